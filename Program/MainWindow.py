@@ -1,11 +1,12 @@
 import os
 from typing import Callable, Any
 
+import numpy as np
 from PIL.Image import Image
 from PySide6 import QtCore
 from PySide6.QtCore import QThreadPool, QEvent, Signal, QTimer, Qt, QPointF
-from PySide6.QtGui import QPixmap, QIcon
-from PySide6.QtWidgets import QMainWindow, QFileDialog, QButtonGroup, QMessageBox, QSlider
+from PySide6.QtGui import QPixmap, QIcon, QImage
+from PySide6.QtWidgets import QMainWindow, QFileDialog, QButtonGroup, QMessageBox, QSlider, QInputDialog
 from matplotlib.backends.backend_qtagg import FigureCanvasQTAgg as FigureCanvas
 from matplotlib.figure import Figure
 from mpl_toolkits.mplot3d import Axes3D
@@ -13,12 +14,31 @@ from mpl_toolkits.mplot3d.art3d import Poly3DCollection
 from stl import Mesh
 
 from Worker import Worker
+from animation_processor import is_animated, create_animation_mosaic
+from color_sweep import ColorsSweep, get_colors_sweep
+from constrained_assignment import InsufficientStockError
 # from cube_mesh_generator import create_many_cube_arrays, save_meshes
-from image_processor import open_image, create_mosaic_from_image_1, create_mosaic_from_image_2, \
-    create_mosaic_from_image_3, create_mosaic_from_image_with_palette_2, create_mosaic_from_image_with_palette_1, \
+from dithering import DITHERING_MODES
+from image_exporter import save_png, save_png_bands, DEFAULT_COMPRESS_LEVEL
+from image_loader import read_image_header, open_preview, open_oriented_image
+from image_processor import create_mosaic_from_image_1, create_mosaic_from_image_2, \
+    create_mosaic_from_image_3, create_mosaic_from_image_4, create_mosaic_from_image_with_palette_2, \
+    create_mosaic_from_image_5, create_mosaic_from_image_with_palette_1, \
     add_grid_to_mosaic, add_numbers_to_mosaic, add_grid_and_numbers_to_mosaic, add_raw_grid_and_numbers_to_mosaic, \
-    get_colors_distribution, colors_palette_from_hex_colors, save_image, save_colors_distribution, rgb_to_hex
+    colors_palette_from_hex_colors, save_colors_distribution, rgb_to_hex, \
+    mosaic_from_index_map, colors_distribution_from_index_map, create_colors_swatch_sheet, build_image_pyramid, \
+    iterate_mosaic_bands, MAX_PALETTE_COLORS
+from memory_budget import band_rows
+from mosaic_error import error_summary, error_heatmap, auto_colors
+from mosaic_profiler import PROFILER_MODES, profile_call, profile_tag, save_profile
+from mosaic_project import save_mosaic_project, load_mosaic_project
+from palette_extractor import dominant_colors
+from parallel import get_threads, set_threads
+from pipeline import MosaicSpec, Pipeline, render_mosaic
+from render_profile import preview_spec
+from print_exporter import save_print_pages, DEFAULT_CELL_SIZE
 from ui_mainwindow import Ui_MainWindow
+from vector_exporter import save_vector_mosaic, DEFAULT_NUMBERS_SCALE
 
 
 class MainWindow(QMainWindow):
@@ -37,6 +57,7 @@ class MainWindow(QMainWindow):
         self.setWindowIcon(icon)
 
         self.mesh_canvas: FigureCanvas | None = None
+        self.colors_sweep_canvas: FigureCanvas | None = None
         self.mesh_plot: Axes3D | None = None
 
         self.setup_radio_button_groups()
@@ -50,6 +71,8 @@ class MainWindow(QMainWindow):
         self.main_thread_signal.connect(self.run)
 
         self.threadpool: QThreadPool = QThreadPool.globalInstance()
+        # задача мозаики одна, тяжёлые этапы внутри неё делятся на полосы между потоками внутреннего пула
+        self.ui.threads_spin_box.setValue(get_threads())
 
         self.mosaic_debounce: QTimer = QTimer()
         self.mosaic_debounce.setInterval(400)
@@ -57,6 +80,13 @@ class MainWindow(QMainWindow):
         # noinspection PyUnresolvedReferences
         self.mosaic_debounce.timeout.connect(self.create_and_show_mosaic)
 
+        # после изменения масштаба предпросмотр перестраивается под новый размер ячеек на экране
+        self.preview_debounce: QTimer = QTimer()
+        self.preview_debounce.setInterval(400)
+        self.preview_debounce.setSingleShot(True)
+        # noinspection PyUnresolvedReferences
+        self.preview_debounce.timeout.connect(self.update_mosaic_preview)
+
         self.mesh_debounce: QTimer = QTimer()
         self.mesh_debounce.setInterval(300)
         self.mesh_debounce.setSingleShot(True)
@@ -64,9 +94,23 @@ class MainWindow(QMainWindow):
         self.mesh_debounce.timeout.connect(self.create_and_show_mesh)
 
         self.imported_image: Image | None = None
+        self.imported_project: dict | None = None
+        self.imported_image_file_name: str | None = None
+        # номер импорта: фоновое декодирование проверяет, что за это время не начался другой импорт (даже того же файла)
+        self.import_generation: int = 0
+        self.imported_image_size: tuple[int, int] | None = None
+        # раскраска и отрисовка мозаик импортированного изображения (None, пока изображение не декодировано)
+        self.pipeline: Pipeline | None = None
         self.mosaic_image: Image | None = None
-        self.mosaic_parameters: dict | None = None
-        self.used_mosaic_parameters: dict | None = None
+        self.mosaic_palette: np.ndarray | None = None
+        self.mosaic_index_map: np.ndarray | None = None
+        # ΔE каждой ячейки относительно усреднённого по ячейке исходного изображения (None для проектов)
+        self.mosaic_delta_e: np.ndarray | None = None
+        self.mosaic_spec: MosaicSpec | None = None
+        self.used_mosaic_spec: MosaicSpec | None = None
+        # спецификация показанного предпросмотра и размеры области показа, по которым он построен
+        self.preview_mosaic_spec: MosaicSpec | None = None
+        self.preview_viewport: tuple[int, int] = (0, 0)
 
         self.mesh: list[Mesh] | None = None
         self.imported_mesh: Mesh | None = None
@@ -141,6 +185,8 @@ class MainWindow(QMainWindow):
         self.ui.colors_count_methods_group.addButton(self.ui.first_colors_count_method_radio_button)
         self.ui.colors_count_methods_group.addButton(self.ui.second_colors_count_method_radio_button)
         self.ui.colors_count_methods_group.addButton(self.ui.third_colors_count_method_radio_button)
+        self.ui.colors_count_methods_group.addButton(self.ui.fourth_colors_count_method_radio_button)
+        self.ui.colors_count_methods_group.addButton(self.ui.fifth_colors_count_method_radio_button)
         self.ui.first_colors_count_method_radio_button.setChecked(True)
 
         self.ui.color_palette_methods_group = QButtonGroup()
@@ -175,10 +221,18 @@ class MainWindow(QMainWindow):
         self.ui.first_colors_count_method_radio_button.toggled.connect(self.create_and_show_mosaic_live)
         self.ui.second_colors_count_method_radio_button.toggled.connect(self.create_and_show_mosaic_live)
         self.ui.third_colors_count_method_radio_button.toggled.connect(self.create_and_show_mosaic_live)
+        self.ui.fourth_colors_count_method_radio_button.toggled.connect(self.create_and_show_mosaic_live)
+        self.ui.fifth_colors_count_method_radio_button.toggled.connect(self.create_and_show_mosaic_live)
+        self.ui.colors_sweep_button.clicked.connect(self.show_colors_sweep)
+        self.ui.auto_colors_button.clicked.connect(self.choose_colors_by_error)
+        self.ui.extract_palette_button.clicked.connect(self.extract_palette_from_image)
 
         self.ui.first_color_palette_method_radio_button.toggled.connect(self.create_and_show_mosaic_live)
         self.ui.second_color_palette_method_radio_button.toggled.connect(self.create_and_show_mosaic_live)
 
+        self.ui.dithering_combo_box.currentIndexChanged.connect(self.create_and_show_mosaic_live)
+        self.ui.palette_subset_spin_box.valueChanged.connect(self.create_and_show_mosaic_live)
+
         self.ui.no_overlay_radio_button.toggled.connect(self.create_and_show_mosaic_live)
         self.ui.grid_radio_button.toggled.connect(self.create_and_show_mosaic_live)
         self.ui.numbers_radio_button.toggled.connect(self.create_and_show_mosaic_live)
@@ -187,6 +241,8 @@ class MainWindow(QMainWindow):
 
         self.ui.numbers_size_slider.valueChanged.connect(self.on_numbers_size_change)
 
+        self.ui.threads_spin_box.valueChanged.connect(set_threads)
+
         self.ui.create_mosaic_live_check_box.toggled.connect(self.on_mosaic_live_check_box)
         self.ui.create_mosaic_button.clicked.connect(self.create_and_show_mosaic)
 
@@ -213,6 +269,8 @@ class MainWindow(QMainWindow):
 
         self.ui.save_mosaic_button.clicked.connect(self.save_mosaic)
         self.ui.save_mosaic_palette_button.clicked.connect(self.save_mosaic_palette)
+        self.ui.save_mosaic_for_print_button.clicked.connect(self.save_mosaic_for_print)
+        self.ui.save_error_heatmap_button.clicked.connect(self.save_error_heatmap)
         # self.ui.save_mosaic_mesh_button.clicked.connect(self.save_mosaic_mesh)
 
     def on_tab_click(self, index: int) -> None:
@@ -238,73 +296,160 @@ class MainWindow(QMainWindow):
     def import_image(self) -> None:
         dialog = QFileDialog(self)
         dialog.setFileMode(QFileDialog.ExistingFile)
-        dialog.setNameFilter("Изображения (*.png *.jpg *.jpeg *.gif *.webp)")
+        dialog.setNameFilters(["Изображения (*.png *.jpg *.jpeg *.gif *.webp)", "Проект мозаики (*.mosaic)"])
         if dialog.exec():
             file_names = dialog.selectedFiles()
             if len(file_names) > 0:
-                try:
-                    self.imported_image = open_image(file_names[0], folder="")
-                except:
-                    self.show_warning("Ошибка", "Выбранный файл не является изображением")
-                    return
-                self.ui.show_imported_image_button.setEnabled(True)
+                self.import_generation += 1
+                if file_names[0].endswith(".mosaic"):
+                    try:
+                        self.imported_project = load_mosaic_project(file_names[0])
+                    except:
+                        self.show_warning("Ошибка", "Выбранный файл не является проектом мозаики")
+                        return
+                    self.imported_image = mosaic_from_index_map(self.imported_project["palette"],
+                                                                self.imported_project["index_map"], 1)
+                    self.imported_image_file_name = None
+                    self.imported_image_size = self.imported_image.size
+                    self.pipeline = Pipeline(self.imported_image)
+                else:
+                    # сначала читается только заголовок: размеры известны сразу, пиксели декодируются в фоне
+                    try:
+                        header = read_image_header(file_names[0])
+                    except:
+                        self.show_warning("Ошибка", "Выбранный файл не является изображением")
+                        return
+                    self.imported_image = None
+                    self.imported_image_file_name = file_names[0]
+                    self.imported_image_size = header["size"]
+                    self.imported_project = None
+                    self.pipeline = None
+                self.used_mosaic_spec = None
+                self.mosaic_index_map = None
                 self.ui.create_mosaic_live_check_box.setChecked(False)
-                self.ui.create_mosaic_live_check_box.setEnabled(True)
-                self.ui.create_mosaic_button.setEnabled(True)
                 self.on_proportions_check_box_change(self.ui.preserving_proportions_check_box.isChecked())
-                self.ui.width_slider.setValue(min(50, self.imported_image.width))
-                self.ui.height_slider.setValue(min(50, self.imported_image.height))
+                is_project = self.imported_project is not None
+                if is_project:
+                    # ячейки проекта уже раскрашены: ползунки только показывают его сетку
+                    height, width = self.imported_project["index_map"].shape
+                    for (slider, label, value) in ((self.ui.width_slider, self.ui.width_slider_value_label, width),
+                                                   (self.ui.height_slider, self.ui.height_slider_value_label, height)):
+                        slider.blockSignals(True)
+                        slider.setMaximum(max(slider.maximum(), value))
+                        slider.setValue(value)
+                        slider.blockSignals(False)
+                        label.setText(str(value))
+                else:
+                    self.ui.width_slider.setValue(min(50, self.imported_image_size[0]))
+                    self.ui.height_slider.setValue(min(50, self.imported_image_size[1]))
+                self.ui.width_slider.setEnabled(not is_project)
+                self.ui.height_slider.setEnabled(not is_project)
+                self.ui.preserving_proportions_check_box.setEnabled(not is_project)
                 self.run_on_main_thread(lambda: self.ui.save_mosaic_button.setEnabled(False))
                 self.run_on_main_thread(lambda: self.ui.save_mosaic_palette_button.setEnabled(False))
+                self.run_on_main_thread(lambda: self.ui.save_mosaic_for_print_button.setEnabled(False))
+                self.run_on_main_thread(lambda: self.ui.save_error_heatmap_button.setEnabled(False))
                 # self.run_on_main_thread(lambda: self.ui.save_mosaic_mesh_button.setEnabled(False))
-                self.show_image(self.imported_image)
+                if self.imported_image is None:
+                    self.set_image_import_finished(False)
+                    file_name = file_names[0]
+                    fast_preview = header["fast_preview"]
+                    generation = self.import_generation
+                    self.run_on_background(lambda: self._internal_import_image(file_name, fast_preview, generation))
+                else:
+                    self.set_image_import_finished(True)
+                    image = self.imported_image
+                    self.run_on_background(lambda: self.show_image(image))
+
+    def _internal_import_image(self, file_name: str, fast_preview: bool, generation: int) -> None:
+        try:
+            # предпросмотр нужен, только если он декодируется быстрее изображения целиком
+            if fast_preview:
+                preview = open_preview(file_name)
+                if generation == self.import_generation:
+                    self.show_image(preview)
+            image = open_oriented_image(file_name)
+        except:
+            self.show_warning("Ошибка", "Выбранный файл не является изображением")
+            return
+        # пока файл декодировался, мог начаться другой импорт
+        if generation != self.import_generation:
+            return
+        self.imported_image = image
+        self.show_image(image)
+        # конвейер публикуется уже с пирамидой: иначе раскраски, закэшированные до её построения,
+        # были бы получены из других ячеек, чем те же раскраски после
+        pipeline = Pipeline(image, build_image_pyramid(image))
+        if generation != self.import_generation:
+            return
+        self.pipeline = pipeline
+        self.run_on_main_thread(lambda: self.set_image_import_finished(True))
+
+    def set_image_import_finished(self, finished: bool) -> None:
+        self.ui.show_imported_image_button.setEnabled(finished)
+        self.ui.create_mosaic_live_check_box.setEnabled(finished)
+        self.ui.create_mosaic_button.setEnabled(finished)
+        self.ui.colors_sweep_button.setEnabled(finished and self.imported_project is None)
+        self.ui.auto_colors_button.setEnabled(finished and self.imported_project is None)
 
     def show_imported_image(self) -> None:
-        self.show_image(self.imported_image)
-        self.used_mosaic_parameters = None
+        image = self.imported_image
+        self.run_on_background(lambda: self.show_image(image))
+        self.used_mosaic_spec = None
         self.ui.create_mosaic_live_check_box.setChecked(False)
         self.run_on_main_thread(lambda: self.ui.save_mosaic_button.setEnabled(False))
         self.run_on_main_thread(lambda: self.ui.save_mosaic_palette_button.setEnabled(False))
+        self.run_on_main_thread(lambda: self.ui.save_mosaic_for_print_button.setEnabled(False))
+        self.run_on_main_thread(lambda: self.ui.save_error_heatmap_button.setEnabled(False))
         # self.run_on_main_thread(lambda: self.ui.save_mosaic_mesh_button.setEnabled(False))
 
-    def show_image(self, image: Image) -> None:
+    def show_image(self, image: Image, keep_scale: bool = False) -> None:
+        # QImage создаётся в вызывающем (обычно фоновом) потоке, в главном потоке из него получается QPixmap
+        qimage = image.toqimage()
+        self.run_on_main_thread(lambda: self.internal_show_image(qimage, keep_scale))
+
+    def internal_show_image(self, qimage: QImage, keep_scale: bool = False) -> None:
+        self.current_image = QPixmap.fromImage(qimage)
+        if keep_scale and self.original_image_viewport_width is not None:
+            # то же изображение в другом разрешении: размер на экране и масштаб не меняются
+            self.ui.image_label.setPixmap(
+                self.current_image.scaled(self.image_scale_factor * self.original_image_viewport_width,
+                                          self.image_scale_factor * self.original_image_viewport_height,
+                                          QtCore.Qt.KeepAspectRatio))
+            return
         self.image_scale_factor = 1.0
-        self.current_image = image.toqpixmap()
-        self.run_on_main_thread(lambda: self.internal_show_image(image))
-
-    def internal_show_image(self, image: Image) -> None:
         self.ui.image_label.clear()
-        self.original_image_viewport_width = min(self.ui.image_scroll_area.width(), image.width)
-        self.original_image_viewport_height = min(self.ui.image_scroll_area.height(), image.height)
+        self.original_image_viewport_width = min(self.ui.image_scroll_area.width(), self.current_image.width())
+        self.original_image_viewport_height = min(self.ui.image_scroll_area.height(), self.current_image.height())
         self.ui.image_label.setPixmap(
-            image.toqpixmap().scaled(self.original_image_viewport_width, self.original_image_viewport_height,
-                                     QtCore.Qt.KeepAspectRatio))
+            self.current_image.scaled(self.original_image_viewport_width, self.original_image_viewport_height,
+                                      QtCore.Qt.KeepAspectRatio))
 
     def on_proportions_check_box_change(self, value: bool) -> None:
-        if self.imported_image is None:
+        if self.imported_image_size is None:
             return
 
         if value:
-            proportions = self.imported_image.width / self.imported_image.height
-            if self.imported_image.width > self.imported_image.height:
-                width = min(200, int(self.imported_image.width * proportions))
-                height = int(min(200 / proportions, self.imported_image.height / proportions))
+            proportions = self.imported_image_size[0] / self.imported_image_size[1]
+            if self.imported_image_size[0] > self.imported_image_size[1]:
+                width = min(200, int(self.imported_image_size[0] * proportions))
+                height = int(min(200 / proportions, self.imported_image_size[1] / proportions))
             else:
-                width = int(min(200 * proportions, self.imported_image.width * proportions))
-                height = min(200, int(self.imported_image.height / proportions))
+                width = int(min(200 * proportions, self.imported_image_size[0] * proportions))
+                height = min(200, int(self.imported_image_size[1] / proportions))
 
             self.ui.width_slider.setMaximum(width)
             self.ui.height_slider.setMaximum(height)
             self.on_width_change(self.ui.width_slider.value())
         else:
-            self.ui.width_slider.setMaximum(min(200, self.imported_image.width))
-            self.ui.height_slider.setMaximum(min(200, self.imported_image.height))
+            self.ui.width_slider.setMaximum(min(200, self.imported_image_size[0]))
+            self.ui.height_slider.setMaximum(min(200, self.imported_image_size[1]))
 
     def on_width_change(self, value: int) -> None:
         self.ui.width_slider_value_label.setText(str(value))
         if self.ui.preserving_proportions_check_box.isChecked():
             self.ui.height_slider.blockSignals(True)
-            height_value = max(1, int(value / (self.imported_image.width / self.imported_image.height)))
+            height_value = max(1, int(value / (self.imported_image_size[0] / self.imported_image_size[1])))
             self.ui.height_slider.setValue(height_value)
             self.ui.height_slider_value_label.setText(str(height_value))
             self.ui.height_slider.blockSignals(False)
@@ -314,7 +459,7 @@ class MainWindow(QMainWindow):
         self.ui.height_slider_value_label.setText(str(value))
         if self.ui.preserving_proportions_check_box.isChecked():
             self.ui.width_slider.blockSignals(True)
-            width_value = max(1, int(value * (self.imported_image.width / self.imported_image.height)))
+            width_value = max(1, int(value * (self.imported_image_size[0] / self.imported_image_size[1])))
             self.ui.width_slider.setValue(width_value)
             self.ui.width_slider_value_label.setText(str(width_value))
             self.ui.width_slider.blockSignals(False)
@@ -332,6 +477,99 @@ class MainWindow(QMainWindow):
         self.ui.numbers_size_slider_value_label.setText(str(value))
         self.create_and_show_mosaic_live()
 
+    def show_colors_sweep(self) -> None:
+        width, height = self.ui.width_slider.value(), self.ui.height_slider.value()
+        self.run_on_background(lambda: self._internal_show_colors_sweep(width, height))
+
+    def _internal_show_colors_sweep(self, width: int, height: int) -> None:
+        self.disable_all_ui()
+        # те же ячейки, что и у способа №5, поэтому после просмотра кривой он берёт разбиение из кэша
+        sweep = get_colors_sweep(self.pipeline.cells(width, height))
+        self.run_on_main_thread(lambda: self.show_colors_sweep_plot(sweep))
+        self.enable_all_ui()
+
+    def choose_colors_by_error(self) -> None:
+        target, accepted = QInputDialog.getDouble(self, "Подбор по допустимой ошибке",
+                                                  "Допустимое среднее отклонение ΔE", 5.0, 0.5, 50.0, 1)
+        if accepted:
+            width, height = self.ui.width_slider.value(), self.ui.height_slider.value()
+            self.run_on_background(lambda: self._internal_choose_colors_by_error(width, height, target))
+
+    def _internal_choose_colors_by_error(self, width: int, height: int, target: float) -> None:
+        self.disable_all_ui()
+        # кандидаты берутся из того же кэшированного разбиения, что и у способа №5
+        colors, delta_e = auto_colors(self.pipeline.cells(width, height), target,
+                                      self.ui.colors_count_slider.minimum(), self.ui.colors_count_slider.maximum())
+        self.run_on_main_thread(lambda: self.set_chosen_colors(colors, delta_e, target))
+        self.enable_all_ui()
+
+    def set_chosen_colors(self, colors: int, delta_e: float, target: float) -> None:
+        self.ui.colors_count_slider.setValue(colors)
+        self.ui.fifth_colors_count_method_radio_button.setChecked(True)
+        if delta_e > target:
+            self.statusBar().showMessage(f"Допустимое отклонение не достигнуто: {colors} цветов, ΔE {delta_e:.1f}")
+        else:
+            self.statusBar().showMessage(f"Подобрано {colors} цветов, среднее отклонение ΔE {delta_e:.1f}")
+
+    def show_colors_sweep_plot(self, sweep: ColorsSweep) -> None:
+        """
+        Quantization error curve over the colors count, a click on the curve sets the colors count
+
+        """
+        if sweep.max_colors <= self.ui.colors_count_slider.minimum():
+            # кривой нет: в ячейках не больше цветов, чем наименьшее количество цветов мозаики
+            self.statusBar().showMessage(f"Различных цветов в ячейках: {sweep.max_colors}, подбирать нечего")
+            return
+        counts = np.arange(self.ui.colors_count_slider.minimum(),
+                           min(sweep.max_colors, self.ui.colors_count_slider.maximum()) + 1)
+        suggested_colors = sweep.suggested_colors(self.ui.colors_count_slider.minimum())
+
+        self.colors_sweep_canvas = FigureCanvas(Figure(figsize=(7, 4)))
+        plot = self.colors_sweep_canvas.figure.add_subplot()
+        plot.plot(counts, sweep.errors[counts])
+        plot.axvline(suggested_colors, linestyle="--", color="gray")
+        plot.axvline(self.ui.colors_count_slider.value(), color="red")
+        plot.set_yscale("log")
+        plot.set_xlabel("Количество цветов")
+        plot.set_ylabel("Среднеквадратичная ошибка")
+        plot.set_title(f"Рекомендуемое количество цветов: {suggested_colors}")
+        self.colors_sweep_canvas.figure.tight_layout()
+        self.colors_sweep_canvas.mpl_connect("button_press_event", self.on_colors_sweep_plot_click)
+        self.colors_sweep_canvas.setWindowTitle("Подбор количества цветов")
+        self.colors_sweep_canvas.setWindowIcon(self.windowIcon())
+        self.colors_sweep_canvas.show()
+
+    def on_colors_sweep_plot_click(self, event: Any) -> None:
+        if event.xdata is not None:
+            self.ui.colors_count_slider.setValue(round(event.xdata))
+            self.ui.fifth_colors_count_method_radio_button.setChecked(True)
+            line = self.colors_sweep_canvas.figure.axes[0].lines[-1]
+            line.set_xdata([self.ui.colors_count_slider.value()] * 2)
+            self.colors_sweep_canvas.draw_idle()
+
+    def extract_palette_from_image(self) -> None:
+        dialog = QFileDialog(self)
+        dialog.setFileMode(QFileDialog.ExistingFile)
+        dialog.setNameFilters(["Изображения (*.png *.jpg *.jpeg *.gif *.webp)"])
+        if dialog.exec():
+            file_names = dialog.selectedFiles()
+            if len(file_names) > 0:
+                colors, accepted = QInputDialog.getInt(self, "Цвета из изображения", "Количество цветов", 8, 2,
+                                                 MAX_PALETTE_COLORS)
+                if accepted:
+                    self.run_on_background(lambda: self._internal_extract_palette_from_image(file_names[0], colors))
+
+    def _internal_extract_palette_from_image(self, filename: str, colors: int) -> None:
+        try:
+            self.disable_all_ui()
+            palette = dominant_colors(open_oriented_image(filename), colors)
+            text = "\n".join("#" + rgb_to_hex(color) for color in palette)
+            self.run_on_main_thread(lambda: self.ui.colors_palette_edit.setPlainText(text))
+        except:
+            self.show_warning("Ошибка", "Выбранный файл не является изображением")
+        finally:
+            self.enable_all_ui()
+
     def show_colors_count_settings(self) -> None:
         self.ui.coloring_method_stacked_widget.setCurrentIndex(0)
 
@@ -340,12 +578,15 @@ class MainWindow(QMainWindow):
         self.ui.create_mosaic_live_check_box.setChecked(False)
 
     # noinspection PyTypedDict
-    def get_mosaic_parameters(self) -> dict[str, Any | None] | None:
+    def get_mosaic_spec(self) -> MosaicSpec | None:
         parameters = {"width": self.ui.width_slider.value(), "height": self.ui.height_slider.value(),
                       "multiplier": self.ui.multiplier_slider.value(), "colors": None, "coloring_function": None,
-                      "overlay_function": None, "numbers_size": None}
+                      "overlay_function": None, "numbers_size": None, "dithering": None, "palette_subset": None,
+                      "stock": None}
 
-        if self.ui.colors_count_method_radio_button.isChecked():
+        if self.imported_project is not None:
+            parameters.update(self.get_project_coloring_parameters())
+        elif self.ui.colors_count_method_radio_button.isChecked():
             parameters["colors"] = self.ui.colors_count_slider.value()
             if self.ui.first_colors_count_method_radio_button.isChecked():
                 parameters["coloring_function"] = create_mosaic_from_image_1
@@ -353,6 +594,10 @@ class MainWindow(QMainWindow):
                 parameters["coloring_function"] = create_mosaic_from_image_2
             elif self.ui.third_colors_count_method_radio_button.isChecked():
                 parameters["coloring_function"] = create_mosaic_from_image_3
+            elif self.ui.fourth_colors_count_method_radio_button.isChecked():
+                parameters["coloring_function"] = create_mosaic_from_image_4
+            elif self.ui.fifth_colors_count_method_radio_button.isChecked():
+                parameters["coloring_function"] = create_mosaic_from_image_5
         elif self.ui.color_palette_method_radio_button.isChecked():
             colors_text = self.ui.colors_palette_edit.toPlainText()
             color_lines = [color_line.strip() for color_line in colors_text.split("#") if
@@ -360,19 +605,35 @@ class MainWindow(QMainWindow):
 
             try:
                 parameters["colors"] = colors_palette_from_hex_colors(color_lines)
+                # после цвета может быть указан запас, цвет без запаса не ограничен
+                stock = [int(color_line.split()[1]) if len(color_line.split()) > 1 else None
+                         for color_line in color_lines]
             except:
                 self.show_warning("Ошибка", "Некорректный ввод цветов")
                 return None
 
+            if any(count is not None for count in stock):
+                cells = parameters["width"] * parameters["height"]
+                parameters["stock"] = [cells if count is None else max(0, count) for count in stock]
+                if sum(parameters["stock"]) < cells:
+                    self.show_warning("Ошибка", "Запаса цветов недостаточно для всех ячеек")
+                    return None
+
             if len(parameters["colors"]) < 2:
                 self.show_warning("Ошибка", "Недостаточное количество цветов")
                 return None
 
+            if 0 < self.ui.palette_subset_spin_box.value() < len(parameters["colors"]):
+                parameters["palette_subset"] = self.ui.palette_subset_spin_box.value()
+
             if self.ui.first_color_palette_method_radio_button.isChecked():
                 parameters["coloring_function"] = create_mosaic_from_image_with_palette_1
             elif self.ui.second_color_palette_method_radio_button.isChecked():
                 parameters["coloring_function"] = create_mosaic_from_image_with_palette_2
 
+        if self.imported_project is None and self.ui.dithering_combo_box.currentIndex() > 0:
+            parameters["dithering"] = DITHERING_MODES[self.ui.dithering_combo_box.currentIndex() - 1]
+
         if self.ui.no_overlay_radio_button.isChecked():
             parameters["overlay_function"] = None
             parameters["numbers_size"] = None
@@ -389,6 +650,27 @@ class MainWindow(QMainWindow):
             parameters["overlay_function"] = add_raw_grid_and_numbers_to_mosaic
             parameters["numbers_size"] = self.ui.numbers_size_slider.value()
 
+        return MosaicSpec.from_parameters(parameters)
+
+    def get_project_coloring_parameters(self) -> dict[str, Any]:
+        """
+        Grid and coloring of the imported project for the spec: the cells of the project are colored already,
+        so the sliders and the coloring settings do not apply; projects without a valid saved coloring
+        are described as colored by their own palette
+
+        """
+        saved = self.imported_project["parameters"]
+        height, width = self.imported_project["index_map"].shape
+        parameters = {"width": width, "height": height,
+                      "coloring_function": saved.get("coloring", saved.get("coloring_function")),
+                      "colors": saved.get("colors"), "dithering": saved.get("dithering"),
+                      "palette_subset": saved.get("palette_subset"), "stock": saved.get("stock")}
+        try:
+            MosaicSpec.from_parameters({**parameters, "multiplier": 1})
+        except (KeyError, TypeError, ValueError):
+            parameters.update({"coloring_function": create_mosaic_from_image_with_palette_1,
+                               "colors": self.imported_project["palette"].tolist(), "dithering": None,
+                               "palette_subset": None, "stock": None})
         return parameters
 
     def show_warning(self, title: str, text: str) -> None:
@@ -401,33 +683,99 @@ class MainWindow(QMainWindow):
         message_box.setIcon(QMessageBox.Warning)
         message_box.exec()
 
-    @staticmethod
-    def create_mosaic(image: Image, parameters: dict[str, Any]) -> Image:
-        mosaic = parameters["coloring_function"](image, parameters["colors"], parameters["width"], parameters["height"],
-                                                 parameters["multiplier"])
-        colors_distribution = get_colors_distribution(mosaic, parameters["multiplier"])
-        if parameters["overlay_function"] is not None:
-            return parameters["overlay_function"](mosaic, colors_distribution, parameters["multiplier"],
-                                                  numbers_size=parameters["numbers_size"])
-        else:
-            return mosaic
-
     def create_and_show_mosaic(self) -> None:
-        self.mosaic_parameters = self.get_mosaic_parameters()
+        self.mosaic_spec = self.get_mosaic_spec()
+        self.preview_viewport = (self.ui.image_scroll_area.width(), self.ui.image_scroll_area.height())
         self.run_on_background(lambda: self._internal_create_and_show_mosaic())
 
+    def color_cells(self, spec: MosaicSpec) -> tuple[np.ndarray, np.ndarray, np.ndarray | None]:
+        """
+        Palette, index map and per cell errors of the mosaic, the pipeline colors the cells again only if
+        the coloring part of the spec changed (the multiplier and the overlay do not change the colors);
+        the state of the window is not changed
+
+        """
+        if self.imported_project is not None:
+            # у проекта ячейки уже раскрашены, меняются только множитель и наложение
+            return self.imported_project["palette"], self.imported_project["index_map"], None
+        palette, index_map = self.pipeline.color(spec)
+        if index_map is self.mosaic_index_map and self.mosaic_delta_e is not None:
+            return palette, index_map, self.mosaic_delta_e
+        return palette, index_map, self.pipeline.delta_e(spec)
+
     def _internal_create_and_show_mosaic(self) -> None:
-        if self.mosaic_parameters is not None:
-            if self.used_mosaic_parameters != self.mosaic_parameters:
+        if self.mosaic_spec is not None:
+            if self.used_mosaic_spec != self.mosaic_spec:
                 self.disable_all_ui()
-                self.mosaic_image = self.create_mosaic(self.imported_image, self.mosaic_parameters)
-                self.used_mosaic_parameters = self.mosaic_parameters
+                spec = preview_spec(self.mosaic_spec, *self.preview_viewport)
+                if spec is None:
+                    self.show_warning("Ошибка", "Недостаточно памяти для построения мозаики")
+                    self.enable_all_ui()
+                    return
+                # при ошибке раскраски или отрисовки остаётся предыдущая мозаика целиком
+                try:
+                    palette, index_map, delta_e = self.color_cells(self.mosaic_spec)
+                    mosaic_image = render_mosaic(palette, index_map, spec)
+                except MemoryError:
+                    self.show_warning("Ошибка", "Недостаточно памяти для построения мозаики")
+                    self.enable_all_ui()
+                    return
+                except InsufficientStockError:
+                    # запаса выбранных из палитры цветов может не хватить на все ячейки
+                    self.show_warning("Ошибка", "Запаса цветов недостаточно для всех ячеек")
+                    self.enable_all_ui()
+                    return
+                self.mosaic_palette, self.mosaic_index_map, self.mosaic_delta_e = palette, index_map, delta_e
+                self.mosaic_image = mosaic_image
+                self.used_mosaic_spec = self.mosaic_spec
+                self.preview_mosaic_spec = spec
                 self.show_image(self.mosaic_image)
+                self.show_mosaic_status()
                 self.run_on_main_thread(lambda: self.ui.save_mosaic_button.setEnabled(True))
                 self.run_on_main_thread(lambda: self.ui.save_mosaic_palette_button.setEnabled(True))
+                self.run_on_main_thread(lambda: self.ui.save_mosaic_for_print_button.setEnabled(True))
+                has_delta_e = self.mosaic_delta_e is not None
+                self.run_on_main_thread(lambda: self.ui.save_error_heatmap_button.setEnabled(has_delta_e))
                 # self.run_on_main_thread(lambda: self.ui.save_mosaic_mesh_button.setEnabled(True))
                 self.enable_all_ui()
 
+    def show_mosaic_status(self) -> None:
+        messages = []
+        if self.mosaic_delta_e is not None:
+            summary = error_summary(self.mosaic_delta_e)
+            messages.append(f"Отклонение от изображения ΔE: среднее {summary['mean']:.1f}, "
+                            f"95% ячеек до {summary['p95']:.1f}, максимум {summary['max']:.1f}, "
+                            f"заметно в {summary['noticeable']:.0%} ячеек")
+        if self.preview_mosaic_spec is not self.used_mosaic_spec:
+            messages.append(f"предпросмотр с множителем {self.preview_mosaic_spec.multiplier} "
+                            f"из {self.used_mosaic_spec.multiplier}, "
+                            f"при сохранении мозаика будет построена полностью")
+        message = "; ".join(messages)
+        self.run_on_main_thread(lambda: self.statusBar().showMessage(message))
+
+    def update_mosaic_preview(self) -> None:
+        if self.used_mosaic_spec is None or self.preview_mosaic_spec is None:
+            return
+        self.preview_viewport = (self.ui.image_scroll_area.width(), self.ui.image_scroll_area.height())
+        used_spec = self.used_mosaic_spec
+        spec = preview_spec(used_spec, *self.preview_viewport, self.image_scale_factor)
+        if spec is not None and spec != self.preview_mosaic_spec:
+            self.run_on_background(lambda: self._internal_update_mosaic_preview(used_spec, spec))
+
+    def _internal_update_mosaic_preview(self, used_spec: MosaicSpec, spec: MosaicSpec) -> None:
+        # раскраска уже есть, перестраивается только изображение предпросмотра
+        try:
+            mosaic_image = render_mosaic(self.mosaic_palette, self.mosaic_index_map, spec)
+        except MemoryError:
+            return
+        # пока предпросмотр строился, могла быть построена другая мозаика
+        if used_spec is not self.used_mosaic_spec:
+            return
+        self.mosaic_image = mosaic_image
+        self.preview_mosaic_spec = spec
+        self.show_image(mosaic_image, keep_scale=True)
+        self.show_mosaic_status()
+
     def enable_all_ui(self) -> None:
         self.run_on_main_thread(lambda: self.ui.image_scroll_area.setAttribute(Qt.WA_TransparentForMouseEvents, False))
         self.run_on_main_thread(lambda: self.ui.configuration_tab_widget.setEnabled(True))
@@ -456,6 +804,7 @@ class MainWindow(QMainWindow):
             return
 
         self.run_on_background(lambda: self.internal_scale_image(factor, relative_cursor_position))
+        self.preview_debounce.start()
 
     def internal_scale_image(self, factor: float, relative_cursor_position: QPointF) -> None:
         scaled_image = self.current_image.scaled(self.image_scale_factor * self.original_image_viewport_width,
@@ -662,30 +1011,200 @@ class MainWindow(QMainWindow):
         dialog = QFileDialog(self)
         dialog.setFileMode(QFileDialog.AnyFile)
         dialog.setAcceptMode(QFileDialog.AcceptSave)
-        dialog.setNameFilter("Изображение (*.png)")
+        name_filters = ["Изображение (*.png)", "Векторное изображение (*.svg *.pdf)", "Проект мозаики (*.mosaic)"]
+        if self.imported_image_file_name is not None and is_animated(self.imported_image_file_name):
+            name_filters.append("Анимация (*.gif *.webp)")
+        dialog.setNameFilters(name_filters)
         if dialog.exec():
             file_names = dialog.selectedFiles()
             if len(file_names) > 0:
-                try:
-                    save_image(self.current_image, file_names[0], folder="")
-                except:
-                    self.show_warning("Ошибка", "Ошибка сохранения мозаики")
+                if dialog.selectedNameFilter().endswith("(*.mosaic)"):
+                    self.run_on_background(lambda: self._internal_save_mosaic_project(file_names[0]))
+                elif dialog.selectedNameFilter().endswith("(*.svg *.pdf)"):
+                    self.run_on_background(lambda: self._internal_save_mosaic_vector(file_names[0]))
+                elif dialog.selectedNameFilter().endswith("(*.gif *.webp)"):
+                    self.run_on_background(lambda: self._internal_save_mosaic_animation(file_names[0]))
+                else:
+                    profiler_mode = None
+                    if self.ui.profiler_combo_box.currentIndex() > 0:
+                        profiler_mode = PROFILER_MODES[self.ui.profiler_combo_box.currentIndex() - 1]
+                    compress_level = self.ui.compress_level_spin_box.value()
+                    self.run_on_background(lambda: self._internal_save_mosaic(file_names[0], compress_level,
+                                                                              profiler_mode))
+
+    def _internal_save_mosaic(self, filename: str, compress_level: int = DEFAULT_COMPRESS_LEVEL,
+                              profiler_mode: str | None = None) -> None:
+        if not filename.endswith(".png"):
+            filename += ".png"
+        spec = self.used_mosaic_spec
+        profile_names = []
+        try:
+            self.disable_all_ui()
+            if profiler_mode is None:
+                self.export_mosaic(filename, spec, compress_level)
+            else:
+                _, stacks = profile_call(lambda: self.export_mosaic(filename, spec, compress_level, profiling=True),
+                                         profiler_mode)
+                profile_names = save_profile(filename, stacks, profile_tag(self.imported_image_size, spec))
+        except:
+            self.show_warning("Ошибка", "Ошибка сохранения мозаики")
+        finally:
+            self.run_on_main_thread(lambda: self.statusBar().clearMessage())
+            self.enable_all_ui()
+        if len(profile_names) > 0:
+            message = f"Профиль сохранён: {', '.join(profile_names)}"
+            self.run_on_main_thread(lambda: self.statusBar().showMessage(message))
+
+    def export_mosaic(self, filename: str, spec: MosaicSpec, compress_level: int = DEFAULT_COMPRESS_LEVEL,
+                      profiling: bool = False) -> None:
+        """
+        Saving the mosaic to PNG; when profiling, the whole run gets into the profile: the cells are colored again
+        by a separate pipeline without cache (the shown coloring is saved) and the mosaic is rendered again
+
+        """
+        if profiling and self.imported_project is None:
+            Pipeline(self.imported_image, self.pipeline.pyramid).color(spec)
+        if self.preview_mosaic_spec is spec and not profiling:
+            save_png(self.mosaic_image, filename, compress_level, palette=self.mosaic_palette,
+                     progress=self.show_export_progress)
+        else:
+            # показан предпросмотр, мозаика в полном размере строится из раскрашенных ячеек и сжимается полосами
+            rows = band_rows(spec.width, spec.height, spec.multiplier, spec.overlay is not None)
+            bands = iterate_mosaic_bands(self.mosaic_palette, self.mosaic_index_map, spec.multiplier,
+                                         spec.overlay_function, spec.numbers_size, rows)
+            save_png_bands(bands, filename, spec.width * spec.multiplier, spec.height * spec.multiplier,
+                           compress_level, progress=self.show_export_progress)
+
+    def _internal_save_mosaic_vector(self, filename: str) -> None:
+        if not filename.endswith((".svg", ".pdf")):
+            filename += ".svg"
+        spec = self.used_mosaic_spec
+        numbers_scale = DEFAULT_NUMBERS_SCALE
+        if spec.numbers_size is not None:
+            numbers_scale = spec.numbers_size / spec.multiplier
+        try:
+            self.disable_all_ui()
+            save_vector_mosaic(filename, self.mosaic_palette, self.mosaic_index_map, spec.overlay_function,
+                               numbers_scale=numbers_scale)
+        except:
+            self.show_warning("Ошибка", "Ошибка сохранения векторной мозаики")
+        finally:
+            self.enable_all_ui()
+
+    def _internal_save_mosaic_animation(self, filename: str) -> None:
+        if not filename.endswith((".gif", ".webp")):
+            filename += ".gif"
+        spec = self.used_mosaic_spec
+        try:
+            self.disable_all_ui()
+            create_animation_mosaic(self.imported_image_file_name, filename, spec, progress=self.show_export_progress)
+        except MemoryError:
+            # WebP сохраняется только после построения всех кадров
+            self.show_warning("Ошибка", "Недостаточно памяти для сохранения анимации, сохраните её в GIF")
+        except:
+            self.show_warning("Ошибка", "Ошибка сохранения анимации")
+        finally:
+            self.run_on_main_thread(lambda: self.statusBar().clearMessage())
+            self.enable_all_ui()
+
+    def show_export_progress(self, done: int, total: int) -> None:
+        self.run_on_main_thread(lambda: self.statusBar().showMessage(f"Сохранение: {done * 100 // total}%"))
+
+    def _internal_save_mosaic_project(self, filename: str) -> None:
+        if not filename.endswith(".mosaic"):
+            filename += ".mosaic"
+        try:
+            self.disable_all_ui()
+            save_mosaic_project(filename, self.mosaic_palette, self.mosaic_index_map,
+                                self.used_mosaic_spec.to_dict())
+        except:
+            self.show_warning("Ошибка", "Ошибка сохранения проекта мозаики")
+        finally:
+            self.enable_all_ui()
+
+    def save_mosaic_for_print(self) -> None:
+        page_formats = {"A4, книжная": ("A4", False), "A4, альбомная": ("A4", True),
+                        "A3, книжная": ("A3", False), "A3, альбомная": ("A3", True)}
+        page_format, accepted = QInputDialog.getItem(self, "Печать по листам", "Формат листа", list(page_formats),
+                                                     editable=False)
+        if not accepted:
+            return
+        cell_size, accepted = QInputDialog.getDouble(self, "Печать по листам", "Размер ячейки (мм)",
+                                                     DEFAULT_CELL_SIZE, 2.0, 100.0, 1)
+        if not accepted:
+            return
+
+        dialog = QFileDialog(self)
+        dialog.setFileMode(QFileDialog.AnyFile)
+        dialog.setAcceptMode(QFileDialog.AcceptSave)
+        dialog.setNameFilters(["Документ PDF (*.pdf)", "Изображения по листам (*.png)"])
+        if dialog.exec():
+            file_names = dialog.selectedFiles()
+            if len(file_names) > 0:
+                file_format = dialog.selectedNameFilter().split("*.")[-1].rstrip(")")
+                page_size, landscape = page_formats[page_format]
+                self.run_on_background(lambda: self._internal_save_mosaic_for_print(
+                    file_names[0], file_format, page_size, landscape, cell_size))
+
+    def _internal_save_mosaic_for_print(self, filename: str, file_format: str, page_size: str, landscape: bool,
+                                        cell_size: float) -> None:
+        if not filename.endswith("." + file_format):
+            filename += "." + file_format
+        try:
+            self.disable_all_ui()
+            save_print_pages(filename, self.mosaic_palette, self.mosaic_index_map, page_size, landscape, cell_size,
+                             progress=self.show_export_progress)
+        except ValueError:
+            self.show_warning("Ошибка", "Ячейка слишком большая для выбранного формата листа")
+        except:
+            self.show_warning("Ошибка", "Ошибка сохранения мозаики для печати")
+        finally:
+            self.run_on_main_thread(lambda: self.statusBar().clearMessage())
+            self.enable_all_ui()
+
+    def save_error_heatmap(self) -> None:
+        dialog = QFileDialog(self)
+        dialog.setFileMode(QFileDialog.AnyFile)
+        dialog.setAcceptMode(QFileDialog.AcceptSave)
+        dialog.setNameFilters(["Изображение (*.png)"])
+        if dialog.exec():
+            file_names = dialog.selectedFiles()
+            if len(file_names) > 0:
+                self.run_on_background(lambda: self._internal_save_error_heatmap(file_names[0]))
+
+    def _internal_save_error_heatmap(self, filename: str) -> None:
+        if not filename.endswith(".png"):
+            filename += ".png"
+        try:
+            self.disable_all_ui()
+            error_heatmap(self.mosaic_delta_e, self.used_mosaic_spec.multiplier).save(filename)
+        except:
+            self.show_warning("Ошибка", "Ошибка сохранения карты ошибок")
+        finally:
+            self.enable_all_ui()
 
     def save_mosaic_palette(self) -> None:
         dialog = QFileDialog(self)
         dialog.setFileMode(QFileDialog.AnyFile)
         dialog.setAcceptMode(QFileDialog.AcceptSave)
-        dialog.setNameFilter("Текстовый файл (*.txt)")
+        dialog.setNameFilters(["Текстовый файл (*.txt)", "Таблица CSV (*.csv)", "Файл JSON (*.json)",
+                               "Лист образцов цветов (*.png)"])
         if dialog.exec():
             file_names = dialog.selectedFiles()
             if len(file_names) > 0:
-                self.run_on_background(lambda: self._internal_save_mosaic_palette(file_names[0]))
+                file_format = dialog.selectedNameFilter().split("*.")[-1].rstrip(")")
+                self.run_on_background(lambda: self._internal_save_mosaic_palette(file_names[0], file_format))
 
-    def _internal_save_mosaic_palette(self, filename: str) -> None:
+    def _internal_save_mosaic_palette(self, filename: str, file_format: str = "txt") -> None:
+        if not filename.endswith("." + file_format):
+            filename += "." + file_format
         try:
             self.disable_all_ui()
-            colors_distribution = get_colors_distribution(self.mosaic_image, self.used_mosaic_parameters["multiplier"])
-            save_colors_distribution(filename, colors_distribution, folder="")
+            colors_distribution = colors_distribution_from_index_map(self.mosaic_palette, self.mosaic_index_map)
+            if file_format == "png":
+                create_colors_swatch_sheet(colors_distribution).save(filename)
+            else:
+                save_colors_distribution(filename, colors_distribution, folder="", file_format=file_format)
         except:
             self.show_warning("Ошибка", "Ошибка сохранения палитры цветов")
         finally:
@@ -0,0 +1,241 @@
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Callable, Iterator
+
+import numpy as np
+from PIL import Image, ImageSequence, GifImagePlugin
+from PIL.Image import BOX, ADAPTIVE
+
+from color_space import nearest_palette_indexes
+from dithering import dither_cells
+from image_processor import PALETTE_COLORING_FUNCTIONS, mosaic_from_index_map, index_map_from_mosaic, \
+    colors_distribution_from_index_map
+from memory_budget import estimate_mosaic_memory, memory_budget
+from pipeline import MosaicSpec
+
+# кадры, по которым подбирается палитра всего ролика
+PALETTE_SAMPLE_FRAMES = 16
+# ячейка считается неизменной, если её средний цвет сдвинулся меньше порога (по каждому каналу)
+DEFAULT_CHANGE_THRESHOLD = 4
+# сколько кадров на поток может одновременно ждать обработки или записи
+PENDING_FRAMES_PER_WORKER = 2
+
+ProgressCallback = Callable[[int, int], None]
+
+
+def is_animated(full_image_name: str) -> bool:
+    with Image.open(full_image_name) as image:
+        return getattr(image, "is_animated", False)
+
+
+def iterate_frames(full_image_name: str) -> Iterator[tuple[Image, int]]:
+    """
+    Frames of an animated GIF/WebP in RGB with their durations in milliseconds, decoded one at a time
+
+    """
+    with Image.open(full_image_name) as image:
+        for frame in ImageSequence.Iterator(image):
+            yield frame.convert("RGB"), frame.info.get("duration", image.info.get("duration", 100))
+
+
+def _bounded_map(executor: ThreadPoolExecutor, function: Callable, items: Iterator, limit: int) -> Iterator:
+    # результаты function(item) по порядку, в работе не больше limit элементов: кадры не копятся в памяти
+    pending: deque[Future] = deque()
+    for item in items:
+        pending.append(executor.submit(function, item))
+        if len(pending) > limit:
+            yield pending.popleft().result()
+    while len(pending) > 0:
+        yield pending.popleft().result()
+
+
+def reduce_frames(full_image_name: str, width: int, height: int,
+                  workers: int | None = None) -> tuple[list[np.ndarray], list[int]]:
+    """
+    Cells (height, width, 3) of every frame and the durations of frames: frames are decoded one at a time
+    and reduced in parallel, only a few full size frames are kept in memory
+
+    """
+    workers = workers or os.cpu_count() or 1
+    durations = []
+
+    def frames() -> Iterator[Image]:
+        for (frame, duration) in iterate_frames(full_image_name):
+            durations.append(duration)
+            yield frame
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        cells_frames = list(_bounded_map(
+            executor, lambda frame: np.asarray(frame.resize((width, height), resample=BOX)), frames(),
+            PENDING_FRAMES_PER_WORKER * workers))
+    return cells_frames, durations
+
+
+def fit_clip_palette(cells_frames: list[np.ndarray], spec: MosaicSpec) -> np.ndarray:
+    """
+    One palette (k, 3) for the whole clip: palette colorings use the palette of the spec, other colorings
+    color the cells of sampled frames together by the coloring function of the spec
+
+    """
+    if spec.coloring_function in PALETTE_COLORING_FUNCTIONS:
+        return np.asarray(spec.colors, np.uint8)
+    step = max(1, len(cells_frames) // PALETTE_SAMPLE_FRAMES)
+    montage = Image.fromarray(np.concatenate(cells_frames[::step]))
+    mosaic = spec.coloring_function(montage, spec.colors, montage.width, montage.height, 1, paletted=True)
+    return index_map_from_mosaic(mosaic, 1)[0]
+
+
+def changed_cells(cells_frames: list[np.ndarray], change_threshold: int = DEFAULT_CHANGE_THRESHOLD) -> list[np.ndarray]:
+    """
+    Masks of the cells of every frame that changed since the previous frame (all cells of the first frame);
+    a cell is compared with its color when it was last recolored, so slow drifts are not lost
+
+    """
+    masks = []
+    reference = None
+    for cells in cells_frames:
+        current = cells.astype(np.int16)
+        if reference is None:
+            changed = np.ones(current.shape[:2], bool)
+            reference = current
+        else:
+            changed = np.any(np.abs(current - reference) >= change_threshold, axis=2)
+            reference = np.where(changed[..., None], current, reference)
+        masks.append(changed)
+    return masks
+
+
+def create_animation_index_maps(cells_frames: list[np.ndarray], palette: np.ndarray, dithering: str | None = None,
+                                change_threshold: int = DEFAULT_CHANGE_THRESHOLD,
+                                workers: int | None = None) -> list[np.ndarray]:
+    """
+    Index maps of cells of every frame colored by the palette of the clip
+
+    Without dithering only the cells that changed since the previous frame are colored (by the nearest palette
+    color), the others keep the previous index. Error diffusion depends on the neighbouring cells, so with
+    dithering the whole frame is dithered and unchanged cells only keep the previous index (no flicker)
+
+    """
+    masks = changed_cells(cells_frames, change_threshold)
+
+    def color_frame(number: int) -> np.ndarray:
+        cells = cells_frames[number]
+        if dithering is not None:
+            return dither_cells(Image.fromarray(cells), palette, dithering)
+        return nearest_palette_indexes(cells[masks[number]], palette)
+
+    dtype = np.uint8 if len(palette) <= 256 else np.uint16
+    index_maps = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for (number, colored) in enumerate(executor.map(color_frame, range(len(cells_frames)))):
+            if number == 0:
+                index_map = colored.reshape(masks[0].shape) if dithering is None else colored
+            elif dithering is not None:
+                index_map = np.where(masks[number], colored, index_maps[-1])
+            else:
+                index_map = index_maps[-1].copy()
+                index_map[masks[number]] = colored
+            index_maps.append(index_map.astype(dtype))
+    return index_maps
+
+
+def changed_box(index_maps: list[np.ndarray], number: int, multiplier: int) -> tuple[int, int, int, int]:
+    """
+    Box (left, upper, right, lower) in pixels of the cells of the frame whose colors differ from the previous frame,
+    the whole frame for the first one and the first cell if nothing changed
+
+    """
+    index_map = index_maps[number]
+    if number == 0:
+        return 0, 0, index_map.shape[1] * multiplier, index_map.shape[0] * multiplier
+    rows, columns = np.nonzero(index_map != index_maps[number - 1])
+    if len(rows) == 0:
+        return 0, 0, multiplier, multiplier
+    return (int(columns.min()) * multiplier, int(rows.min()) * multiplier, (int(columns.max()) + 1) * multiplier,
+            (int(rows.max()) + 1) * multiplier)
+
+
+def write_gif(file_name: str, frames: Iterator[tuple[Image, tuple[int, int]]], durations: list[int],
+              loop: int = 0) -> None:
+    """
+    Animated GIF written frame by frame: PIL collects all frames before writing, here every frame (a part
+    of the canvas at the offset) is written as soon as it is given, with its own color table
+
+    """
+    with open(file_name, "wb") as file:
+        for (number, (frame, offset)) in enumerate(frames):
+            if frame.mode not in ("P", "L"):
+                # RGB кадры (палитра с наложением не помещается в 256 цветов) переводятся в "P" так же, как в PIL
+                frame = frame.convert("P", palette=ADAPTIVE)
+            if number == 0:
+                header, _ = GifImagePlugin.getheader(frame, info={"loop": loop, "duration": durations[0]})
+                file.writelines(header)
+            file.writelines(GifImagePlugin.getdata(frame, offset, duration=durations[number],
+                                                   include_color_table=True))
+        file.write(b";")
+
+
+def save_animation(file_name: str, palette: np.ndarray, index_maps: list[np.ndarray], durations: list[int],
+                   spec: MosaicSpec, workers: int | None = None, progress: ProgressCallback | None = None) -> None:
+    """
+    Saving the frames of the mosaic with the overlay of the spec as an animated GIF/WebP or, for other extensions,
+    as a numbered frame sequence; frames are rendered in parallel while the previous ones are written
+
+    GIF frames and the frame sequence are written one at a time, GIF frames hold only the changed cells.
+    PIL writes WebP only after all frames are rendered, so raises MemoryError if they do not fit into the budget
+
+    """
+    workers = workers or os.cpu_count() or 1
+    # номера цветов общие для всего ролика, чтобы не меняться от кадра к кадру
+    colors_distribution = colors_distribution_from_index_map(palette, np.concatenate(index_maps))
+    name, extension = os.path.splitext(file_name)
+    extension = extension.lower()
+    if extension == ".webp" and len(index_maps) * estimate_mosaic_memory(
+            spec.width, spec.height, spec.multiplier, spec.overlay is not None, display=False) > memory_budget():
+        raise MemoryError("animation frames do not fit into the memory budget")
+
+    def render_frame(number: int) -> tuple[Image, tuple[int, int]]:
+        mosaic = mosaic_from_index_map(palette, index_maps[number], spec.multiplier, paletted=True)
+        if spec.overlay_function is not None:
+            mosaic = spec.overlay_function(mosaic, colors_distribution, spec.multiplier,
+                                           numbers_size=spec.numbers_size)
+        if extension == ".gif":
+            box = changed_box(index_maps, number, spec.multiplier)
+            return mosaic.crop(box), box[:2]
+        if extension != ".webp":
+            mosaic.save(f"{name}_{number + 1:04}{extension or '.png'}")
+        return mosaic, (0, 0)
+
+    def rendered_frames() -> Iterator[tuple[Image, tuple[int, int]]]:
+        for (number, frame) in enumerate(_bounded_map(executor, render_frame, iter(range(len(index_maps))),
+                                                      PENDING_FRAMES_PER_WORKER * workers)):
+            if progress is not None:
+                progress(number + 1, len(index_maps))
+            yield frame
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        frames = rendered_frames()
+        if extension == ".gif":
+            write_gif(file_name, frames, durations)
+        elif extension == ".webp":
+            mosaics = (mosaic for (mosaic, _) in frames)
+            first = next(mosaics)
+            first.save(file_name, save_all=True, append_images=mosaics, duration=durations, loop=0)
+        else:
+            for _ in frames:
+                pass
+
+
+def create_animation_mosaic(full_image_name: str, file_name: str, spec: MosaicSpec,
+                            change_threshold: int = DEFAULT_CHANGE_THRESHOLD, workers: int | None = None,
+                            progress: ProgressCallback | None = None) -> None:
+    """
+    Frame by frame mosaic of an animated GIF/WebP by the coloring, dithering and overlay of the spec
+    (the stock and the palette subset are not applied to clips)
+
+    """
+    cells_frames, durations = reduce_frames(full_image_name, spec.width, spec.height, workers)
+    palette = fit_clip_palette(cells_frames, spec)
+    index_maps = create_animation_index_maps(cells_frames, palette, spec.dithering, change_threshold, workers)
+    save_animation(file_name, palette, index_maps, durations, spec, workers, progress)
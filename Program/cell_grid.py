@@ -0,0 +1,117 @@
+import numpy as np
+
+# вершины единичного куба и его 12 треугольников (наружу смотрящие нормали)
+_CUBE_VERTICES = np.array([[0, 0, 0], [1, 0, 0], [1, 1, 0], [0, 1, 0], [0, 0, 1], [1, 0, 1], [1, 1, 1], [0, 1, 1]],
+                          np.float32)
+_CUBE_TRIANGLES = np.array([[0, 3, 1], [1, 3, 2], [4, 5, 7], [5, 6, 7], [0, 1, 4], [1, 5, 4],
+                            [1, 2, 5], [2, 6, 5], [2, 3, 6], [3, 7, 6], [3, 0, 7], [0, 4, 7]])
+
+
+def row_runs(index_map: np.ndarray) -> np.ndarray:
+    """
+    Run-length encoding of the rows of the cell grid: array (n, 4) of [row, column, length, color index]
+
+    """
+    rows, columns = index_map.shape
+    # начало отрезка - первая ячейка строки или ячейка, цвет которой отличается от соседа слева
+    starts = np.ones((rows, columns), bool)
+    starts[:, 1:] = index_map[:, 1:] != index_map[:, :-1]
+    run_rows, run_columns = np.nonzero(starts)
+    flat_starts = run_rows * columns + run_columns
+    lengths = np.diff(np.append(flat_starts, rows * columns))
+    # отрезок не переходит на следующую строку: следующее начало всегда есть в начале каждой строки
+    return np.stack((run_rows, run_columns, lengths, index_map[run_rows, run_columns]), axis=1)
+
+
+def greedy_rectangles(index_map: np.ndarray) -> np.ndarray:
+    """
+    Covering of the cell grid by rectangles of one color (greedy meshing): array (n, 5) of
+    [row, column, height, width, color index]
+
+    The first uncovered cell in row order starts a rectangle, it is extended to the right as far as possible,
+    then down while the whole row segment has the same color and is uncovered
+
+    """
+    rows, columns = index_map.shape
+    covered = np.zeros((rows, columns), bool)
+    rectangles = []
+    for row in range(rows):
+        column = 0
+        while column < columns:
+            free = np.flatnonzero(~covered[row, column:])
+            if len(free) == 0:
+                break
+            column += int(free[0])
+            color = index_map[row, column]
+            same = (index_map[row, column:] == color) & ~covered[row, column:]
+            width = int(np.argmin(same)) if not same.all() else columns - column
+            height = 1
+            while (row + height < rows and (index_map[row + height, column:column + width] == color).all()
+                   and not covered[row + height, column:column + width].any()):
+                height += 1
+            covered[row:row + height, column:column + width] = True
+            rectangles.append((row, column, height, width, color))
+            column += width
+    return np.array(rectangles, np.int64).reshape(-1, 5)
+
+
+def index_map_from_rectangles(rectangles: np.ndarray, shape: tuple[int, int]) -> np.ndarray:
+    index_map = np.zeros(shape, np.int64)
+    for (row, column, height, width, color) in rectangles.tolist():
+        index_map[row:row + height, column:column + width] = color
+    return index_map
+
+
+def rectangles_triangles(rectangles: np.ndarray, rows: int, cell_size: float = 1.0, depth: float = 1.0) -> np.ndarray:
+    """
+    Triangles (12 per rectangle, shape (n * 12, 3, 3)) of cuboids standing on the rectangles of a grid with rows rows,
+    the y axis points up (the first row of cells is at the top), suitable for an STL mesh
+
+    """
+    origins = np.stack((rectangles[:, 1], rows - rectangles[:, 0] - rectangles[:, 2], np.zeros(len(rectangles))),
+                       axis=1) * np.array([cell_size, cell_size, 1.0])
+    sizes = np.stack((rectangles[:, 3] * cell_size, rectangles[:, 2] * cell_size, np.full(len(rectangles), depth)),
+                     axis=1)
+    vertices = origins[:, None, :] + sizes[:, None, :] * _CUBE_VERTICES[None, :, :]
+    return vertices[:, _CUBE_TRIANGLES].reshape(-1, 3, 3).astype(np.float32)
+
+
+class CellGrid:
+    """
+    Compressed cell grid of the mosaic: palette, row runs and greedy rectangles of one color,
+    exporters and mesh builders emit one primitive per run or rectangle instead of one per cell
+
+    """
+
+    def __init__(self, palette: np.ndarray, index_map: np.ndarray) -> None:
+        """
+        Class constructor
+
+        """
+        self.palette = palette
+        self.shape = index_map.shape
+        self.runs = row_runs(index_map)
+        self._rectangles: np.ndarray | None = None
+
+    @property
+    def rectangles(self) -> np.ndarray:
+        if self._rectangles is None:
+            self._rectangles = greedy_rectangles(self.index_map())
+        return self._rectangles
+
+    def colors_counts(self) -> np.ndarray:
+        return np.bincount(self.runs[:, 3], weights=self.runs[:, 2], minlength=len(self.palette)).astype(np.int64)
+
+    def colors_distribution(self) -> dict[tuple[int, int, int], int]:
+        return {tuple(int(channel) for channel in color): int(count)
+                for (color, count) in zip(self.palette, self.colors_counts())}
+
+    def index_map(self) -> np.ndarray:
+        """
+        Index map decoded from the row runs
+
+        """
+        return np.repeat(self.runs[:, 3], self.runs[:, 2]).reshape(self.shape)
+
+    def triangles(self, cell_size: float = 1.0, depth: float = 1.0) -> np.ndarray:
+        return rectangles_triangles(self.rectangles, self.shape[0], cell_size, depth)
@@ -0,0 +1,46 @@
+import numpy as np
+
+from parallel import map_row_bands
+
+# матрица перевода линейного sRGB в XYZ и белая точка D65
+_RGB_TO_XYZ = np.array([[0.4124564, 0.3575761, 0.1804375],
+                        [0.2126729, 0.7151522, 0.0721750],
+                        [0.0193339, 0.1191920, 0.9503041]])
+_D65_WHITE = np.array([0.95047, 1.0, 1.08883])
+_LAB_EPSILON = (6 / 29) ** 3
+
+# количество цветов, для которых расстояния до палитры считаются за один раз (и наименьший кусок для потока)
+NEAREST_CHUNK_SIZE = 65536
+NEAREST_MIN_CHUNK_SIZE = 4096
+
+
+def rgb_to_lab(rgb: np.ndarray) -> np.ndarray:
+    """
+    Conversion of sRGB colors (0..255, last axis - channels) to CIELAB (D65)
+
+    """
+    rgb = np.asarray(rgb, np.float64) / 255.0
+    linear = np.where(rgb > 0.04045, ((rgb + 0.055) / 1.055) ** 2.4, rgb / 12.92)
+    xyz = linear @ _RGB_TO_XYZ.T / _D65_WHITE
+    f = np.where(xyz > _LAB_EPSILON, np.cbrt(xyz), xyz / (3 * (6 / 29) ** 2) + 4 / 29)
+    return np.stack([116 * f[..., 1] - 16, 500 * (f[..., 0] - f[..., 1]), 200 * (f[..., 1] - f[..., 2])], axis=-1)
+
+
+def nearest_palette_indexes(colors: np.ndarray, palette: np.ndarray) -> np.ndarray:
+    """
+    Indexes of the nearest palette colors (euclidean distance) for an array of colors, last axis - channels
+
+    """
+    shape = colors.shape[:-1]
+    colors = colors.reshape(-1, colors.shape[-1]).astype(np.float32)
+    palette = np.asarray(palette, np.float32)
+    palette_norms = (palette ** 2).sum(axis=1)
+    indexes = np.empty(len(colors), np.intp)
+
+    # куски цветов обрабатываются потоками пула
+    def nearest_chunk(start: int, stop: int) -> None:
+        # |c - p|^2 без |c|^2, который не влияет на выбор ближайшего
+        indexes[start:stop] = (palette_norms - 2 * colors[start:stop] @ palette.T).argmin(axis=1)
+
+    map_row_bands(nearest_chunk, len(colors), NEAREST_MIN_CHUNK_SIZE, NEAREST_CHUNK_SIZE)
+    return indexes.reshape(shape)
@@ -0,0 +1,127 @@
+import hashlib
+import threading
+
+import numpy as np
+from PIL import Image
+
+# размер мелкой палитры, из которой слиянием получаются все палитры меньшего размера
+FINE_PALETTE_SIZE = 256
+# сколько последних наборов ячеек помнят свои разбиения
+SWEEP_CACHE_SIZE = 4
+
+# разбиения строятся и читаются из нескольких потоков (живой предпросмотр, сохранение)
+_sweeps: dict[str, "ColorsSweep"] = {}
+_lock = threading.Lock()
+
+
+class ColorsSweep:
+    """
+    Hierarchical palette of the cells: the fine median-cut palette is merged pair by pair (Ward criterion)
+    down to one color, so the palette and the index map for any colors count are read off without quantizing
+    again, errors[colors] is the mean squared error of the cells for that colors count
+
+    """
+
+    def __init__(self, cells: Image, fine_size: int = FINE_PALETTE_SIZE) -> None:
+        """
+        Class constructor
+
+        """
+        pixels = np.asarray(cells.convert("RGB"), np.float64)
+        self.fine_index_map = np.asarray(cells.convert("RGB").quantize(colors=fine_size))
+        labels = self.fine_index_map.ravel()
+        count = int(labels.max()) + 1
+        weights = np.bincount(labels, minlength=count).astype(np.float64)
+        # центры мелких кластеров - средние их ячеек, тогда стоимость слияния Уорда точно равна росту ошибки
+        centers = np.stack([np.bincount(labels, pixels[..., channel].ravel(), count) for channel in range(3)], axis=1)
+        used = weights > 0
+        centers[used] /= weights[used, None]
+        fine_error = ((pixels.reshape(-1, 3) - centers[labels]) ** 2).sum()
+
+        # assignments[colors] - номер кластера для каждого цвета мелкой палитры, palettes[colors] - палитра
+        self.assignments: dict[int, np.ndarray] = {}
+        self.palettes: dict[int, np.ndarray] = {}
+        self.errors = np.full(count + 1, np.nan)
+        clusters = np.flatnonzero(used)
+        cluster_of = np.arange(count)
+        total_error = fine_error
+        self._record(clusters, cluster_of, centers, total_error, labels.size)
+
+        weights, centers = weights[clusters], centers[clusters]
+        costs = self._merge_costs(centers, weights)
+        while len(clusters) > 1:
+            first, second = np.unravel_index(costs.argmin(), costs.shape)
+            total_error += costs[first, second]
+            total = weights[first] + weights[second]
+            centers[first] = (centers[first] * weights[first] + centers[second] * weights[second]) / total
+            weights[first] = total
+            cluster_of[cluster_of == clusters[second]] = clusters[first]
+            clusters, centers, weights = (np.delete(clusters, second), np.delete(centers, second, axis=0),
+                                          np.delete(weights, second))
+            costs = np.delete(np.delete(costs, second, axis=0), second, axis=1)
+            first -= second < first
+            costs[first] = costs[:, first] = self._merge_costs(centers, weights, first)
+            costs[first, first] = np.inf
+            self._record(clusters, cluster_of, centers, total_error, labels.size)
+
+    @staticmethod
+    def _merge_costs(centers: np.ndarray, weights: np.ndarray, row: int | None = None) -> np.ndarray:
+        # рост суммарной квадратичной ошибки при слиянии кластеров: wi * wj / (wi + wj) * |ci - cj|^2
+        if row is not None:
+            return (weights[row] * weights / (weights[row] + weights) * ((centers - centers[row]) ** 2).sum(axis=1))
+        costs = (weights[:, None] * weights[None, :] / (weights[:, None] + weights[None, :])
+                 * ((centers[:, None, :] - centers[None, :, :]) ** 2).sum(axis=2))
+        np.fill_diagonal(costs, np.inf)
+        return costs
+
+    def _record(self, clusters: np.ndarray, cluster_of: np.ndarray, centers: np.ndarray, total_error: float,
+                cells_count: int) -> None:
+        colors = len(clusters)
+        order = np.full(len(cluster_of), -1)
+        order[clusters] = np.arange(colors)
+        self.assignments[colors] = order[cluster_of].astype(np.uint8 if colors <= 256 else np.uint16)
+        self.palettes[colors] = np.clip(np.rint(centers), 0, 255).astype(np.uint8)
+        self.errors[colors] = total_error / cells_count
+
+    @property
+    def max_colors(self) -> int:
+        return max(self.palettes)
+
+    def palette(self, colors: int) -> np.ndarray:
+        return self.palettes[max(1, min(colors, self.max_colors))]
+
+    def index_map(self, colors: int) -> np.ndarray:
+        return self.assignments[max(1, min(colors, self.max_colors))][self.fine_index_map]
+
+    def suggested_colors(self, min_colors: int = 2) -> int:
+        """
+        The "knee" of the error curve: the colors count farthest from the chord between its ends,
+        the cells with fewer than min_colors different colors get all their colors
+
+        """
+        counts = np.arange(min(min_colors, self.max_colors), self.max_colors + 1)
+        if len(counts) < 3:
+            return int(counts[-1])
+        errors = self.errors[counts]
+        x = (counts - counts[0]) / (counts[-1] - counts[0])
+        y = (errors - errors[-1]) / max(errors[0] - errors[-1], 1e-12)
+        return int(counts[np.argmax(1 - x - y)])
+
+
+def get_colors_sweep(cells: Image) -> ColorsSweep:
+    """
+    Cached colors sweep of the cells: stepping the colors count of the same cells does not build it again
+
+    """
+    key = hashlib.sha1(cells.tobytes() + str(cells.size).encode()).hexdigest()
+    with _lock:
+        sweep = _sweeps.get(key)
+    if sweep is not None:
+        return sweep
+    # разбиение строится без блокировки, чтобы не задерживать другие потоки
+    sweep = ColorsSweep(cells)
+    with _lock:
+        sweep = _sweeps.setdefault(key, sweep)
+        while len(_sweeps) > SWEEP_CACHE_SIZE:
+            del _sweeps[next(iter(_sweeps))]
+    return sweep
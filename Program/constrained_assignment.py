@@ -0,0 +1,118 @@
+import numpy as np
+from PIL import Image
+
+from color_space import rgb_to_lab
+
+# во сколько раз уменьшается шаг аукциона на каждом этапе и шаг последнего этапа (в единицах ΔE)
+EPSILON_SCALING = 5.0
+FINAL_EPSILON = 0.01
+# запас считается тесным, если лишних мест меньше этой доли ячеек: тогда аукцион идёт этапами с фиктивными ячейками
+TIGHT_STOCK_SURPLUS = 0.1
+
+
+class InsufficientStockError(ValueError):
+    """
+    The stock of the colors is less than the number of cells
+
+    """
+
+
+def _resolve_bids(rows: np.ndarray, columns: np.ndarray, bids: np.ndarray,
+                  capacities: np.ndarray) -> np.ndarray:
+    # каждый цвет оставляет за собой не больше capacities ставок, самые высокие, результат - маска оставленных;
+    # сортировка по одному ключу: номер цвета, внутри цвета - ставки по убыванию
+    order = np.argsort(columns * (np.ptp(bids) + 1.0) - bids)
+    sorted_columns = columns[order]
+    starts = np.concatenate(([0], np.cumsum(np.bincount(sorted_columns, minlength=len(capacities)))[:-1]))
+    kept = np.zeros(len(rows), bool)
+    kept[order] = np.arange(len(rows)) - starts[sorted_columns] < capacities[sorted_columns]
+    return kept
+
+
+def auction_assignment(costs: np.ndarray, capacities: np.ndarray, final_epsilon: float = FINAL_EPSILON) -> np.ndarray:
+    """
+    Assignment of rows (cells) to columns (colors) with the minimal total cost where column j gets at most
+    capacities[j] rows: Jacobi auction with similar objects, all unassigned rows bid at once
+
+    With tight capacities the problem is balanced by dummy rows of zero cost, so every column gets full
+    and epsilon scaling can reuse the prices of the previous phase (long eviction chains are cheap then);
+    with loose capacities the auction runs once from zero prices (a column not full must stay free).
+    The total cost is at most len(costs) * final_epsilon above the optimum
+
+    """
+    capacities = np.asarray(capacities, np.int64)
+    if capacities.sum() < costs.shape[0]:
+        raise InsufficientStockError("not enough stock for all cells")
+    # цвета без запаса в аукционе не участвуют
+    available = np.flatnonzero(capacities > 0)
+    costs, capacities = costs[:, available], np.minimum(capacities[available], costs.shape[0])
+    cells = costs.shape[0]
+    surplus = int(capacities.sum()) - cells
+    if surplus <= cells * TIGHT_STOCK_SURPLUS:
+        costs = np.concatenate((costs, np.zeros((surplus, costs.shape[1]), costs.dtype)))
+        # этапы с шагами final_epsilon * EPSILON_SCALING ** m, ..., final_epsilon, первый шаг - около размаха цен / 5
+        phases = max(0, int(np.ceil(np.log(max(float(np.ptp(costs)), final_epsilon) / final_epsilon)
+                                    / np.log(EPSILON_SCALING))) - 1)
+        epsilon = final_epsilon * EPSILON_SCALING ** phases
+    else:
+        epsilon = final_epsilon
+    rows, columns = costs.shape
+    benefits = -costs.astype(np.float64)
+    prices = np.zeros(columns)
+    while True:
+        # цвет и удержанная ставка каждой строки (-1 - строка не назначена)
+        column_of_row = np.full(rows, -1, np.int64)
+        bid_of_row = np.zeros(rows)
+        unassigned = np.arange(rows)
+        while len(unassigned) > 0:
+            values = benefits[unassigned] - prices
+            best = values.argmax(axis=1)
+            best_values = values[np.arange(len(unassigned)), best]
+            values[np.arange(len(unassigned)), best] = -np.inf
+            second_values = values.max(axis=1)
+            # у единственного цвета нет второго по выгоде, ставка поднимается только на шаг
+            second_values = np.where(np.isfinite(second_values), second_values, best_values)
+            bids = prices[best] + best_values - second_values + epsilon
+
+            # заново распределяются только цвета, на которые были ставки (последний элемент - для строк без цвета)
+            bid_columns = np.zeros(columns + 1, bool)
+            bid_columns[best] = True
+            holders = np.flatnonzero(bid_columns[column_of_row])
+            candidate_rows = np.concatenate((holders, unassigned))
+            candidate_columns = np.concatenate((column_of_row[holders], best))
+            candidate_bids = np.concatenate((bid_of_row[holders], bids))
+            kept = _resolve_bids(candidate_rows, candidate_columns, candidate_bids, capacities)
+            column_of_row[candidate_rows[~kept]] = -1
+            column_of_row[candidate_rows[kept]] = candidate_columns[kept]
+            bid_of_row[candidate_rows[kept]] = candidate_bids[kept]
+            # цена цвета - самая низкая удержанная ставка, пока у цвета есть свободные места, цвет бесплатный
+            counts = np.bincount(candidate_columns[kept], minlength=columns)
+            lowest = np.full(columns, np.inf)
+            np.minimum.at(lowest, candidate_columns[kept], candidate_bids[kept])
+            full = bid_columns[:-1] & (counts >= capacities)
+            prices[full] = lowest[full]
+            unassigned = candidate_rows[~kept]
+        if epsilon <= final_epsilon * (1 + 1e-9):
+            break
+        epsilon /= EPSILON_SCALING
+
+    return available[column_of_row[:cells]]
+
+
+def assign_cells_with_stock(cells: Image, palette: np.ndarray, stock: np.ndarray) -> np.ndarray:
+    """
+    Index map (h, w) of the cells colored by the palette (k, 3) so that color j is used at most stock[j] times
+    and the total CIELAB color difference is minimal, raises InsufficientStockError if the stock is not enough
+
+    """
+    pixels = np.asarray(cells.convert("RGB"))
+    palette = np.asarray(palette, np.uint8).reshape(-1, 3)
+    stock = np.minimum(np.asarray(stock, np.int64), pixels.shape[0] * pixels.shape[1])
+    # одинаковые ячейки взаимозаменяемы: цена считается для разных цветов, а не для каждой ячейки
+    colors, inverse = np.unique(pixels.reshape(-1, 3), axis=0, return_inverse=True)
+    inverse = inverse.ravel()
+    costs = np.sqrt(((rgb_to_lab(colors)[:, None, :] - rgb_to_lab(palette)[None, :, :]) ** 2).sum(axis=2))
+    nearest = costs.argmin(axis=1)
+    if (np.bincount(nearest[inverse], minlength=len(palette)) <= stock).all():
+        return nearest[inverse].reshape(pixels.shape[:2])
+    return auction_assignment(costs[inverse], stock).reshape(pixels.shape[:2])
@@ -0,0 +1,71 @@
+import hashlib
+import threading
+from contextlib import contextmanager
+from typing import Iterator
+
+import numpy as np
+
+DETERMINISTIC_SEED = 0
+# версия формата отпечатка: меняется, если меняется то, что в него входит
+FINGERPRINT_VERSION = 1
+
+# глобальное состояние NumPy одно на процесс: детерминированные запуски идут по одному
+_lock = threading.RLock()
+# флаг свой у каждого потока: запуск в одном потоке не отключает бюджеты времени в других
+_state = threading.local()
+
+
+@contextmanager
+def deterministic_mode(seed: int = DETERMINISTIC_SEED) -> Iterator[None]:
+    """
+    Deterministic mode of the calling thread: quantizers use fixed seeds, no time budgets and no state left
+    by previous runs; the previous mode is restored afterwards
+
+    The global NumPy random state (used by pyxelate fitting) is seeded and restored afterwards as well, it is
+    process-wide: deterministic runs are serialized, but pyxelate fitting in other threads meanwhile shares
+    the seeded state, so the results are reproducible only if no other coloring runs at the same time
+
+    """
+    with _lock:
+        random_state = np.random.get_state()
+        previous = is_deterministic()
+        np.random.seed(seed)
+        _state.deterministic = True
+        try:
+            yield
+        finally:
+            _state.deterministic = previous
+            np.random.set_state(random_state)
+
+
+def is_deterministic() -> bool:
+    return getattr(_state, "deterministic", False)
+
+
+def canonical_palette_order(palette: np.ndarray, index_map: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Palette ordered by frequency of colors in the index map (most frequent first), then by color value,
+    unused colors are dropped and the index map is renumbered accordingly
+
+    """
+    counts = np.bincount(index_map.ravel(), minlength=len(palette))
+    used = np.flatnonzero(counts)
+    keys = (palette[used, 0].astype(np.int64) << 16) | (palette[used, 1].astype(np.int64) << 8) | palette[used, 2]
+    order = used[np.lexsort((keys, -counts[used]))]
+    renumbering = np.zeros(len(palette), np.int64)
+    renumbering[order] = np.arange(len(order))
+    dtype = np.uint8 if len(order) <= 256 else np.uint16
+    return palette[order].astype(np.uint8), renumbering[index_map].astype(dtype)
+
+
+def mosaic_fingerprint(palette: np.ndarray, index_map: np.ndarray) -> str:
+    """
+    Content fingerprint of the mosaic: SHA-256 of the canonical palette and index map,
+    it does not depend on the palette order or the index map dtype
+
+    """
+    palette, index_map = canonical_palette_order(np.asarray(palette, np.uint8).reshape(-1, 3), index_map)
+    digest = hashlib.sha256(f"mosaic:{FINGERPRINT_VERSION}:{index_map.shape[0]}x{index_map.shape[1]}:".encode())
+    digest.update(palette.tobytes())
+    digest.update(index_map.astype("<u2").tobytes())
+    return digest.hexdigest()
@@ -0,0 +1,117 @@
+import numpy as np
+from PIL import Image
+from PIL.Image import FLOYDSTEINBERG
+
+from color_space import rgb_to_lab, nearest_palette_indexes
+
+# режимы дизеринга, окончание "_lab" - дизеринг в перцептивном пространстве CIELAB
+DITHERING_MODES = ("ordered", "ordered_lab", "floyd_steinberg", "floyd_steinberg_lab")
+# соответствующие режимы pyxelate
+PYXELATE_DITHERING_MODES = {"ordered": "bayer", "ordered_lab": "bayer", "floyd_steinberg": "floyd",
+                            "floyd_steinberg_lab": "floyd"}
+BAYER_MATRIX_SIZE = 4
+
+
+def bayer_matrix(size: int) -> np.ndarray:
+    """
+    Bayer threshold matrix size x size (size - power of two) with values in [0, 1)
+
+    """
+    matrix = np.zeros((1, 1))
+    while matrix.shape[0] < size:
+        matrix = np.block([[4 * matrix, 4 * matrix + 2], [4 * matrix + 3, 4 * matrix + 1]])
+    return matrix / matrix.size
+
+
+def palette_spread(palette: np.ndarray) -> float:
+    """
+    Typical distance between palette colors: median distance from each color to its nearest neighbour
+
+    """
+    if len(palette) < 2:
+        return 0.0
+    distances = np.sqrt(((palette[:, None, :] - palette[None, :, :]) ** 2).sum(axis=2))
+    np.fill_diagonal(distances, np.inf)
+    return float(np.median(distances.min(axis=1)))
+
+
+def ordered_dither(cells: np.ndarray, palette: np.ndarray, perceptual: bool = False,
+                   matrix_size: int = BAYER_MATRIX_SIZE) -> np.ndarray:
+    """
+    Ordered (Bayer) dithering of the cell grid, fully vectorised, returns the index map of cells
+
+    In RGB the threshold shifts all channels, in CIELAB only the lightness
+
+    """
+    height, width = cells.shape[:2]
+    colors = rgb_to_lab(cells) if perceptual else cells.astype(np.float64)
+    palette_colors = rgb_to_lab(palette) if perceptual else palette.astype(np.float64)
+    thresholds = np.tile(bayer_matrix(matrix_size) - 0.5, (height // matrix_size + 1, width // matrix_size + 1))
+    offsets = thresholds[:height, :width] * palette_spread(palette_colors)
+    if perceptual:
+        colors[..., 0] += offsets
+    else:
+        colors += offsets[..., None]
+    return nearest_palette_indexes(colors, palette_colors)
+
+
+def _floyd_steinberg_rgb(cells: np.ndarray, palette: np.ndarray) -> np.ndarray:
+    # ядро Флойда-Стейнберга из PIL (C), палитра дополняется первым цветом до 256 записей
+    palette_image = Image.new("P", (1, 1))
+    padded_palette = np.vstack((palette, np.repeat(palette[:1], 256 - len(palette), axis=0)))
+    palette_image.putpalette(padded_palette.astype(np.uint8).tobytes())
+    index_map = np.asarray(Image.fromarray(cells).quantize(palette=palette_image, dither=FLOYDSTEINBERG))
+    return np.where(index_map >= len(palette), 0, index_map)
+
+
+def _floyd_steinberg(colors: np.ndarray, palette_colors: np.ndarray) -> np.ndarray:
+    # волновой фронт: строка y отстаёт от строки y - 1 на две ячейки, тогда ячейки фронта x + 2y получают ошибку
+    # только от ячеек предыдущих фронтов и обрабатываются вместе (построчный порядок обхода, без змейки)
+    height, width = colors.shape[:2]
+    # рамка по бокам и снизу принимает ошибку, уходящую за край сетки
+    padded = np.zeros((height + 1, width + 2, colors.shape[2]))
+    padded[:height, 1:width + 1] = colors
+    index_map = np.empty((height, width), np.intp)
+    for front in range(width + 2 * (height - 1)):
+        ys = np.arange(max(0, (front - width + 2) // 2), min(height - 1, front // 2) + 1)
+        xs = front - 2 * ys
+        color = padded[ys, xs + 1]
+        indexes = ((color[:, None, :] - palette_colors[None, :, :]) ** 2).sum(axis=2).argmin(axis=1)
+        index_map[ys, xs] = indexes
+        error = color - palette_colors[indexes]
+        # у каждого слагаемого свои клетки назначения, повторов внутри одного присваивания нет
+        padded[ys, xs + 2] += error * (7 / 16)
+        padded[ys + 1, xs] += error * (3 / 16)
+        padded[ys + 1, xs + 1] += error * (5 / 16)
+        padded[ys + 1, xs + 2] += error * (1 / 16)
+    return index_map
+
+
+def floyd_steinberg_dither(cells: np.ndarray, palette: np.ndarray, perceptual: bool = False) -> np.ndarray:
+    """
+    Floyd-Steinberg error diffusion of the cell grid, returns the index map of cells
+
+    In RGB palettes of at most 256 colors use the kernel of PIL, larger palettes (and CIELAB)
+    use the vectorised wavefront kernel in the same color space
+
+    """
+    if perceptual:
+        return _floyd_steinberg(rgb_to_lab(cells), rgb_to_lab(palette))
+    if len(palette) <= 256:
+        return _floyd_steinberg_rgb(cells, palette)
+    return _floyd_steinberg(cells.astype(np.float64), palette.astype(np.float64))
+
+
+def dither_cells(cells: Image, palette: np.ndarray, mode: str) -> np.ndarray:
+    """
+    Dithering of the image of cells (one pixel per cell) with the palette (k, 3) in the given mode
+
+    """
+    if mode not in DITHERING_MODES:
+        raise ValueError(f"unknown dithering mode: {mode}")
+    pixels = np.asarray(cells.convert("RGB"))
+    palette = np.asarray(palette, np.uint8).reshape(-1, 3)
+    perceptual = mode.endswith("_lab")
+    if mode.startswith("ordered"):
+        return ordered_dither(pixels, palette, perceptual)
+    return floyd_steinberg_dither(pixels, palette, perceptual)
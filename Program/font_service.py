@@ -0,0 +1,73 @@
+import os
+from functools import lru_cache
+
+import matplotlib
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+# шрифты в порядке предпочтения: рядом с программой, системные, DejaVu Sans из matplotlib
+FONT_CANDIDATES = (
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "font.ttf"),
+    "arial.ttf",
+    "Arial.ttf",
+    "DejaVuSans.ttf",
+    "LiberationSans-Regular.ttf",
+    os.path.join(matplotlib.get_data_path(), "fonts", "ttf", "DejaVuSans.ttf"),
+)
+
+
+@lru_cache(maxsize=None)
+def get_font_path() -> str | None:
+    """
+    Path of the first available font from FONT_CANDIDATES, the search is done once
+
+    """
+    for font_path in FONT_CANDIDATES:
+        try:
+            ImageFont.truetype(font_path, 10)
+            return font_path
+        except OSError:
+            continue
+    return None
+
+
+@lru_cache(maxsize=None)
+def get_font(size: int) -> ImageFont.FreeTypeFont | ImageFont.ImageFont:
+    """
+    Font of the given size, fonts are cached per size
+
+    """
+    font_path = get_font_path()
+    if font_path is not None:
+        return ImageFont.truetype(font_path, size)
+    try:
+        return ImageFont.load_default(size)
+    except TypeError:
+        return ImageFont.load_default()
+
+
+def draw_centered_text(draw: ImageDraw.ImageDraw, xy: tuple[float, float], text: str, fill: int | str,
+                       font: ImageFont.FreeTypeFont | ImageFont.ImageFont) -> None:
+    if isinstance(font, ImageFont.FreeTypeFont):
+        draw.text(xy, text, fill=fill, anchor="mm", font=font)
+    else:
+        left, top, right, bottom = draw.textbbox((0, 0), text, font=font)
+        draw.text((xy[0] - (left + right) / 2, xy[1] - (top + bottom) / 2), text, fill=fill, font=font)
+
+
+@lru_cache(maxsize=16)
+def get_numbers_atlas(count: int, size: int, cell_size: int) -> np.ndarray:
+    """
+    Masks of numbers 1..count centered in cells of cell_size pixels, shape (count, cell_size, cell_size)
+
+    The mask of number n is atlas[n - 1], the text is clipped by the cell borders
+
+    """
+    font = get_font(size)
+    atlas = np.empty((count, cell_size, cell_size), np.uint8)
+    for number in range(1, count + 1):
+        glyph = Image.new("L", (cell_size, cell_size), 0)
+        draw_centered_text(ImageDraw.Draw(glyph), (cell_size * 0.5, cell_size * 0.5), str(number), 255, font)
+        atlas[number - 1] = np.asarray(glyph)
+    atlas.setflags(write=False)
+    return atlas
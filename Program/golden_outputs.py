@@ -0,0 +1,96 @@
+"""
+Golden outputs of the coloring functions for regression checks
+
+Every coloring function is run in the deterministic mode on the image, fingerprints of the results and run times
+are compared with the golden file; without the golden file (or with --update) it is written.
+The run time is the best of several runs after a warm-up run, so lazy imports and cold caches do not count
+
+Run: python golden_outputs.py images/image.png golden.json --colors 8 --width 50 --height 50
+(the golden outputs in tests/data are checked by tests/test_golden_outputs.py)
+"""
+import argparse
+import json
+import os.path
+import sys
+import time
+
+from image_processor import COLORING_FUNCTIONS, PALETTE_COLORING_FUNCTIONS, create_reproducible_mosaic
+from image_loader import open_oriented_image
+from palette_extractor import dominant_colors
+
+# во сколько раз функция может стать медленнее эталона, прежде чем это считается регрессией
+DEFAULT_MAX_SLOWDOWN = 1.5
+# замеров после прогревочного запуска, время - лучший из них
+DEFAULT_REPEATS = 5
+
+
+def golden_outputs(image_name: str, colors: int, width: int, height: int, dithering: str | None = None,
+                   repeats: int = DEFAULT_REPEATS, names: list[str] | None = None) -> dict[str, dict]:
+    """
+    Fingerprint and run time of the result of every coloring function (or of the named ones), palette functions get
+    the dominant colors of the image as the palette; the time is the best of repeats runs after a warm-up run
+
+    """
+    image = open_oriented_image(image_name)
+    palette = dominant_colors(image, colors)
+    outputs = {}
+    for name in names or COLORING_FUNCTIONS:
+        coloring_function = COLORING_FUNCTIONS[name]
+        function_colors = palette if coloring_function in PALETTE_COLORING_FUNCTIONS else colors
+        *_, fingerprint = create_reproducible_mosaic(coloring_function, image, function_colors, width, height,
+                                                     dithering)
+        times = []
+        for _ in range(max(1, repeats)):
+            started = time.perf_counter()
+            create_reproducible_mosaic(coloring_function, image, function_colors, width, height, dithering)
+            times.append(time.perf_counter() - started)
+        outputs[name] = {"fingerprint": fingerprint, "time": min(times)}
+    return outputs
+
+
+def compare_outputs(outputs: dict[str, dict], golden: dict[str, dict],
+                    max_slowdown: float | None = DEFAULT_MAX_SLOWDOWN) -> list[str]:
+    """
+    Differences of the outputs from the golden outputs: changed fingerprints and slowdowns
+    (run times are not compared if max_slowdown is None)
+
+    """
+    differences = []
+    for (name, output) in outputs.items():
+        if name not in golden:
+            differences.append(f"{name}: no golden output")
+            continue
+        if output["fingerprint"] != golden[name]["fingerprint"]:
+            differences.append(f"{name}: fingerprint {output['fingerprint']} != {golden[name]['fingerprint']}")
+        if max_slowdown is not None and output["time"] > golden[name]["time"] * max_slowdown:
+            differences.append(f"{name}: {output['time']:.3f} s instead of {golden[name]['time']:.3f} s")
+    return differences
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="3DMosaic golden outputs")
+    parser.add_argument("image")
+    parser.add_argument("golden")
+    parser.add_argument("--colors", type=int, default=8)
+    parser.add_argument("--width", type=int, default=50)
+    parser.add_argument("--height", type=int, default=50)
+    parser.add_argument("--dithering", default=None)
+    parser.add_argument("--max-slowdown", type=float, default=DEFAULT_MAX_SLOWDOWN)
+    parser.add_argument("--repeats", type=int, default=DEFAULT_REPEATS)
+    parser.add_argument("--functions", default=None, help="comma separated names of coloring functions (all by default)")
+    parser.add_argument("--update", action="store_true")
+    arguments = parser.parse_args()
+
+    outputs = golden_outputs(arguments.image, arguments.colors, arguments.width, arguments.height,
+                             arguments.dithering, arguments.repeats,
+                             arguments.functions.split(",") if arguments.functions else None)
+    if arguments.update or not os.path.exists(arguments.golden):
+        with open(arguments.golden, "w", encoding="utf-8") as file:
+            json.dump(outputs, file, indent=4)
+        print(f"golden outputs written to {arguments.golden}")
+        sys.exit(0)
+    with open(arguments.golden, encoding="utf-8") as file:
+        differences = compare_outputs(outputs, json.load(file), arguments.max_slowdown)
+    for difference in differences:
+        print(difference)
+    sys.exit(1 if differences else 0)
@@ -0,0 +1,193 @@
+import os
+import struct
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable
+
+import numpy as np
+from PIL import Image
+from PIL.Image import NONE
+
+DEFAULT_COMPRESS_LEVEL = 6
+# количество строк изображения, сжимаемых одной задачей
+ROWS_PER_CHUNK = 256
+
+ProgressCallback = Callable[[int, int], None]
+
+_PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+_PNG_UP_FILTER = 2
+_PNG_COLOR_TYPES = {"L": 0, "RGB": 2, "P": 3}
+
+
+def _png_chunk(chunk_type: bytes, data: bytes) -> bytes:
+    return struct.pack(">I", len(data)) + chunk_type + data + struct.pack(">I", zlib.crc32(chunk_type + data))
+
+
+def _filter_rows(pixels: np.ndarray, start: int, stop: int, previous_row: np.ndarray | None = None) -> bytes:
+    """
+    Rows [start, stop) with the PNG "Up" filter: repeated rows of mosaic cells turn into zeros
+
+    previous_row is the row above the first row when pixels is a band of a larger image
+
+    """
+    rows = pixels[start:stop].reshape(stop - start, -1)
+    if start > 0:
+        previous = pixels[start - 1:stop - 1].reshape(stop - start, -1)
+    else:
+        first_previous = np.zeros((1, rows.shape[1]), np.uint8) if previous_row is None else previous_row.reshape(1, -1)
+        previous = np.vstack((first_previous, rows[:-1]))
+    filtered = np.empty((rows.shape[0], rows.shape[1] + 1), np.uint8)
+    filtered[:, 0] = _PNG_UP_FILTER
+    np.subtract(rows, previous, out=filtered[:, 1:])
+    return filtered.tobytes()
+
+
+def _deflate_rows(pixels: np.ndarray, start: int, stop: int, compress_level: int, last: bool,
+                  previous_row: np.ndarray | None = None) -> tuple[bytes, int]:
+    data = _filter_rows(pixels, start, stop, previous_row)
+    compressor = zlib.compressobj(compress_level, zlib.DEFLATED, -15)
+    compressed = compressor.compress(data) + compressor.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+    return compressed, zlib.adler32(data)
+
+
+def _adler32_combine(adler1: int, adler2: int, length2: int) -> int:
+    base = 65521
+    remainder = length2 % base
+    sum1 = adler1 & 0xFFFF
+    sum2 = (remainder * sum1) % base
+    sum1 = (sum1 + (adler2 & 0xFFFF) + base - 1) % base
+    sum2 = (sum2 + (adler1 >> 16) + (adler2 >> 16) + base - remainder) % base
+    return (sum2 << 16) | sum1
+
+
+def encode_png(image: Image, compress_level: int = DEFAULT_COMPRESS_LEVEL, workers: int | None = None,
+               progress: ProgressCallback | None = None) -> bytes:
+    """
+    PNG encoding with rows split into chunks that are deflated in parallel (zlib releases the GIL)
+
+    Supports "RGB", "L" and "P" images, "P" images are written with their palette (indexed PNG)
+
+    """
+    if image.mode not in _PNG_COLOR_TYPES:
+        image = image.convert("RGB")
+    pixels = np.asarray(image)
+    height = image.height
+    row_length = pixels[0].size + 1
+    bounds = [(start, min(start + ROWS_PER_CHUNK, height)) for start in range(0, height, ROWS_PER_CHUNK)]
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(_deflate_rows, pixels, start, stop, compress_level, stop == height)
+                   for (start, stop) in bounds]
+        compressed_chunks = []
+        checksum = 1
+        for (number, (future, (start, stop))) in enumerate(zip(futures, bounds)):
+            compressed, chunk_checksum = future.result()
+            compressed_chunks.append(compressed)
+            checksum = _adler32_combine(checksum, chunk_checksum, (stop - start) * row_length)
+            if progress is not None:
+                progress(number + 1, len(bounds))
+
+    idat = _zlib_header(compress_level) + b"".join(compressed_chunks) + struct.pack(">I", checksum)
+    palette = image.getpalette()[:3 * (int(pixels.max()) + 1)] if image.mode == "P" else None
+    return _png_header(image.width, height, image.mode, palette) + _png_chunk(b"IDAT", idat) + _png_chunk(b"IEND", b"")
+
+
+def _zlib_header(compress_level: int) -> bytes:
+    # заголовок zlib: deflate с окном 32 КБ, без словаря
+    return bytes((0x78, 0x01 if compress_level <= 1 else 0x9C if compress_level <= 6 else 0xDA))
+
+
+def _png_header(width: int, height: int, mode: str, palette: list[int] | None = None) -> bytes:
+    header = _PNG_SIGNATURE + _png_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, _PNG_COLOR_TYPES[mode],
+                                                              0, 0, 0))
+    if mode == "P":
+        header += _png_chunk(b"PLTE", bytes(palette))
+    return header
+
+
+def save_png_bands(bands: Iterable[Image], file_name: str, width: int, height: int,
+                   compress_level: int = DEFAULT_COMPRESS_LEVEL, workers: int | None = None,
+                   progress: ProgressCallback | None = None) -> None:
+    """
+    Streaming PNG saving of the image given as horizontal bands from top to bottom
+
+    Bands are deflated in parallel and written as separate IDAT chunks as soon as they are ready,
+    only a few bands are kept in memory. All bands must have the same mode (and palette for "P")
+
+    """
+    workers = workers or os.cpu_count() or 1
+    with open(file_name, "wb") as file, ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        checksum = 1
+        done_rows = 0
+        submitted_rows = 0
+        previous_row = None
+        row_length = None
+
+        def write_pending(limit: int) -> None:
+            nonlocal checksum, done_rows
+            while len(pending) > limit:
+                future, rows = pending.popleft()
+                compressed, chunk_checksum = future.result()
+                file.write(_png_chunk(b"IDAT", compressed))
+                checksum = _adler32_combine(checksum, chunk_checksum, rows * row_length)
+                done_rows += rows
+                if progress is not None:
+                    progress(done_rows, height)
+
+        for band in bands:
+            if band.mode not in _PNG_COLOR_TYPES:
+                band = band.convert("RGB")
+            pixels = np.asarray(band)
+            if row_length is None:
+                row_length = pixels[0].size + 1
+                file.write(_png_header(width, height, band.mode, band.getpalette() if band.mode == "P" else None))
+                file.write(_png_chunk(b"IDAT", _zlib_header(compress_level)))
+            for start in range(0, band.height, ROWS_PER_CHUNK):
+                stop = min(start + ROWS_PER_CHUNK, band.height)
+                last = submitted_rows + stop - start == height
+                pending.append((executor.submit(_deflate_rows, pixels, start, stop, compress_level, last,
+                                                previous_row if start == 0 else None), stop - start))
+                submitted_rows += stop - start
+            previous_row = pixels[-1]
+            write_pending(2 * workers)
+        write_pending(0)
+
+        file.write(_png_chunk(b"IDAT", struct.pack(">I", checksum)))
+        file.write(_png_chunk(b"IEND", b""))
+
+
+def indexed_image(image: Image, palette: np.ndarray) -> Image:
+    """
+    Conversion of the mosaic to "P" mode with the mosaic palette
+
+    Black and white are added to the palette for grid lines and numbers of overlays,
+    if the colors do not fit into 256 entries, the image is returned unchanged
+
+    """
+    if image.mode in ("P", "L"):
+        return image
+    colors = [tuple(color) for color in palette.tolist()]
+    for extra_color in ((0, 0, 0), (255, 255, 255)):
+        if extra_color not in colors:
+            colors.append(extra_color)
+    if len(colors) > 256:
+        return image
+    palette_image = Image.new("P", (1, 1))
+    palette_image.putpalette([channel for color in colors for channel in color])
+    return image.convert("RGB").quantize(palette=palette_image, dither=NONE)
+
+
+def save_png(image: Image, file_name: str, compress_level: int = DEFAULT_COMPRESS_LEVEL,
+             palette: np.ndarray | None = None, workers: int | None = None,
+             progress: ProgressCallback | None = None) -> None:
+    """
+    Saving the image to PNG, if the palette is given, the image is saved as indexed PNG
+
+    """
+    if palette is not None:
+        image = indexed_image(image, palette)
+    with open(file_name, "wb") as file:
+        file.write(encode_png(image, compress_level, workers, progress))
+
@@ -0,0 +1,47 @@
+from PIL import Image, ImageOps
+
+# размер предпросмотра, который показывается до декодирования изображения целиком
+PREVIEW_SIZE = (1024, 1024)
+# значения тега EXIF Orientation, при которых изображение повёрнуто на 90 градусов
+_EXIF_ORIENTATION_TAG = 0x0112
+_TRANSPOSED_ORIENTATIONS = (5, 6, 7, 8)
+
+
+def read_image_header(full_image_name: str) -> dict:
+    """
+    Size (with the EXIF orientation applied), orientation and format of the image read from the header only,
+    pixels are not decoded; fast_preview - the image can be decoded at a reduced scale for the preview
+
+    """
+    with Image.open(full_image_name) as image:
+        orientation = image.getexif().get(_EXIF_ORIENTATION_TAG, 1)
+        width, height = image.size
+        # draft уменьшает размер только у форматов, которые умеют декодироваться в уменьшенном масштабе (JPEG)
+        image.draft("RGB", PREVIEW_SIZE)
+        fast_preview = image.size != (width, height)
+        if orientation in _TRANSPOSED_ORIENTATIONS:
+            width, height = height, width
+        return {"size": (width, height), "orientation": orientation, "format": image.format,
+                "fast_preview": fast_preview}
+
+
+def open_preview(full_image_name: str, size: tuple[int, int] = PREVIEW_SIZE) -> Image:
+    """
+    Fast preview of the image: JPEG is decoded directly at a reduced scale (draft mode),
+    other formats are decoded in full, so the preview is worth it only if fast_preview of the header is set
+
+    """
+    with Image.open(full_image_name) as image:
+        image.draft("RGB", size)
+        preview = ImageOps.exif_transpose(image).convert("RGB")
+    preview.thumbnail(size)
+    return preview
+
+
+def open_oriented_image(full_image_name: str) -> Image:
+    """
+    Full resolution image in RGB with the EXIF orientation applied
+
+    """
+    with Image.open(full_image_name) as image:
+        return ImageOps.exif_transpose(image).convert("RGB")
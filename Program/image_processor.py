@@ -1,11 +1,28 @@
+import json
 import math
 import os.path
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterator
 
 import numpy as np
-from PIL import Image, ImageDraw, ImageFont
-from PIL.Image import BOX
+from PIL import Image, ImageDraw
+from PIL.Image import BOX, NEAREST
 from pyxelate import Pyx, Pal
 
+from color_space import nearest_palette_indexes
+from constrained_assignment import assign_cells_with_stock
+from color_sweep import get_colors_sweep
+from determinism import deterministic_mode, canonical_palette_order, mosaic_fingerprint
+from dithering import dither_cells, PYXELATE_DITHERING_MODES
+from font_service import get_font, get_numbers_atlas
+from kmeans_quantizer import fit_kmeans_palette
+from palette_extractor import unique_colors, image_palette
+from palette_subset import select_palette_subset, inventory_counts
+from parallel import map_row_bands
+
+# наибольшая палитра мозаики, при которой в режиме "P" остаётся место для чёрного и белого цветов наложений
+MAX_PALETTE_COLORS = 254
+
 
 # -------------- utils function --------------
 
@@ -23,20 +40,12 @@ def is_light_color(rgb: tuple[int, int, int]) -> bool:
 
 
 def colors_palette_from_image(image: Image) -> list[tuple[int, int, int]]:
-    colors = set()
-    for x in range(image.width):
-        for y in range(image.height):
-            colors.add(image.getpixel((x, y)))
-    return list(colors)
+    return unique_colors(image)
 
 
 # палитра цветов из изображения с палитрой
 def colors_palette_from_image_with_palette(image: Image) -> list | None:
-    if image.getpalette() is not None:
-        original_palette = image.getpalette()
-        return [(original_palette[i], original_palette[i + 1], original_palette[i + 2]) for i in
-                range(0, len(original_palette), 3)]
-    return None
+    return image_palette(image)
 
 
 # палитра определённого количества цветов из изображения pyxelate
@@ -81,16 +90,45 @@ def resize_image(image: Image, width: int, height: int) -> Image:
     return image.resize((width, height))
 
 
-def reresize_image(image: Image, width: int, height: int, multiplier: int) -> Image:
-    return image.resize((width * multiplier, height * multiplier), resample=BOX).convert("RGB")
+# пирамида уменьшенных вдвое (BOX) копий изображения, первый уровень - само изображение
+def build_image_pyramid(image: Image, min_size: int = 16) -> list[Image]:
+    pyramid = [image]
+    while min(pyramid[-1].size) // 2 >= min_size:
+        pyramid.append(pyramid[-1].reduce(2))
+    return pyramid
+
+
+# наименьший уровень пирамиды, из которого можно уменьшить изображение до заданного размера
+def image_from_pyramid(pyramid: list[Image], width: int, height: int) -> Image:
+    for level in reversed(pyramid):
+        if level.width >= width and level.height >= height:
+            return level
+    return pyramid[0]
+
 
+def reresize_image(image: Image, width: int, height: int, multiplier: int, paletted: bool = False) -> Image:
+    if image.size != (width, height) or image.mode not in ("P", "RGB"):
+        image = image.resize((width * multiplier, height * multiplier), resample=BOX)
+        return image if paletted and image.mode == "P" else image.convert("RGB")
+    # изображение уже в размере ячеек: ячейки увеличиваются полосами в потоках пула
+    if image.mode == "P":
+        palette = np.asarray(image.getpalette(), np.uint8).reshape(-1, 3)
+        return mosaic_from_index_map(palette, np.asarray(image), multiplier, paletted)
+    return Image.fromarray(upscale_cells(np.asarray(image), multiplier), "RGB")
 
-def palette_from_image(image: Image) -> Image:
-    original_palette = image.getpalette()
-    palette = []
-    for i in range(0, len(original_palette), 3):
-        palette.append((original_palette[i], original_palette[i + 1], original_palette[i + 2]))
-    return palette
+
+# изображение в режиме "P" с палитрой из его цветов (если цветов не больше 256)
+def paletted_image(image: Image) -> Image:
+    if image.mode == "P":
+        return image
+    palette, index_map = index_map_from_mosaic(image, 1)
+    if len(palette) > 256:
+        return image.convert("RGB")
+    return mosaic_from_index_map(palette, index_map, 1, paletted=True)
+
+
+def palette_from_image(image: Image) -> list[tuple[int, int, int]] | None:
+    return image_palette(image)
 
 
 def colors_distribution(image: Image, palette) -> dict[tuple[int, int, int], int]:
@@ -102,125 +140,229 @@ def colors_distribution(image: Image, palette) -> dict[tuple[int, int, int], int
     return {color: count for (color, count) in zip(palette, each_color_count)}
 
 
+COLORS_REPORT_FORMATS = ("txt", "csv", "json")
+
+
+# таблица распределения цветов в текстовом виде, csv или json
+def format_colors_distribution(each_color_palette: dict[tuple[int, int, int], int], file_format: str = "txt") -> str:
+    rows = [(number + 1, rgb_to_hex(color), count)
+            for (number, (color, count)) in enumerate(each_color_palette.items())]
+    if file_format == "txt":
+        return "№     #RRGGBB   Count\n" + "".join(f"{number:<5} #{color}   {count}\n"
+                                                   for (number, color, count) in rows)
+    elif file_format == "csv":
+        return "number,color,count\n" + "".join(f"{number},#{color},{count}\n" for (number, color, count) in rows)
+    elif file_format == "json":
+        return json.dumps([{"number": number, "color": f"#{color}", "count": count} for (number, color, count) in rows],
+                          indent=2)
+    raise ValueError(f"unknown colors distribution format: {file_format}")
+
+
 def save_colors_distribution(distribution_file_name: str, each_color_palette: dict[tuple[int, int, int], int],
-                             folder: str = "outputs/"):
+                             folder: str = "outputs/", file_format: str = "txt"):
     with open(os.path.join(folder, distribution_file_name), "w", encoding="utf-8") as file:
-        file.write("№     #RRGGBB   Count\n")
-        for (number, (color, count)) in enumerate(each_color_palette.items()):
-            file.write(f"{number + 1:<5} #{color[0]:02X}{color[1]:02X}{color[2]:02X}   {count}\n")
+        file.write(format_colors_distribution(each_color_palette, file_format))
 
 
 def save_colors_distribution_for_image(image_name: str, each_color_palette: dict[tuple[int, int, int], int],
                                        folder: str = "outputs/") -> None:
-    with open(os.path.join(folder, f"{image_name}_colors.txt"), "w", encoding="utf-8") as file:
-        file.write("№     #RRGGBB   Count\n")
-        for (number, (color, count)) in enumerate(each_color_palette.items()):
-            file.write(f"{number + 1:<5} #{color[0]:02X}{color[1]:02X}{color[2]:02X}   {count}\n")
+    save_colors_distribution(f"{image_name}_colors.txt", each_color_palette, folder)
 
 
 def save_colors_distribution_to_color_images(image_name: str, each_color_palette: dict[tuple[int, int, int], int],
-                                             width: int, height: int, folder: str = "outputs/colors/") -> None:
-    for (number, (color, count)) in enumerate(each_color_palette.items()):
+                                             width: int, height: int, folder: str = "outputs/colors/",
+                                             workers: int | None = None) -> None:
+    def save_color_image(number: int, color: tuple[int, int, int], count: int) -> None:
         Image.new("RGB", (width, height), color=color).save(
-            os.path.join(folder, f"{image_name} - {number + 1} {color[0]:02X}{color[1]:02X}{color[2]:02X} {count}.png"))
+            os.path.join(folder, f"{image_name} - {number + 1} {rgb_to_hex(color)} {count}.png"))
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for future in [executor.submit(save_color_image, number, color, count)
+                       for (number, (color, count)) in enumerate(each_color_palette.items())]:
+            future.result()
+
+
+# один лист с образцами всех цветов: номер, цвет и количество под каждым образцом
+def create_colors_swatch_sheet(each_color_palette: dict[tuple[int, int, int], int], swatch_size: int = 64,
+                               columns: int = 8) -> Image:
+    font = get_font(11)
+    label_height = 3 * (font.getbbox("0")[3] + 2)
+    columns = max(1, min(columns, len(each_color_palette)))
+    rows = max(1, math.ceil(len(each_color_palette) / columns))
+    sheet = Image.new("RGB", (columns * swatch_size, rows * (swatch_size + label_height)), "white")
+    sheet_draw = ImageDraw.Draw(sheet)
+    for (number, (color, count)) in enumerate(each_color_palette.items()):
+        x = (number % columns) * swatch_size
+        y = (number // columns) * (swatch_size + label_height)
+        sheet_draw.rectangle(((x, y), (x + swatch_size - 1, y + swatch_size - 1)), fill=color, outline="black")
+        sheet_draw.multiline_text((x + 2, y + swatch_size + 1), f"{number + 1}\n#{rgb_to_hex(color)}\n{count}",
+                                  fill="black", font=font, spacing=2)
+    return sheet
+
+
+# отчёт по цветам: таблицы в выбранных форматах и лист образцов, файлы записываются параллельно
+def save_colors_report(image_name: str, each_color_palette: dict[tuple[int, int, int], int],
+                       folder: str = "outputs/", file_formats: tuple[str, ...] = COLORS_REPORT_FORMATS,
+                       swatch_size: int = 64, columns: int = 8, workers: int | None = None) -> None:
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(save_colors_distribution, f"{image_name}_colors.{file_format}",
+                                   each_color_palette, folder, file_format) for file_format in file_formats]
+        futures.append(executor.submit(
+            lambda: create_colors_swatch_sheet(each_color_palette, swatch_size, columns).save(
+                os.path.join(folder, f"{image_name}_colors.png"))))
+        for future in futures:
+            future.result()
+
+
+# значение пикселя заданного цвета для изображения в режиме "RGB", "L" или "P"
+# (в палитру изображения цвет добавляется при отсутствии)
+def _ink(image: Image, color: tuple[int, int, int]) -> int | tuple[int, int, int]:
+    if image.mode == "L":
+        return round(0.299 * color[0] + 0.587 * color[1] + 0.114 * color[2])
+    if image.mode == "P":
+        return ImageDraw.Draw(image).palette.getcolor(color, image)
+    return color
+
+
+def _overlay_canvas(image: Image) -> Image:
+    # копия мозаики для наложения: если в палитре режима "P" не осталось места для чёрного и белого
+    # (больше MAX_PALETTE_COLORS цветов заняты ячейками), наложение рисуется в RGB
+    if image.mode != "P":
+        return image.copy()
+    used = [index for (index, count) in enumerate(image.histogram()) if count > 0]
+    if len(used) > MAX_PALETTE_COLORS:
+        return image.convert("RGB")
+    if len(image.getpalette()) // 3 > MAX_PALETTE_COLORS:
+        # в дополненной до 256 цветов палитре PIL отдаёт чёрному и белому один и тот же свободный номер,
+        # поэтому в палитре оставляются только цвета ячеек
+        canvas = image.remap_palette(used)
+    else:
+        canvas = image.copy()
+    _ink(canvas, (0, 0, 0))
+    _ink(canvas, (255, 255, 255))
+    return canvas
+
+
+def _draw_grid(pixels: np.ndarray, multiplier: int, ink: int | tuple[int, int, int]) -> None:
+    pixels[::multiplier] = ink
+    pixels[-1] = ink
+    pixels[:, ::multiplier] = ink
+    pixels[:, -1] = ink
+
+
+# номера цветов ячеек: маски номеров из атласа вставляются сразу в целую строку ячеек,
+# inks - значения пикселей для номеров на светлых и на тёмных ячейках
+def _draw_numbers(pixels: np.ndarray, mosaic: Image, palette: list[tuple[int, int, int]], multiplier: int,
+                  numbers_size: int, inks: tuple[int | tuple[int, int, int], int | tuple[int, int, int]],
+                  blend: bool) -> None:
+    mosaic_palette, index_map = index_map_from_mosaic(mosaic, multiplier)
+    cell_numbers = np.array([palette.index(tuple(int(channel) for channel in color)) for color in mosaic_palette])
+    cell_numbers = cell_numbers[index_map]
+    light = np.array([is_light_color(color) for color in mosaic_palette])[index_map]
+    atlas = get_numbers_atlas(len(palette), numbers_size, multiplier)
+    rows, columns = index_map.shape
+
+    # полосы строк ячеек рисуются потоками пула, каждая полоса пишет только в свои строки пикселей
+    def draw_rows(start: int, stop: int) -> None:
+        for row in range(start, stop):
+            band = pixels[row * multiplier:(row + 1) * multiplier, :columns * multiplier]
+            alpha = atlas[cell_numbers[row]].transpose(1, 0, 2).reshape(multiplier, columns * multiplier)
+            ys, xs = np.nonzero(alpha)
+            ink = np.where(np.repeat(light[row], multiplier)[xs], 0, 1)
+            if not blend:
+                # в режиме "P" смешивать индексы нельзя, сглаживание заменяется порогом
+                visible = alpha[ys, xs] >= 128
+                band[ys[visible], xs[visible]] = np.asarray(inks)[ink[visible]]
+            else:
+                ink_values = np.asarray(inks, np.uint16)[ink]
+                weights = alpha[ys, xs].astype(np.uint16)
+                if band.ndim == 3:
+                    weights = weights[:, None]
+                band[ys, xs] = ((band[ys, xs] * (255 - weights) + ink_values * weights + 127) // 255).astype(np.uint8)
+
+    map_row_bands(draw_rows, rows)
 
 
 def create_image_with_numbers(image: Image, palette: list[tuple[int, int, int]], width: int, height: int,
                               multiplier: int,
                               numbers_size: int) -> Image:
-    image_with_numbers = image.copy()
-    image_with_numbers_draw = ImageDraw.Draw(image_with_numbers)
-    for x in range(0, width, multiplier):
-        for y in range(0, height, multiplier):
-            xy = (x + multiplier * 0.5, y + multiplier * 0.5)
-            color = image.getpixel(xy)
-            image_with_numbers_draw.text(xy, str(palette.index(color) + 1),
-                                         fill="black" if is_light_color(color) else "white",
-                                         anchor="mm", font=ImageFont.truetype("arial.ttf", numbers_size))
-    return image_with_numbers
+    image_with_numbers = _overlay_canvas(image)
+    inks = (_ink(image_with_numbers, (0, 0, 0)), _ink(image_with_numbers, (255, 255, 255)))
+    pixels = np.array(image_with_numbers)
+    _draw_numbers(pixels[:height, :width], image, palette, multiplier, numbers_size, inks,
+                  image_with_numbers.mode != "P")
+    return _image_from_pixels(pixels, image_with_numbers)
 
 
 def create_image_with_grid(image: Image, width: int, height: int, multiplier: int) -> Image:
-    image_with_grid = image.copy()
-    image_with_grid_draw = ImageDraw.Draw(image_with_grid)
-    for x in range(0, width, multiplier):
-        for y in range(0, height, multiplier):
-            w = x + multiplier
-            h = y + multiplier
-            if x == width - multiplier and y == height - multiplier:
-                image_with_grid_draw.rectangle(((x, y), (w - 1, h - 1)), outline="black")
-            elif x == width - multiplier:
-                image_with_grid_draw.rectangle(((x, y), (w - 1, h)), outline="black")
-            elif y == height - multiplier:
-                image_with_grid_draw.rectangle(((x, y), (w, h - 1)), outline="black")
-            else:
-                image_with_grid_draw.rectangle(((x, y), (w, h)), outline="black")
-
-    return image_with_grid
+    image_with_grid = _overlay_canvas(image)
+    pixels = np.array(image_with_grid)
+    _draw_grid(pixels[:height, :width], multiplier, _ink(image_with_grid, (0, 0, 0)))
+    return _image_from_pixels(pixels, image_with_grid)
 
 
 def create_image_with_numbers_and_grid(image: Image, palette: list[tuple[int, int, int]], width: int, height: int,
                                        multiplier: int,
                                        numbers_size: int) -> Image:
-    image_with_numbers_and_grid = image.copy()
-    image_with_numbers_and_grid_draw = ImageDraw.Draw(image_with_numbers_and_grid)
-    for x in range(0, width, multiplier):
-        for y in range(0, height, multiplier):
-            w = x + multiplier
-            h = y + multiplier
-            if x == width - multiplier and y == height - multiplier:
-                image_with_numbers_and_grid_draw.rectangle(((x, y), (w - 1, h - 1)), outline="black")
-            elif x == width - multiplier:
-                image_with_numbers_and_grid_draw.rectangle(((x, y), (w - 1, h)), outline="black")
-            elif y == height - multiplier:
-                image_with_numbers_and_grid_draw.rectangle(((x, y), (w, h - 1)), outline="black")
-            else:
-                image_with_numbers_and_grid_draw.rectangle(((x, y), (w, h)), outline="black")
-
-            color = image.getpixel((x, y))
-            image_with_numbers_and_grid_draw.text((x + multiplier * 0.5, y + multiplier * 0.5),
-                                                  str(palette.index(color) + 1),
-                                                  fill="black" if is_light_color(color) else "white",
-                                                  anchor="mm", font=ImageFont.truetype("arial.ttf", numbers_size))
-
-    return image_with_numbers_and_grid
+    image_with_numbers_and_grid = _overlay_canvas(image)
+    inks = (_ink(image_with_numbers_and_grid, (0, 0, 0)), _ink(image_with_numbers_and_grid, (255, 255, 255)))
+    pixels = np.array(image_with_numbers_and_grid)
+    _draw_grid(pixels[:height, :width], multiplier, inks[0])
+    _draw_numbers(pixels[:height, :width], image, palette, multiplier, numbers_size, inks,
+                  image_with_numbers_and_grid.mode != "P")
+    return _image_from_pixels(pixels, image_with_numbers_and_grid)
 
 
 def create_image_with_numbers_and_grid_without_color(image: Image, palette: list[tuple[int, int, int]], width: int,
                                                      height: int, multiplier: int,
                                                      numbers_size: int) -> Image:
-    image_with_numbers_and_grid_without_color = Image.new("RGB", (image.width, image.height), "white")
-    image_with_numbers_and_grid_without_color_draq = ImageDraw.Draw(image_with_numbers_and_grid_without_color)
-    for x in range(0, width, multiplier):
-        for y in range(0, height, multiplier):
-            w = x + multiplier
-            h = y + multiplier
-            if x == width - multiplier and y == height - multiplier:
-                image_with_numbers_and_grid_without_color_draq.rectangle(((x, y), (w - 1, h - 1)), outline="black")
-            elif x == width - multiplier:
-                image_with_numbers_and_grid_without_color_draq.rectangle(((x, y), (w - 1, h)), outline="black")
-            elif y == height - multiplier:
-                image_with_numbers_and_grid_without_color_draq.rectangle(((x, y), (w, h - 1)), outline="black")
-            else:
-                image_with_numbers_and_grid_without_color_draq.rectangle(((x, y), (w, h)), outline="black")
+    # для мозаики в режиме "P" чёрно-белое наложение хранится в режиме "L"
+    image_with_numbers_and_grid_without_color = Image.new("L" if image.mode == "P" else "RGB",
+                                                          (image.width, image.height), "white")
+    black = _ink(image_with_numbers_and_grid_without_color, (0, 0, 0))
+    pixels = np.array(image_with_numbers_and_grid_without_color)
+    _draw_grid(pixels[:height, :width], multiplier, black)
+    _draw_numbers(pixels[:height, :width], image, palette, multiplier, numbers_size, (black, black), True)
+    return _image_from_pixels(pixels, image_with_numbers_and_grid_without_color)
 
-            image_with_numbers_and_grid_without_color_draq.text((x + multiplier * 0.5, y + multiplier * 0.5),
-                                                                str(palette.index(image.getpixel((x, y))) + 1),
-                                                                fill="black", anchor="mm",
-                                                                font=ImageFont.truetype("arial.ttf", numbers_size))
 
-    return image_with_numbers_and_grid_without_color
+def _image_from_pixels(pixels: np.ndarray, image: Image) -> Image:
+    result = Image.fromarray(pixels, image.mode)
+    if image.mode == "P":
+        result.putpalette(image.getpalette())
+    return result
 
 
-def create_image_with_palette(image: Image, palette: tuple[int], width: int, height: int, multiplier: int) -> Image:
+def create_image_with_palette(image: Image, palette: tuple[int], width: int, height: int, multiplier: int,
+                              paletted: bool = False, dithering: str | None = None) -> Image:
     if len(palette) % 3 != 0:
         raise ValueError("palette % 3 must be zero")
+    if dithering is not None:
+        return dither_and_reresize_image(image, np.array(palette).reshape(-1, 3), width, height, multiplier, dithering,
+                                         paletted)
+    if len(palette) > 256 * 3:
+        # палитра больше, чем помещается в изображение "P": ближайший цвет ищется для каждого пикселя
+        colors = np.array(palette, np.uint8).reshape(-1, 3)
+        indexes = nearest_palette_indexes(np.asarray(image.convert("RGB")), colors)
+        cells = Image.fromarray(indexes.astype(np.int32), "I").resize((width, height), resample=NEAREST)
+        return mosaic_from_index_map(colors, np.asarray(cells), multiplier, paletted)
     palette_image = Image.new("P", (1, 1))
-    if len(palette) < 255:
-        palette = palette + (0, 0, 0) * (255 - len(palette))
-    palette_image.putpalette(palette)
-    return image.quantize(palette=palette_image).resize((width, height)).resize(
-        (width * multiplier, height * multiplier), resample=BOX).convert("RGB")
+    # палитра дополняется до 256 цветов повтором первого цвета, чтобы в ней не появлялся лишний чёрный
+    palette_image.putpalette(palette + palette[:3] * (256 - len(palette) // 3))
+    return reresize_image(image.quantize(palette=palette_image).resize((width, height)), width, height, multiplier,
+                          paletted)
+
+
+# палитра цветов, которые используются в изображении в режиме "P"
+def used_palette(image: Image) -> np.ndarray:
+    return np.asarray(image.getpalette(), np.uint8).reshape(-1, 3)[np.unique(np.asarray(image))]
+
+
+# уменьшение до размера в ячейках и раскраска ячеек заданной палитрой (k, 3) с дизерингом
+def dither_and_reresize_image(image: Image, palette: np.ndarray, width: int, height: int, multiplier: int,
+                              dithering: str, paletted: bool = False) -> Image:
+    return mosaic_from_index_map(palette, dither_cells(resize_image(image, width, height), palette, dithering),
+                                 multiplier, paletted)
 
 
 def quantize_image_pyxelate(image: Image, colors: int) -> Image:
@@ -231,9 +373,11 @@ def quantize_and_resize_image_pyxelate(image: Image, colors: int, width: int, he
     return Image.fromarray(Pyx(palette=colors, width=width, height=height).fit_transform(np.array(image)))
 
 
-def quantize_and_reresize_image_pyxelate(image: Image, colors: int, width: int, height: int, multiplier: int) -> Image:
-    return Image.fromarray(Pyx(palette=colors, width=width, height=height).fit_transform(np.array(image))).resize(
-        (width * multiplier, height * multiplier), resample=BOX).convert("RGB")
+def quantize_and_reresize_image_pyxelate(image: Image, colors: int, width: int, height: int, multiplier: int,
+                                         paletted: bool = False, dithering: str | None = None) -> Image:
+    cells = Image.fromarray(Pyx(palette=colors, width=width, height=height,
+                                dither=PYXELATE_DITHERING_MODES.get(dithering, "none")).fit_transform(np.array(image)))
+    return reresize_image(paletted_image(cells) if paletted else cells, width, height, multiplier, paletted)
 
 
 def create_image_with_palette_pyxelate(image: Image, palette: tuple[int]) -> Image:
@@ -246,45 +390,215 @@ def create_and_resize_image_with_palette_pyxelate(image: Image, palette: tuple[i
 
 
 def create_and_reresize_image_with_palette_pyxelate(image: Image, palette: tuple[int], width: int, height: int,
-                                                    multiplier: int) -> Image:
-    return Image.fromarray(
-        Pyx(palette=Pal.from_rgb(palette), width=width, height=height).fit_transform(np.array(image))).resize(
-        (width * multiplier, height * multiplier), resample=BOX).convert("RGB")
+                                                    multiplier: int, paletted: bool = False,
+                                                    dithering: str | None = None) -> Image:
+    cells = Image.fromarray(
+        Pyx(palette=Pal.from_rgb(palette), width=width, height=height,
+            dither=PYXELATE_DITHERING_MODES.get(dithering, "none")).fit_transform(np.array(image)))
+    return reresize_image(paletted_image(cells) if paletted else cells, width, height, multiplier, paletted)
 
 
 # -------------- combined functions --------------
-def create_mosaic_from_image_1(image: Image, colors: int, width: int, height: int, multiplier: int) -> Image:
-    return reresize_image(quantize_image(resize_image(image, width, height), colors), width, height, multiplier)
+# paletted=True оставляет мозаику в режиме "P" (в 3 раза меньше памяти), в RGB она переводится только при показе,
+# dithering - режим дизеринга из DITHERING_MODES (None - без дизеринга)
+def create_mosaic_from_image_1(image: Image, colors: int, width: int, height: int, multiplier: int,
+                               paletted: bool = False, dithering: str | None = None) -> Image:
+    cells = resize_image(image, width, height)
+    quantized_cells = quantize_image(cells, colors)
+    if dithering is not None:
+        return dither_and_reresize_image(cells, used_palette(quantized_cells), width, height, multiplier, dithering,
+                                         paletted)
+    return reresize_image(quantized_cells, width, height, multiplier, paletted)
+
+
+def create_mosaic_from_image_2(image: Image, colors: int, width: int, height: int, multiplier: int,
+                               paletted: bool = False, dithering: str | None = None) -> Image:
+    quantized_image = quantize_image(image, colors)
+    if dithering is not None:
+        return dither_and_reresize_image(image, used_palette(quantized_image), width, height, multiplier, dithering,
+                                         paletted)
+    return reresize_image(resize_image(quantized_image, width, height), width, height, multiplier, paletted)
+
+
+def create_mosaic_from_image_3(image: Image, colors: int, width: int, height: int, multiplier: int,
+                               paletted: bool = False, dithering: str | None = None) -> Image:
+    return quantize_and_reresize_image_pyxelate(image, colors, width, height, multiplier, paletted, dithering)
+
+
+# палитра подбирается мини-пакетным k-means по ячейкам (детерминированно, с ограничением по времени)
+def create_mosaic_from_image_4(image: Image, colors: int, width: int, height: int, multiplier: int,
+                               paletted: bool = False, dithering: str | None = None) -> Image:
+    cells = resize_image(image, width, height)
+    palette = fit_kmeans_palette(np.asarray(cells.convert("RGB")), colors)
+    if dithering is not None:
+        return dither_and_reresize_image(cells, palette, width, height, multiplier, dithering, paletted)
+    index_map = nearest_palette_indexes(np.asarray(cells.convert("RGB")), palette)
+    return mosaic_from_index_map(palette, index_map, multiplier, paletted)
+
+
+# палитра читается из иерархического разбиения ячеек, при смене количества цветов ячейки не квантуются заново
+def create_mosaic_from_image_5(image: Image, colors: int, width: int, height: int, multiplier: int,
+                               paletted: bool = False, dithering: str | None = None) -> Image:
+    cells = resize_image(image, width, height)
+    sweep = get_colors_sweep(cells)
+    if dithering is not None:
+        return dither_and_reresize_image(cells, sweep.palette(colors), width, height, multiplier, dithering, paletted)
+    return mosaic_from_index_map(sweep.palette(colors), sweep.index_map(colors), multiplier, paletted)
 
 
-def create_mosaic_from_image_2(image: Image, colors: int, width: int, height: int, multiplier: int) -> Image:
-    return reresize_image(resize_image(quantize_image(image, colors), width, height), width, height, multiplier)
+def create_mosaic_from_image_with_palette_1(image: Image, palette: tuple[tuple[int, int, int]], width: int,
+                                            height: int, multiplier: int, paletted: bool = False,
+                                            dithering: str | None = None) -> Image:
+    return create_image_with_palette(image, flat_colors_list_from_colors_palette(palette), width, height, multiplier,
+                                     paletted, dithering)
 
 
-def create_mosaic_from_image_3(image: Image, colors: int, width: int, height: int, multiplier: int) -> Image:
-    return quantize_and_reresize_image_pyxelate(image, colors, width, height, multiplier)
+def create_mosaic_from_image_with_palette_2(image: Image, palette: tuple[int], width: int,
+                                            height: int, multiplier: int, paletted: bool = False,
+                                            dithering: str | None = None) -> Image:
+    return create_and_reresize_image_with_palette_pyxelate(image, palette, width, height, multiplier, paletted,
+                                                           dithering)
 
 
-def create_mosaic_from_image_with_palette_1(image: Image, palette: tuple[tuple[int, int, int]], width: int,
-                                            height: int, multiplier: int) -> Image:
-    return create_image_with_palette(image, flat_colors_list_from_colors_palette(palette), width, height, multiplier)
+# из большой палитры наличия выбираются colors цветов, лучше всего передающих ячейки изображения
+def inventory_palette_subset(image: Image, inventory: tuple[tuple[int, int, int]], colors: int, width: int,
+                             height: int) -> list[tuple[int, int, int]]:
+    chosen = select_palette_subset(resize_image(image, width, height), np.array(inventory, np.uint8), colors)
+    return [tuple(inventory[index]) for index in chosen]
 
 
-def create_mosaic_from_image_with_palette_2(image: Image, palette: tuple[int], width: int,
-                                            height: int, multiplier: int) -> Image:
-    return create_and_reresize_image_with_palette_pyxelate(image, palette, width, height, multiplier)
+def create_mosaic_from_inventory(image: Image, inventory: tuple[tuple[int, int, int]], colors: int, width: int,
+                                 height: int, multiplier: int, paletted: bool = False, dithering: str | None = None,
+                                 coloring_function: Callable = create_mosaic_from_image_with_palette_1
+                                 ) -> tuple[Image, np.ndarray]:
+    """
+    The mosaic colored by the best colors colors subset of the inventory palette
+    and the number of cells of every inventory color
+
+    """
+    palette = inventory_palette_subset(image, inventory, colors, width, height)
+    mosaic = coloring_function(image, palette, width, height, multiplier, paletted, dithering)
+    return mosaic, inventory_counts(np.array(inventory, np.uint8), *index_map_from_mosaic(mosaic, multiplier))
+
+
+# запас цветов палитры (например, выбранных из палитры наличия) по запасу цветов палитры наличия
+def palette_stock(palette: tuple[tuple[int, int, int]], inventory: tuple[tuple[int, int, int]],
+                  stock: list[int]) -> list[int]:
+    inventory_stock = {tuple(color): count for (color, count) in zip(inventory, stock)}
+    return [inventory_stock[tuple(color)] for color in palette]
+
+
+def create_mosaic_with_stock(image: Image, palette: tuple[tuple[int, int, int]], stock: list[int], width: int,
+                             height: int, multiplier: int, paletted: bool = False) -> Image:
+    """
+    The mosaic colored by the palette so that color j covers at most stock[j] cells and the total color difference
+    from the image is minimal, raises InsufficientStockError if the stock is not enough (dithering is not applied)
+
+    """
+    palette = np.array(palette, np.uint8).reshape(-1, 3)
+    index_map = assign_cells_with_stock(resize_image(image, width, height), palette, np.array(stock, np.int64))
+    return mosaic_from_index_map(palette, index_map, multiplier, paletted)
 
 
 def get_colors_distribution(image: Image, multiplier: int) -> dict[tuple[int, int, int], int]:
-    distribution = {}
-    for x in range(0, image.width, multiplier):
-        for y in range(0, image.height, multiplier):
-            color = image.getpixel((x, y))
-            if color in distribution:
-                distribution[color] += 1
-            else:
-                distribution[color] = 1
-    return distribution
+    return colors_distribution_from_index_map(*index_map_from_mosaic(image, multiplier))
+
+
+# карта индексов ячеек и палитра мозаики (порядок цветов совпадает с обходом ячеек по столбцам)
+def index_map_from_mosaic(mosaic: Image, multiplier: int) -> tuple[np.ndarray, np.ndarray]:
+    mosaic_palette = np.asarray(mosaic.getpalette(), np.uint8).reshape(-1, 3) if mosaic.mode == "P" else None
+    keys = np.empty((-(-mosaic.height // multiplier), -(-mosaic.width // multiplier)), np.uint32)
+
+    # ключи цветов ячеек считаются полосами строк ячеек в потоках пула, целиком изображение в массив не копируется
+    def band_keys(start: int, stop: int) -> None:
+        band = mosaic.crop((0, start * multiplier, mosaic.width, min(mosaic.height, stop * multiplier)))
+        if mosaic_palette is not None:
+            cells = mosaic_palette[np.asarray(band)[::multiplier, ::multiplier]].astype(np.uint32)
+        else:
+            cells = np.asarray(band.convert("RGB"))[::multiplier, ::multiplier].astype(np.uint32)
+        keys[start:stop] = (cells[..., 0] << 16) | (cells[..., 1] << 8) | cells[..., 2]
+
+    map_row_bands(band_keys, keys.shape[0])
+    unique_keys, first_indexes, inverse = np.unique(keys.T.ravel(), return_index=True, return_inverse=True)
+    order = np.argsort(first_indexes)
+    ranks = np.empty_like(order)
+    ranks[order] = np.arange(len(order))
+    ordered_keys = unique_keys[order]
+    palette = np.stack([ordered_keys >> 16, (ordered_keys >> 8) & 0xFF, ordered_keys & 0xFF], axis=1).astype(np.uint8)
+    index_dtype = np.uint8 if len(palette) <= 256 else np.uint16
+    index_map = ranks[inverse].reshape(keys.shape[1], keys.shape[0]).T.astype(index_dtype)
+    return palette, index_map
+
+
+# мозаика из карты индексов ячеек и палитры
+def mosaic_from_index_map(palette: np.ndarray, index_map: np.ndarray, multiplier: int,
+                          paletted: bool = False) -> Image:
+    palette = np.asarray(palette, np.uint8)
+    if paletted and len(palette) <= 256:
+        mosaic = Image.fromarray(upscale_cells(index_map.astype(np.uint8), multiplier), "P")
+        mosaic.putpalette(palette.tobytes())
+        return mosaic
+    # мозаика в RGB сразу собирается из цветов палитры, без перевода из "P"
+    return Image.fromarray(upscale_cells(index_map, multiplier, palette), "RGB")
+
+
+def upscale_cells(cells: np.ndarray, multiplier: int, palette: np.ndarray | None = None) -> np.ndarray:
+    """
+    Pixels of the cells (h, w) or (h, w, c) enlarged to multiplier x multiplier squares, the cells are indexes
+    of the palette colors if the palette is given; bands of cell rows are enlarged by the threads of the pool
+
+    """
+    height, width = cells.shape[:2]
+    channels = cells.shape[2:] if palette is None else palette.shape[1:]
+    pixels = np.empty((height, multiplier, width, multiplier) + channels, cells.dtype if palette is None else
+                      palette.dtype)
+
+    def upscale_band(start: int, stop: int) -> None:
+        band = cells[start:stop] if palette is None else palette[cells[start:stop]]
+        pixels[start:stop] = np.expand_dims(band, (1, 3))
+
+    map_row_bands(upscale_band, height)
+    return pixels.reshape((height * multiplier, width * multiplier) + channels)
+
+
+def iterate_mosaic_bands(palette: np.ndarray, index_map: np.ndarray, multiplier: int,
+                         overlay_function: Callable | None = None, numbers_size: int | None = None,
+                         rows: int = 16) -> Iterator[Image]:
+    """
+    The mosaic with the overlay built in horizontal bands of rows cell rows, top to bottom,
+    so the whole image never exists in memory
+
+    """
+    colors_distribution = colors_distribution_from_index_map(palette, index_map)
+    for start in range(0, index_map.shape[0], rows):
+        stop = min(start + rows, index_map.shape[0])
+        # полоса строится с лишней строкой ячеек: нижняя граница сетки должна быть только у последней полосы
+        extra = 1 if stop < index_map.shape[0] else 0
+        band = mosaic_from_index_map(palette, index_map[start:stop + extra], multiplier, paletted=True)
+        if overlay_function is not None:
+            band = overlay_function(band, colors_distribution, multiplier, numbers_size=numbers_size)
+        yield band.crop((0, 0, band.width, (stop - start) * multiplier)) if extra else band
+
+
+def create_reproducible_mosaic(coloring_function: Callable, image: Image, colors: int | tuple, width: int,
+                               height: int, dithering: str | None = None) -> tuple[np.ndarray, np.ndarray, str]:
+    """
+    Palette, index map and fingerprint of the mosaic created in the deterministic mode,
+    the palette is ordered by frequency of colors, then by color value
+
+    """
+    with deterministic_mode():
+        mosaic = coloring_function(image, colors, width, height, 1, paletted=True, dithering=dithering)
+    palette, index_map = canonical_palette_order(*index_map_from_mosaic(mosaic, 1))
+    return palette, index_map, mosaic_fingerprint(palette, index_map)
+
+
+def colors_distribution_from_index_map(palette: np.ndarray, index_map: np.ndarray) -> dict[tuple[int, int, int], int]:
+    # количество ячеек каждого цвета считается полосами в потоках пула и складывается
+    counts = np.sum(map_row_bands(lambda start, stop: np.bincount(index_map[start:stop].ravel(),
+                                                                  minlength=len(palette)), index_map.shape[0]),
+                    axis=0, dtype=np.int64)
+    return {tuple(int(channel) for channel in color): int(count) for color, count in zip(palette, counts)}
 
 
 def add_grid_to_mosaic(mosaic: Image, _: dict[tuple[int, int, int], int], multiplier: int, **kwargs: dict) -> Image:
@@ -318,6 +632,18 @@ def add_raw_grid_and_numbers_to_mosaic(mosaic: Image, colors_distribution: dict[
                                                             mosaic.height, multiplier, numbers_size)
 
 
+# функции раскраски и наложения по именам (имена сохраняются в проектах и передаются в запросах)
+COLORING_FUNCTIONS = {function.__name__: function for function in (
+    create_mosaic_from_image_1, create_mosaic_from_image_2, create_mosaic_from_image_3, create_mosaic_from_image_4,
+    create_mosaic_from_image_5, create_mosaic_from_image_with_palette_1, create_mosaic_from_image_with_palette_2)}
+OVERLAY_FUNCTIONS = {function.__name__: function for function in (
+    add_grid_to_mosaic, add_numbers_to_mosaic, add_grid_and_numbers_to_mosaic, add_raw_grid_and_numbers_to_mosaic)}
+PALETTE_COLORING_FUNCTIONS = (create_mosaic_from_image_with_palette_1, create_mosaic_from_image_with_palette_2)
+# функции, которые сначала уменьшают изображение до размера в ячейках (им можно передавать уровень пирамиды)
+PYRAMID_COLORING_FUNCTIONS = (create_mosaic_from_image_1, create_mosaic_from_image_3, create_mosaic_from_image_4,
+                              create_mosaic_from_image_5, create_mosaic_from_image_with_palette_2)
+
+
 if __name__ == "__main__":
     pass
 
@@ -0,0 +1,153 @@
+import hashlib
+import threading
+import time
+
+import numpy as np
+
+from color_space import nearest_palette_indexes
+from determinism import is_deterministic
+
+# фиксированное зерно, чтобы одинаковые входные данные давали одинаковую палитру
+KMEANS_SEED = 0
+# количество пикселей, по которым подбирается палитра
+KMEANS_SAMPLE_SIZE = 20000
+KMEANS_BATCH_SIZE = 1024
+KMEANS_MAX_ITERATIONS = 200
+# время подбора палитры в секундах (None - без ограничения), чтобы живой предпросмотр оставался отзывчивым
+KMEANS_TIME_BUDGET = 0.25
+# подбор останавливается, когда центры сдвигаются меньше порога
+KMEANS_TOLERANCE = 0.05
+# сколько последних наборов пикселей помнят свои палитры для тёплого старта
+WARM_START_CACHE_SIZE = 4
+
+# отпечаток набора пикселей -> {количество цветов: палитра}, палитры подбираются из нескольких потоков
+_fitted_palettes: dict[str, dict[int, np.ndarray]] = {}
+_lock = threading.Lock()
+
+
+def sample_pixels(pixels: np.ndarray, size: int = KMEANS_SAMPLE_SIZE, seed: int = KMEANS_SEED) -> np.ndarray:
+    """
+    Deterministic random sample of pixels (n, 3) as float64
+
+    """
+    pixels = pixels.reshape(-1, 3)
+    if len(pixels) > size:
+        pixels = pixels[np.random.default_rng(seed).choice(len(pixels), size, replace=False)]
+    return pixels.astype(np.float64)
+
+
+def kmeans_plus_plus(samples: np.ndarray, colors: int, rng: np.random.Generator,
+                     centers: np.ndarray | None = None) -> np.ndarray:
+    """
+    k-means++ seeding: every next center is chosen with probability proportional to the squared distance
+    to the nearest already chosen center, existing centers are kept
+
+    """
+    if centers is None or len(centers) == 0:
+        centers = samples[rng.integers(len(samples))][None, :]
+    distances = ((samples[:, None, :] - centers[None, :, :]) ** 2).sum(axis=2).min(axis=1)
+    centers = list(centers)
+    while len(centers) < colors:
+        total = distances.sum()
+        index = rng.choice(len(samples), p=distances / total) if total > 0 else rng.integers(len(samples))
+        centers.append(samples[index])
+        distances = np.minimum(distances, ((samples - samples[index]) ** 2).sum(axis=1))
+    return np.array(centers, np.float64)
+
+
+def merge_closest_centers(centers: np.ndarray, weights: np.ndarray, colors: int) -> np.ndarray:
+    """
+    Reducing the number of centers by merging the closest pairs into their weighted average
+
+    """
+    centers = centers.copy()
+    weights = weights.astype(np.float64) + 1e-9
+    while len(centers) > colors:
+        distances = ((centers[:, None, :] - centers[None, :, :]) ** 2).sum(axis=2)
+        np.fill_diagonal(distances, np.inf)
+        first, second = np.unravel_index(distances.argmin(), distances.shape)
+        total = weights[first] + weights[second]
+        centers[first] = (centers[first] * weights[first] + centers[second] * weights[second]) / total
+        weights[first] = total
+        centers = np.delete(centers, second, axis=0)
+        weights = np.delete(weights, second)
+    return centers
+
+
+def minibatch_kmeans(samples: np.ndarray, centers: np.ndarray, rng: np.random.Generator,
+                     batch_size: int = KMEANS_BATCH_SIZE, max_iterations: int = KMEANS_MAX_ITERATIONS,
+                     time_budget: float | None = KMEANS_TIME_BUDGET) -> np.ndarray:
+    """
+    Mini-batch k-means (per-center learning rate 1 / number of assigned samples) with a final full assignment step
+
+    """
+    started = time.perf_counter()
+    centers = centers.copy()
+    counts = np.zeros(len(centers))
+    for _ in range(max_iterations):
+        batch = samples[rng.integers(0, len(samples), min(batch_size, len(samples)))]
+        labels = nearest_palette_indexes(batch, centers)
+        batch_counts = np.bincount(labels, minlength=len(centers))
+        batch_sums = np.stack([np.bincount(labels, batch[:, channel], len(centers)) for channel in range(3)], axis=1)
+        counts += batch_counts
+        assigned = batch_counts > 0
+        shift = (batch_sums[assigned] - batch_counts[assigned, None] * centers[assigned]) / counts[assigned, None]
+        centers[assigned] += shift
+        if len(shift) == 0 or np.abs(shift).max() < KMEANS_TOLERANCE:
+            break
+        if time_budget is not None and time.perf_counter() - started > time_budget:
+            break
+
+    # шаг Ллойда по всей выборке: центры становятся средними своих пикселей
+    labels = nearest_palette_indexes(samples, centers)
+    sizes = np.bincount(labels, minlength=len(centers))
+    used = sizes > 0
+    for channel in range(3):
+        centers[used, channel] = np.bincount(labels, samples[:, channel], len(centers))[used] / sizes[used]
+    return centers
+
+
+def fit_kmeans_palette(pixels: np.ndarray, colors: int, seed: int = KMEANS_SEED,
+                       time_budget: float | None = KMEANS_TIME_BUDGET, warm_start: bool = True) -> np.ndarray:
+    """
+    Palette (colors, 3) uint8 fitted to the pixels with mini-batch k-means on a deterministic sample
+
+    With warm_start the fit starts from the palette already fitted to the same pixels for a neighbouring number
+    of colors (the closest centers are merged or k-means++ centers are added), so stepping the colors count
+    converges in a few batches
+
+    In the deterministic mode the fit always starts from scratch and is not limited by time,
+    so the palette depends only on the pixels and the seed
+
+    """
+    if is_deterministic():
+        time_budget, warm_start = None, False
+    samples = sample_pixels(pixels, seed=seed)
+    colors = max(1, min(colors, len(np.unique(samples, axis=0))))
+    rng = np.random.default_rng(seed)
+    key = hashlib.sha1(samples.tobytes()).hexdigest()
+    with _lock:
+        fitted = dict(_fitted_palettes.get(key, {})) if warm_start else {}
+
+    if colors in fitted:
+        return fitted[colors]
+    neighbours = sorted(fitted, key=lambda count: abs(count - colors))
+    if neighbours:
+        previous = fitted[neighbours[0]].astype(np.float64)
+        if len(previous) > colors:
+            weights = np.bincount(nearest_palette_indexes(samples, previous), minlength=len(previous))
+            initial_centers = merge_closest_centers(previous, weights, colors)
+        else:
+            initial_centers = kmeans_plus_plus(samples, colors, rng, previous)
+    else:
+        initial_centers = kmeans_plus_plus(samples, colors, rng)
+
+    palette = np.clip(np.rint(minibatch_kmeans(samples, initial_centers, rng, time_budget=time_budget)),
+                      0, 255).astype(np.uint8)
+    if warm_start:
+        with _lock:
+            # палитры, подобранные другими потоками за это время, сохраняются
+            _fitted_palettes[key] = {**_fitted_palettes.pop(key, {}), colors: palette}
+            while len(_fitted_palettes) > WARM_START_CACHE_SIZE:
+                del _fitted_palettes[next(iter(_fitted_palettes))]
+    return palette
@@ -0,0 +1,84 @@
+import ctypes
+import os
+
+# доля доступной памяти, которую может занять построение мозаики
+MEMORY_BUDGET_FRACTION = 0.5
+# бюджет, если доступную память узнать не удалось
+DEFAULT_MEMORY_BUDGET = 2 * 1024 ** 3
+# часть бюджета на одну полосу при построении мозаики полосами (несколько полос сжимаются одновременно)
+BAND_BUDGET_FRACTION = 1 / 16
+
+# байт на пиксель мозаики: изображение в "P", копия с наложением и её массив, QImage и QPixmap (ARGB32) при показе
+_MOSAIC_BYTES_PER_PIXEL = 1
+_OVERLAY_BYTES_PER_PIXEL = 2
+_DISPLAY_BYTES_PER_PIXEL = 1 + 4
+# в режиме RGB каждое изображение занимает в 3 раза больше
+_RGB_FACTOR = 3
+# карта индексов, промежуточные массивы ячеек и т.п. на одну ячейку
+_BYTES_PER_CELL = 64
+
+
+class _MemoryStatus(ctypes.Structure):
+    _fields_ = [("length", ctypes.c_ulong), ("memory_load", ctypes.c_ulong),
+                ("total_physical", ctypes.c_ulonglong), ("available_physical", ctypes.c_ulonglong),
+                ("total_page_file", ctypes.c_ulonglong), ("available_page_file", ctypes.c_ulonglong),
+                ("total_virtual", ctypes.c_ulonglong), ("available_virtual", ctypes.c_ulonglong),
+                ("available_extended_virtual", ctypes.c_ulonglong)]
+
+
+def available_memory() -> int | None:
+    """
+    Available physical memory in bytes or None if it can not be determined
+
+    """
+    if os.name == "nt":
+        status = _MemoryStatus()
+        status.length = ctypes.sizeof(_MemoryStatus)
+        if ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(status)):
+            return status.available_physical
+        return None
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def memory_budget() -> int:
+    memory = available_memory()
+    return int(memory * MEMORY_BUDGET_FRACTION) if memory is not None else DEFAULT_MEMORY_BUDGET
+
+
+def estimate_mosaic_memory(width: int, height: int, multiplier: int, overlay: bool = False, paletted: bool = True,
+                           display: bool = True) -> int:
+    """
+    Estimated peak memory in bytes for building the mosaic of width x height cells (and showing it)
+
+    """
+    bytes_per_pixel = _MOSAIC_BYTES_PER_PIXEL + (_OVERLAY_BYTES_PER_PIXEL if overlay else 0)
+    if not paletted:
+        bytes_per_pixel *= _RGB_FACTOR
+    if display:
+        bytes_per_pixel += _DISPLAY_BYTES_PER_PIXEL
+    return width * height * (multiplier ** 2 * bytes_per_pixel + _BYTES_PER_CELL)
+
+
+def fitting_multiplier(width: int, height: int, multiplier: int, overlay: bool = False,
+                       budget: int | None = None) -> int:
+    """
+    The largest multiplier not greater than the given one whose mosaic fits into the budget, 0 if none fits
+
+    """
+    budget = memory_budget() if budget is None else budget
+    while multiplier > 0 and estimate_mosaic_memory(width, height, multiplier, overlay) > budget:
+        multiplier -= 1
+    return multiplier
+
+
+def band_rows(width: int, height: int, multiplier: int, overlay: bool = False, budget: int | None = None) -> int:
+    """
+    Number of cell rows in one band for building the mosaic band by band within the budget
+
+    """
+    budget = memory_budget() if budget is None else budget
+    row_memory = estimate_mosaic_memory(width, 1, multiplier, overlay, display=False)
+    return max(1, min(height, int(budget * BAND_BUDGET_FRACTION) // row_memory))
@@ -0,0 +1,157 @@
+import numpy as np
+from PIL import Image
+from PIL.Image import NEAREST
+
+from color_space import rgb_to_lab
+from color_sweep import get_colors_sweep
+from palette_subset import cells_colors, distance_matrix, greedy_palette_order, refine_palette_subset
+
+# ΔE, которую глаз едва замечает
+JUST_NOTICEABLE_DELTA_E = 2.3
+# ΔE, которой соответствует верхний цвет тепловой карты, если максимум не задан
+HEATMAP_MAX_DELTA_E = 20.0
+# опорные цвета тепловой карты: от тёмно-синего (нет ошибки) до жёлтого (максимальная ошибка)
+_HEATMAP_COLORS = np.array([[0, 0, 64], [128, 0, 160], [230, 60, 60], [255, 170, 0], [255, 255, 160]], np.float64)
+
+
+def delta_e_76(lab: np.ndarray, other_lab: np.ndarray) -> np.ndarray:
+    return np.sqrt(((lab - other_lab) ** 2).sum(axis=-1))
+
+
+def delta_e_2000(lab: np.ndarray, other_lab: np.ndarray) -> np.ndarray:
+    """
+    Color difference CIEDE2000 of CIELAB colors, last axis - channels
+
+    """
+    l1, a1, b1 = lab[..., 0], lab[..., 1], lab[..., 2]
+    l2, a2, b2 = other_lab[..., 0], other_lab[..., 1], other_lab[..., 2]
+    mean_c = (np.hypot(a1, b1) + np.hypot(a2, b2)) / 2
+    g = 0.5 * (1 - np.sqrt(mean_c ** 7 / (mean_c ** 7 + 25.0 ** 7)))
+    a1, a2 = a1 * (1 + g), a2 * (1 + g)
+    c1, c2 = np.hypot(a1, b1), np.hypot(a2, b2)
+    h1, h2 = np.degrees(np.arctan2(b1, a1)) % 360, np.degrees(np.arctan2(b2, a2)) % 360
+    chroma = (c1 * c2) != 0
+
+    delta_l = l2 - l1
+    delta_c = c2 - c1
+    delta_h = np.where(chroma, (h2 - h1 + 180) % 360 - 180, 0.0)
+    delta_big_h = 2 * np.sqrt(c1 * c2) * np.sin(np.radians(delta_h) / 2)
+
+    mean_l = (l1 + l2) / 2
+    mean_c = (c1 + c2) / 2
+    mean_h = np.where(chroma, np.where(np.abs(h1 - h2) > 180, (h1 + h2 + 360) / 2 % 360, (h1 + h2) / 2), h1 + h2)
+    t = (1 - 0.17 * np.cos(np.radians(mean_h - 30)) + 0.24 * np.cos(np.radians(2 * mean_h))
+         + 0.32 * np.cos(np.radians(3 * mean_h + 6)) - 0.20 * np.cos(np.radians(4 * mean_h - 63)))
+    s_l = 1 + 0.015 * (mean_l - 50) ** 2 / np.sqrt(20 + (mean_l - 50) ** 2)
+    s_c = 1 + 0.045 * mean_c
+    s_h = 1 + 0.015 * mean_c * t
+    r_t = (-2 * np.sqrt(mean_c ** 7 / (mean_c ** 7 + 25.0 ** 7))
+           * np.sin(np.radians(60 * np.exp(-(((mean_h - 275) / 25) ** 2)))))
+    return np.sqrt((delta_l / s_l) ** 2 + (delta_c / s_c) ** 2 + (delta_big_h / s_h) ** 2
+                   + r_t * (delta_c / s_c) * (delta_big_h / s_h))
+
+
+DELTA_E_FORMULAS = {"cie76": delta_e_76, "ciede2000": delta_e_2000}
+
+
+def cell_delta_e(cells: Image, palette: np.ndarray, index_map: np.ndarray,
+                 formula: str = "ciede2000") -> np.ndarray:
+    """
+    Per cell color difference (h, w) between the cell-averaged source (cells, the source resized to the mosaic size)
+    and the mosaic given by the palette and the index map
+
+    """
+    cells_lab = rgb_to_lab(np.asarray(cells.convert("RGB")))
+    # палитра переводится в Lab один раз, ячейки берут свой цвет по индексу
+    return DELTA_E_FORMULAS[formula](cells_lab, rgb_to_lab(palette)[index_map]).astype(np.float32)
+
+
+def error_summary(delta_e: np.ndarray) -> dict[str, float]:
+    """
+    Summary of the per cell errors: mean, median, 95th percentile, maximum and share of noticeable errors
+
+    """
+    return {"mean": float(delta_e.mean()), "median": float(np.median(delta_e)),
+            "p95": float(np.percentile(delta_e, 95)), "max": float(delta_e.max()),
+            "noticeable": float((delta_e > JUST_NOTICEABLE_DELTA_E).mean())}
+
+
+def error_heatmap(delta_e: np.ndarray, multiplier: int = 1, max_delta_e: float | None = HEATMAP_MAX_DELTA_E) -> Image:
+    """
+    Heatmap of the per cell errors, max_delta_e and above get the top color (None - the maximum error)
+
+    """
+    if max_delta_e is None:
+        max_delta_e = max(float(delta_e.max()), 1e-6)
+    position = np.clip(delta_e / max_delta_e, 0, 1) * (len(_HEATMAP_COLORS) - 1)
+    lower = np.minimum(position.astype(np.intp), len(_HEATMAP_COLORS) - 2)
+    fraction = (position - lower)[..., None]
+    pixels = _HEATMAP_COLORS[lower] * (1 - fraction) + _HEATMAP_COLORS[lower + 1] * fraction
+    heatmap = Image.fromarray(np.rint(pixels).astype(np.uint8), "RGB")
+    return heatmap.resize((heatmap.width * multiplier, heatmap.height * multiplier), resample=NEAREST)
+
+
+def auto_colors(cells: Image, target: float, min_colors: int = 2, max_colors: int = 256,
+                formula: str = "ciede2000") -> tuple[int, float]:
+    """
+    The fewest colors count whose mean per cell error is at most target and that mean error,
+    the largest allowed colors count if the target is not reached
+
+    Palettes and index maps of all candidates are read off the cached colors sweep of the cells, the Lab colors
+    of the cells are converted once, the colors count is found by bisection (the error falls with more colors)
+
+    """
+    sweep = get_colors_sweep(cells)
+    cells_lab = rgb_to_lab(np.asarray(cells.convert("RGB")))
+    errors: dict[int, float] = {}
+
+    def mean_error(colors: int) -> float:
+        if colors not in errors:
+            errors[colors] = float(DELTA_E_FORMULAS[formula](
+                cells_lab, rgb_to_lab(sweep.palette(colors))[sweep.index_map(colors)]).mean())
+        return errors[colors]
+
+    high = max(1, min(max_colors, sweep.max_colors))
+    low = max(1, min(min_colors, high))
+    if mean_error(high) > target:
+        return high, mean_error(high)
+    while low < high:
+        middle = (low + high) // 2
+        if mean_error(middle) <= target:
+            high = middle
+        else:
+            low = middle + 1
+    return low, mean_error(low)
+
+
+def auto_palette_subset(cells: Image, inventory: np.ndarray, target: float, min_colors: int = 2,
+                        max_colors: int = 256, formula: str = "ciede2000") -> tuple[np.ndarray, float]:
+    """
+    Indexes of the smallest subset of the inventory palette (n, 3) whose mean per cell error is at most target
+    and that mean error, the largest allowed subset if the target is not reached
+
+    The distance matrix of cell colors and inventory colors and the greedy order are computed once,
+    candidates are prefixes of the greedy order found by bisection, only the result is refined by k-medoids
+
+    """
+    inventory = np.asarray(inventory, np.uint8).reshape(-1, 3)
+    inventory_lab = rgb_to_lab(inventory)
+    cell_colors, weights = cells_colors(cells)
+    distances = distance_matrix(cell_colors, inventory_lab)
+    order = greedy_palette_order(distances, weights, max(1, min(max_colors, len(inventory))))
+
+    def mean_error(chosen: np.ndarray) -> float:
+        nearest = chosen[distances[:, chosen].argmin(axis=1)]
+        return float(weights @ DELTA_E_FORMULAS[formula](cell_colors, inventory_lab[nearest]) / weights.sum())
+
+    high = len(order)
+    low = max(1, min(min_colors, high))
+    if mean_error(order[:high]) <= target:
+        while low < high:
+            middle = (low + high) // 2
+            if mean_error(order[:middle]) <= target:
+                high = middle
+            else:
+                low = middle + 1
+    chosen = np.sort(refine_palette_subset(distances, weights, order[:high]))
+    return chosen, mean_error(chosen)
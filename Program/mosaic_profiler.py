@@ -0,0 +1,220 @@
+"""
+Profiling of one mosaic run: where inside coloring, overlay and export the time goes
+
+The run is wrapped in a sampling profiler (stacks of the running threads are sampled with a fixed interval,
+low overhead, worker threads of thread pools are included) or a deterministic one (every call of the calling
+thread is timed, the internal pool runs the bands in the calling thread meanwhile).
+The profile is written next to the output as collapsed stacks (flamegraph.pl, inferno) and as a speedscope file,
+the root frame and the profile name hold the image size and the mosaic parameters
+
+Run: python mosaic_profiler.py images/image.png mosaic.png --colors 8 --width 50 --height 50 --multiplier 10
+"""
+import argparse
+import concurrent.futures.thread
+import json
+import os.path
+import sys
+import threading
+import time
+from types import CodeType, FrameType
+from typing import Any, Callable, TypeVar
+
+from image_exporter import save_png
+from image_loader import open_oriented_image
+from image_processor import build_image_pyramid, colors_palette_from_hex_colors
+from parallel import get_threads, set_threads
+from pipeline import MosaicSpec, Pipeline
+
+PROFILER_MODES = ("sampling", "deterministic")
+# интервал выборки стеков в секундах (поток выборки получает GIL не чаще sys.getswitchinterval())
+DEFAULT_SAMPLING_INTERVAL = 0.001
+# кадр, ниже которого в потоке пула выполняется задача, а без задачи поток простаивает
+POOL_WORKER_CODE = concurrent.futures.thread._worker.__code__
+POOL_FRAME = "[thread pool]"
+PROFILE_EXTENSIONS = {"collapsed": ".profile.collapsed", "speedscope": ".profile.speedscope.json"}
+
+T = TypeVar("T")
+
+
+def _code_name(code: CodeType) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _thread_stack(frame: FrameType, stop_frame: FrameType | None) -> tuple[str, ...] | None:
+    # стек от корня до листа: в вызывающем потоке - ниже кадра профилировщика, в потоке пула - ниже цикла пула;
+    # простаивающие потоки пула и прочие потоки (интерфейса, фоновых задач) пропускаются
+    names = []
+    while frame is not None:
+        if frame is stop_frame:
+            return tuple(reversed(names)) if names else None
+        if frame.f_code is POOL_WORKER_CODE:
+            return (POOL_FRAME, *reversed(names)) if names else None
+        names.append(_code_name(frame.f_code))
+        frame = frame.f_back
+    return None
+
+
+def _sampling_profile(function: Callable[[], T], interval: float) -> tuple[T, dict[tuple[str, ...], float]]:
+    stacks: dict[tuple[str, ...], float] = {}
+    caller = threading.get_ident()
+    caller_frame = sys._getframe()
+    stop = threading.Event()
+
+    def sample() -> None:
+        sampler = threading.get_ident()
+        last = time.perf_counter()
+        while not stop.wait(interval):
+            # вес выборки - прошедшее время, а не интервал: поток выборки может просыпаться позже
+            now = time.perf_counter()
+            elapsed, last = now - last, now
+            for (ident, frame) in sys._current_frames().items():
+                if ident == sampler:
+                    continue
+                stack = _thread_stack(frame, caller_frame if ident == caller else None)
+                if stack is not None:
+                    stacks[stack] = stacks.get(stack, 0.0) + elapsed
+
+    sampler_thread = threading.Thread(target=sample, name="mosaic-profiler", daemon=True)
+    sampler_thread.start()
+    try:
+        result = function()
+    finally:
+        stop.set()
+        sampler_thread.join()
+    return result, stacks
+
+
+def _deterministic_profile(function: Callable[[], T]) -> tuple[T, dict[tuple[str, ...], float]]:
+    stacks: dict[tuple[str, ...], float] = {}
+    # открытые вызовы: [имя, время начала, время вложенных вызовов]
+    calls: list[list] = []
+
+    def hook(frame: FrameType, event: str, argument: Any) -> None:
+        now = time.perf_counter()
+        if event == "call":
+            calls.append([_code_name(frame.f_code), now, 0.0])
+        elif event == "c_call":
+            calls.append([getattr(argument, "__qualname__", repr(argument)), now, 0.0])
+        elif calls:
+            # return, c_return, c_exception: собственное время вызова добавляется к его стеку
+            name, started, nested = calls.pop()
+            elapsed = now - started
+            stack = (*(call[0] for call in calls), name)
+            stacks[stack] = stacks.get(stack, 0.0) + elapsed - nested
+            if calls:
+                calls[-1][2] += elapsed
+
+    threads = get_threads()
+    set_threads(1)
+    sys.setprofile(hook)
+    try:
+        result = function()
+    finally:
+        sys.setprofile(None)
+        set_threads(threads)
+    return result, stacks
+
+
+def profile_call(function: Callable[[], T], mode: str = "sampling",
+                 interval: float = DEFAULT_SAMPLING_INTERVAL) -> tuple[T, dict[tuple[str, ...], float]]:
+    """
+    Result of function() and its profile: seconds spent in every stack (tuple of frames from the root),
+    for the deterministic mode it is the own time of the innermost call
+
+    """
+    if mode == "sampling":
+        return _sampling_profile(function, interval)
+    if mode == "deterministic":
+        return _deterministic_profile(function)
+    raise ValueError(f"unknown profiler mode: {mode}")
+
+
+def profile_tag(image_size: tuple[int, int], spec: MosaicSpec) -> str:
+    """
+    Image size and mosaic parameters for the name of the profile
+
+    """
+    colors = spec.colors if isinstance(spec.colors, int) else f"palette of {len(spec.colors)}"
+    parameters = [f"image {image_size[0]}x{image_size[1]}",
+                  f"mosaic {spec.width}x{spec.height}x{spec.multiplier}", spec.coloring, f"colors {colors}"]
+    parameters += [f"{name} {value}" for (name, value) in
+                   (("overlay", spec.overlay), ("numbers", spec.numbers_size), ("dithering", spec.dithering),
+                    ("subset", spec.palette_subset)) if value is not None]
+    if spec.stock is not None:
+        parameters.append("stock")
+    return ", ".join(parameters)
+
+
+def write_collapsed_stacks(file_name: str, stacks: dict[tuple[str, ...], float], root: str) -> None:
+    """
+    Collapsed stacks: a line "root;frame;...;frame microseconds" per stack
+
+    """
+    with open(file_name, "w", encoding="utf-8") as file:
+        for (stack, seconds) in sorted(stacks.items()):
+            microseconds = round(seconds * 1e6)
+            if microseconds > 0:
+                frames = ";".join(name.replace(";", ",") for name in (root, *stack))
+                file.write(f"{frames} {microseconds}\n")
+
+
+def write_speedscope(file_name: str, stacks: dict[tuple[str, ...], float], root: str) -> None:
+    """
+    Speedscope file with one sampled profile: a sample per stack weighted by its seconds
+
+    """
+    frame_indexes: dict[str, int] = {}
+    samples = [[frame_indexes.setdefault(name, len(frame_indexes)) for name in (root, *stack)]
+               for stack in sorted(stacks)]
+    weights = [stacks[stack] for stack in sorted(stacks)]
+    profile = {"$schema": "https://www.speedscope.app/file-format-schema.json", "name": root,
+               "exporter": "3DMosaic", "activeProfileIndex": 0,
+               "shared": {"frames": [{"name": name} for name in frame_indexes]},
+               "profiles": [{"type": "sampled", "name": root, "unit": "seconds", "startValue": 0,
+                             "endValue": sum(weights), "samples": samples, "weights": weights}]}
+    with open(file_name, "w", encoding="utf-8") as file:
+        json.dump(profile, file)
+
+
+def save_profile(output_name: str, stacks: dict[tuple[str, ...], float], tag: str) -> list[str]:
+    """
+    Writing the profile next to the output file in both formats, the result is the names of the profile files
+
+    """
+    base_name = os.path.splitext(output_name)[0]
+    file_names = [base_name + extension for extension in PROFILE_EXTENSIONS.values()]
+    write_collapsed_stacks(file_names[0], stacks, tag)
+    write_speedscope(file_names[1], stacks, tag)
+    return file_names
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="3DMosaic mosaic profiler")
+    parser.add_argument("image")
+    parser.add_argument("output")
+    parser.add_argument("--coloring", default="create_mosaic_from_image_1")
+    parser.add_argument("--colors", default="8", help="colors count or comma separated hex colors")
+    parser.add_argument("--width", type=int, default=50)
+    parser.add_argument("--height", type=int, default=50)
+    parser.add_argument("--multiplier", type=int, default=10)
+    parser.add_argument("--overlay", default=None)
+    parser.add_argument("--numbers-size", type=int, default=None)
+    parser.add_argument("--dithering", default=None)
+    parser.add_argument("--mode", choices=PROFILER_MODES, default="sampling")
+    parser.add_argument("--interval", type=float, default=DEFAULT_SAMPLING_INTERVAL)
+    parser.add_argument("--threads", type=int, default=None)
+    arguments = parser.parse_args()
+
+    if arguments.threads is not None:
+        set_threads(arguments.threads)
+    colors = arguments.colors
+    colors = int(colors) if "," not in colors else colors_palette_from_hex_colors(colors.split(","))
+    mosaic_spec = MosaicSpec(arguments.width, arguments.height, arguments.multiplier, arguments.coloring, colors,
+                             arguments.overlay, arguments.numbers_size, arguments.dithering)
+    source = open_oriented_image(arguments.image)
+    # пирамида строится при импорте изображения, в профиль попадают раскраска, отрисовка и сохранение
+    pipeline = Pipeline(source, build_image_pyramid(source))
+    _, profile = profile_call(lambda: save_png(pipeline.render(mosaic_spec), arguments.output), arguments.mode,
+                              arguments.interval)
+    for profile_name in save_profile(arguments.output, profile, profile_tag(source.size, mosaic_spec)):
+        print(f"profile written to {profile_name}")
@@ -0,0 +1,61 @@
+import json
+from typing import Any, BinaryIO
+
+import numpy as np
+from PIL import Image
+
+from determinism import mosaic_fingerprint
+from image_processor import mosaic_from_index_map
+
+PROJECT_VERSION = 1
+THUMBNAIL_SIZE = 256
+
+
+def serializable_parameters(parameters: dict[str, Any]) -> dict[str, Any]:
+    """
+    Parameters of the mosaic without function objects (functions are stored by name)
+
+    """
+    return {key: value.__name__ if callable(value) else value for (key, value) in parameters.items()}
+
+
+def create_thumbnail(palette: np.ndarray, index_map: np.ndarray, size: int = THUMBNAIL_SIZE) -> Image:
+    height, width = index_map.shape
+    multiplier = max(1, size // max(width, height))
+    thumbnail = mosaic_from_index_map(palette, index_map, multiplier)
+    thumbnail.thumbnail((size, size))
+    return thumbnail
+
+
+def save_mosaic_project(file_name: str, palette: np.ndarray, index_map: np.ndarray,
+                        parameters: dict[str, Any]) -> None:
+    """
+    Saving the mosaic as a project: palette, index map of cells, parameters and thumbnail
+
+    """
+    with open(file_name, "wb") as file:
+        write_mosaic_project(file, palette, index_map, parameters)
+
+
+def write_mosaic_project(file: BinaryIO, palette: np.ndarray, index_map: np.ndarray,
+                         parameters: dict[str, Any]) -> None:
+    np.savez_compressed(file, version=np.array(PROJECT_VERSION), palette=palette.astype(np.uint8),
+                        index_map=index_map,
+                        parameters=np.array(json.dumps(serializable_parameters(parameters))),
+                        thumbnail=np.asarray(create_thumbnail(palette, index_map)),
+                        fingerprint=np.array(mosaic_fingerprint(palette, index_map)))
+
+
+def load_mosaic_project(file_name: str) -> dict[str, Any]:
+    """
+    Loading the mosaic project saved by save_mosaic_project,
+    fingerprint is None for projects saved without it
+
+    """
+    with np.load(file_name, allow_pickle=False) as data:
+        if int(data["version"]) > PROJECT_VERSION:
+            raise ValueError("unsupported project version")
+        return {"palette": data["palette"], "index_map": data["index_map"],
+                "parameters": json.loads(str(data["parameters"])),
+                "thumbnail": Image.fromarray(data["thumbnail"]),
+                "fingerprint": str(data["fingerprint"]) if "fingerprint" in data else None}
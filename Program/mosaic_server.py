@@ -0,0 +1,314 @@
+"""
+Local HTTP service for creating mosaics without the GUI
+
+POST /mosaic?coloring=create_mosaic_from_image_1&colors=8&width=50&height=50&multiplier=10
+            &overlay=add_grid_to_mosaic&numbers_size=12&dithering=ordered&format=png&deterministic=1
+    body - the source image file, response - PNG (format=png), mosaic project (format=mosaic)
+    or PNG error heatmap (format=heatmap)
+    colors=8 - colors count, for palette coloring functions hex colors: colors=FF0000,00FF00,0000FF
+    colors=auto&target=5 - the fewest colors whose mean per cell error ΔE is at most target
+    palette_subset=20 - the mosaic is colored by the best 20 colors of the palette
+    palette_subset=auto&target=5 - by the smallest subset of the palette meeting the target
+    stock=120,80,500 - the most cells of every palette color (minimal total error, dithering is not applied)
+    deterministic=1 - reproducible results (colors ordered by frequency), they are cached
+    X-Mosaic-Fingerprint header - the fingerprint of the palette and index map
+    X-Mosaic-Delta-E header - the mean per cell error ΔE
+GET /metrics
+    latency and throughput of the service in JSON
+
+Run: python mosaic_server.py --port 8765 (--workers - worker processes, --threads - threads of every worker)
+"""
+import argparse
+import asyncio
+import hashlib
+import io
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any
+from urllib.parse import urlsplit, parse_qsl
+
+import numpy as np
+from PIL import Image
+
+from determinism import mosaic_fingerprint
+from dithering import DITHERING_MODES
+from image_exporter import encode_png
+from image_processor import COLORING_FUNCTIONS, OVERLAY_FUNCTIONS, PALETTE_COLORING_FUNCTIONS, \
+    colors_palette_from_hex_colors, palette_stock
+from mosaic_error import error_heatmap, auto_colors, auto_palette_subset
+from memory_budget import estimate_mosaic_memory, memory_budget
+from mosaic_project import write_mosaic_project
+from parallel import DEFAULT_THREADS, set_threads
+from pipeline import MosaicSpec, Pipeline
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+DEFAULT_WORKERS = 2
+DEFAULT_QUEUE_SIZE = 16
+MAX_BODY_SIZE = 64 * 1024 * 1024
+STREAM_CHUNK_SIZE = 64 * 1024
+LATENCY_WINDOW = 1000
+# сколько результатов детерминированных запросов хранится
+RESULT_CACHE_SIZE = 32
+
+RESULT_CONTENT_TYPES = {"png": "image/png", "mosaic": "application/octet-stream", "heatmap": "image/png"}
+
+
+def parse_parameters(query: dict[str, str]) -> dict[str, Any]:
+    """
+    Mosaic parameters from the query string, raises ValueError for incorrect parameters
+
+    """
+    coloring_function = COLORING_FUNCTIONS[query.get("coloring", "create_mosaic_from_image_1")]
+    parameters = {"width": int(query.get("width", 50)), "height": int(query.get("height", 50)),
+                  "multiplier": int(query.get("multiplier", 10)), "coloring_function": coloring_function.__name__,
+                  "overlay_function": query.get("overlay") or None,
+                  "numbers_size": int(query.get("numbers_size", 12)), "dithering": query.get("dithering") or None,
+                  "format": query.get("format", "png"), "deterministic": query.get("deterministic") == "1"}
+    if coloring_function in PALETTE_COLORING_FUNCTIONS:
+        parameters["colors"] = colors_palette_from_hex_colors(query["colors"].split(","))
+        if query.get("palette_subset") == "auto":
+            parameters["palette_subset"] = "auto"
+        elif query.get("palette_subset"):
+            parameters["palette_subset"] = int(query["palette_subset"])
+            if parameters["palette_subset"] < 1:
+                raise ValueError("incorrect palette subset")
+        if query.get("stock"):
+            parameters["stock"] = [int(count) for count in query["stock"].split(",")]
+            if len(parameters["stock"]) != len(parameters["colors"]) or min(parameters["stock"]) < 0:
+                raise ValueError("incorrect stock")
+    elif query.get("colors") == "auto":
+        parameters["colors"] = "auto"
+    else:
+        parameters["colors"] = int(query.get("colors", 8))
+    if "auto" in (parameters["colors"], parameters.get("palette_subset")):
+        parameters["target"] = float(query.get("target", 5.0))
+        if parameters["target"] <= 0:
+            raise ValueError("incorrect error target")
+    if parameters["overlay_function"] is not None and parameters["overlay_function"] not in OVERLAY_FUNCTIONS:
+        raise ValueError(f"unknown overlay: {parameters['overlay_function']}")
+    if parameters["dithering"] is not None and parameters["dithering"] not in DITHERING_MODES:
+        raise ValueError(f"unknown dithering: {parameters['dithering']}")
+    if parameters["format"] not in RESULT_CONTENT_TYPES:
+        raise ValueError(f"unknown format: {parameters['format']}")
+    if not (1 <= parameters["width"] <= 1000 and 1 <= parameters["height"] <= 1000
+            and 1 <= parameters["multiplier"] <= 100):
+        raise ValueError("incorrect mosaic sizes")
+    if estimate_mosaic_memory(parameters["width"], parameters["height"], parameters["multiplier"],
+                              parameters["overlay_function"] is not None, display=False) > memory_budget():
+        raise ValueError("mosaic does not fit into the memory budget")
+    return parameters
+
+
+def render_mosaic(image_bytes: bytes, parameters: dict[str, Any]) -> tuple[bytes, dict[str, str]]:
+    """
+    Creating the mosaic in a worker process, the result is PNG or mosaic project bytes and the response headers
+    with the mosaic fingerprint and the mean per cell error
+
+    """
+    image = Image.open(io.BytesIO(image_bytes)).convert("RGB")
+    pipeline = Pipeline(image, deterministic=parameters["deterministic"])
+    cells = pipeline.cells(parameters["width"], parameters["height"])
+    colors = parameters["colors"]
+    stock = parameters.get("stock")
+    palette_subset = parameters.get("palette_subset")
+    if colors == "auto":
+        colors, _ = auto_colors(cells, parameters["target"])
+    elif palette_subset == "auto":
+        chosen, _ = auto_palette_subset(cells, np.array(colors, np.uint8), parameters["target"])
+        colors = [colors[index] for index in chosen]
+        if stock is not None:
+            stock = palette_stock(colors, parameters["colors"], stock)
+        palette_subset = None
+    spec = MosaicSpec.from_parameters({**parameters, "colors": colors, "stock": stock,
+                                       "palette_subset": palette_subset})
+    palette, index_map = pipeline.color(spec)
+    delta_e = pipeline.delta_e(spec)
+    headers = {"X-Mosaic-Fingerprint": mosaic_fingerprint(palette, index_map),
+               "X-Mosaic-Delta-E": f"{delta_e.mean():.3f}"}
+    result = io.BytesIO()
+    if parameters["format"] == "mosaic":
+        write_mosaic_project(result, palette, index_map, {**parameters, **spec.to_dict()})
+        return result.getvalue(), headers
+    if parameters["format"] == "heatmap":
+        return encode_png(error_heatmap(delta_e, spec.multiplier), workers=1), headers
+    return encode_png(pipeline.render(spec), workers=1), headers
+
+
+class MosaicServer:
+    """
+    HTTP server with a bounded process pool, a request queue and deduplication of identical requests,
+    results of deterministic requests are cached
+
+    """
+
+    def __init__(self, workers: int = DEFAULT_WORKERS, queue_size: int = DEFAULT_QUEUE_SIZE,
+                 threads: int | None = None) -> None:
+        """
+        Class constructor, threads - threads of the internal pool of every worker process
+        (by default the cores are shared between the workers)
+
+        """
+        threads = threads or max(1, DEFAULT_THREADS // workers)
+        self.executor = ProcessPoolExecutor(max_workers=workers, initializer=set_threads, initargs=(threads,))
+        self.queue_size = queue_size
+        self.running_requests = asyncio.Semaphore(workers)
+        self.in_flight: dict[str, asyncio.Future] = {}
+        # ключ запроса -> (результат, заголовки ответа)
+        self.results: dict[str, tuple[bytes, dict[str, str]]] = {}
+        self.queued = 0
+        self.started = time.monotonic()
+        self.metrics = {"requests": 0, "completed": 0, "failed": 0, "rejected": 0, "deduplicated": 0, "cached": 0}
+        self.latencies: list[float] = []
+
+    async def create_mosaic(self, image_bytes: bytes, parameters: dict[str, Any]) -> tuple[bytes, dict[str, str]]:
+        """
+        Creating the mosaic in the process pool, identical requests in flight share one result,
+        the result is the response body and headers
+
+        """
+        key = hashlib.sha256(image_bytes + json.dumps(parameters, sort_keys=True).encode()).hexdigest()
+        if key in self.results:
+            self.metrics["cached"] += 1
+            self.results[key] = self.results.pop(key)
+            return self.results[key]
+        if key in self.in_flight:
+            self.metrics["deduplicated"] += 1
+            return await asyncio.shield(self.in_flight[key])
+
+        if self.queued >= self.queue_size:
+            self.metrics["rejected"] += 1
+            raise OverflowError("request queue is full")
+
+        future = asyncio.get_running_loop().create_future()
+        self.in_flight[key] = future
+        self.queued += 1
+        waiting = True
+        try:
+            async with self.running_requests:
+                self.queued -= 1
+                waiting = False
+                result = await asyncio.get_running_loop().run_in_executor(self.executor, render_mosaic, image_bytes,
+                                                                          parameters)
+            future.set_result(result)
+            if parameters["deterministic"]:
+                self.results[key] = result
+                while len(self.results) > RESULT_CACHE_SIZE:
+                    del self.results[next(iter(self.results))]
+            return result
+        except Exception as exception:
+            future.set_exception(exception)
+            # исключение получит этот запрос, для остальных будущее помечается обработанным
+            future.exception()
+            raise
+        except BaseException:
+            future.cancel()
+            raise
+        finally:
+            if waiting:
+                self.queued -= 1
+            del self.in_flight[key]
+
+    def get_metrics(self) -> dict[str, Any]:
+        latencies = sorted(self.latencies)
+        uptime = time.monotonic() - self.started
+        return {**self.metrics, "in_flight": len(self.in_flight), "queued": self.queued, "uptime": uptime,
+                "throughput": self.metrics["completed"] / uptime if uptime > 0 else 0.0,
+                "latency_mean": sum(latencies) / len(latencies) if latencies else None,
+                "latency_p50": latencies[len(latencies) // 2] if latencies else None,
+                "latency_p95": latencies[int(len(latencies) * 0.95)] if latencies else None}
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            request_line = (await reader.readline()).decode("latin-1").split()
+            headers = {}
+            while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+            if len(request_line) < 2:
+                return await self.send(writer, 400, b"bad request")
+
+            method, target = request_line[0], urlsplit(request_line[1])
+            if method == "GET" and target.path == "/metrics":
+                return await self.send(writer, 200, json.dumps(self.get_metrics()).encode(), "application/json")
+            if method != "POST" or target.path != "/mosaic":
+                return await self.send(writer, 404, b"not found")
+
+            try:
+                content_length = int(headers.get("content-length", 0))
+                if content_length < 0:
+                    raise ValueError("negative content length")
+            except ValueError:
+                # некорректный заголовок - тоже неудачный запрос мозаики
+                self.metrics["requests"] += 1
+                self.metrics["failed"] += 1
+                return await self.send(writer, 400, b"bad request")
+            if not 0 < content_length <= MAX_BODY_SIZE:
+                return await self.send(writer, 413, b"image is missing or too large")
+            image_bytes = await reader.readexactly(content_length)
+            await self.handle_mosaic_request(writer, image_bytes, dict(parse_qsl(target.query)))
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def handle_mosaic_request(self, writer: asyncio.StreamWriter, image_bytes: bytes,
+                                    query: dict[str, str]) -> None:
+        self.metrics["requests"] += 1
+        started = time.monotonic()
+        try:
+            parameters = parse_parameters(query)
+        except (KeyError, ValueError) as exception:
+            self.metrics["failed"] += 1
+            return await self.send(writer, 400, f"incorrect parameters: {exception}".encode())
+
+        try:
+            result, headers = await self.create_mosaic(image_bytes, parameters)
+        except OverflowError:
+            return await self.send(writer, 503, b"server is busy")
+        except Exception as exception:
+            self.metrics["failed"] += 1
+            return await self.send(writer, 422, f"mosaic creation error: {exception}".encode())
+
+        self.metrics["completed"] += 1
+        self.latencies = self.latencies[-LATENCY_WINDOW + 1:] + [time.monotonic() - started]
+        await self.send(writer, 200, result, RESULT_CONTENT_TYPES[parameters["format"]], headers)
+
+    @staticmethod
+    async def send(writer: asyncio.StreamWriter, status: int, body: bytes, content_type: str = "text/plain",
+                   headers: dict[str, str] | None = None) -> None:
+        """
+        Sending the response, the body is streamed with chunked transfer encoding
+
+        """
+        extra_headers = "".join(f"{name}: {value}\r\n" for (name, value) in (headers or {}).items())
+        writer.write(f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}\r\n"
+                     f"Content-Type: {content_type}\r\nTransfer-Encoding: chunked\r\n{extra_headers}"
+                     f"Connection: close\r\n\r\n".encode("latin-1"))
+        for start in range(0, len(body), STREAM_CHUNK_SIZE):
+            chunk = body[start:start + STREAM_CHUNK_SIZE]
+            writer.write(f"{len(chunk):X}\r\n".encode() + chunk + b"\r\n")
+            await writer.drain()
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+    async def serve(self, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT) -> None:
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.executor.shutdown(cancel_futures=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="3DMosaic rendering service")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS)
+    parser.add_argument("--queue-size", type=int, default=DEFAULT_QUEUE_SIZE)
+    parser.add_argument("--threads", type=int, default=None)
+    arguments = parser.parse_args()
+    asyncio.run(MosaicServer(arguments.workers, arguments.queue_size, arguments.threads).serve(arguments.host,
+                                                                                               arguments.port))
@@ -0,0 +1,82 @@
+import numpy as np
+from PIL import Image
+
+# больше пикселей не считается: для огромных изображений берётся детерминированная случайная выборка
+MAX_COUNTED_PIXELS = 4_000_000
+SAMPLE_SEED = 0
+
+
+def pack_colors(pixels: np.ndarray) -> np.ndarray:
+    """
+    RGB colors (..., 3) packed into one uint32 key per color: 0xRRGGBB
+
+    """
+    pixels = pixels.astype(np.uint32)
+    return (pixels[..., 0] << 16) | (pixels[..., 1] << 8) | pixels[..., 2]
+
+
+def unpack_colors(keys: np.ndarray) -> np.ndarray:
+    keys = keys.astype(np.uint32)
+    return np.stack(((keys >> 16) & 0xFF, (keys >> 8) & 0xFF, keys & 0xFF), axis=-1).astype(np.uint8)
+
+
+def image_palette(image: Image) -> list[tuple[int, int, int]] | None:
+    """
+    Palette of the image with a palette ("P" mode) as a list of colors, None for other images
+
+    """
+    palette = image.getpalette()
+    if palette is None:
+        return None
+    return [tuple(color) for color in np.asarray(palette, np.uint8).reshape(-1, 3).tolist()]
+
+
+def count_colors(image: Image, max_pixels: int = MAX_COUNTED_PIXELS) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Unique colors (n, 3) of the image and their counts, ordered by frequency (most frequent first)
+
+    Images with more than max_pixels pixels are counted on a deterministic random sample,
+    counts are then those of the sample
+
+    """
+    if image.mode == "P":
+        indexes = np.asarray(image).ravel()
+        if indexes.size > max_pixels:
+            indexes = np.random.default_rng(SAMPLE_SEED).choice(indexes, max_pixels, replace=False)
+        counts = np.bincount(indexes)
+        palette = np.asarray(image.getpalette(), np.uint8).reshape(-1, 3)
+        used = np.flatnonzero(counts)
+        # разные индексы палитры могут означать один цвет
+        keys, inverse = np.unique(pack_colors(palette[used]), return_inverse=True)
+        counts = np.bincount(inverse, weights=counts[used]).astype(np.int64)
+    else:
+        pixels = np.asarray(image.convert("RGB")).reshape(-1, 3)
+        if len(pixels) > max_pixels:
+            pixels = pixels[np.random.default_rng(SAMPLE_SEED).choice(len(pixels), max_pixels, replace=False)]
+        keys, counts = np.unique(pack_colors(pixels), return_counts=True)
+    # по убыванию частоты, при равенстве - по ключу цвета, чтобы порядок был детерминированным
+    order = np.lexsort((keys, -counts))
+    return unpack_colors(keys[order]), counts[order]
+
+
+def unique_colors(image: Image, max_pixels: int = MAX_COUNTED_PIXELS) -> list[tuple[int, int, int]]:
+    colors, _ = count_colors(image, max_pixels)
+    return [tuple(color) for color in colors.tolist()]
+
+
+def dominant_colors(image: Image, colors: int, max_pixels: int = MAX_COUNTED_PIXELS) -> list[tuple[int, int, int]]:
+    """
+    The colors most dominant colors of the image ordered by frequency, ready for the palette editor
+
+    Images with few colors give their most frequent exact colors, other images are quantized (median cut)
+    to colors colors first, so similar shades are merged instead of taking the most frequent single shade
+
+    """
+    exact_colors, _ = count_colors(image, max_pixels)
+    if len(exact_colors) <= colors:
+        return [tuple(color) for color in exact_colors.tolist()]
+    if image.width * image.height > max_pixels:
+        scale = (max_pixels / (image.width * image.height)) ** 0.5
+        image = image.resize((max(1, int(image.width * scale)), max(1, int(image.height * scale))))
+    quantized_colors, _ = count_colors(image.convert("RGB").quantize(colors=colors), max_pixels)
+    return [tuple(color) for color in quantized_colors.tolist()]
@@ -0,0 +1,104 @@
+import numpy as np
+from PIL import Image
+
+from color_space import rgb_to_lab
+
+# сколько разных цветов ячеек участвует в подборе, остальные заменяются детерминированной выборкой
+SUBSET_SAMPLE_SIZE = 20000
+SUBSET_SEED = 0
+# максимальное количество итераций уточнения k-medoids
+MAX_REFINE_ITERATIONS = 20
+
+
+def cells_colors(cells: Image, size: int = SUBSET_SAMPLE_SIZE) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Unique colors (m, 3) of the cells in CIELAB and their weights (counts), at most size colors;
+    the sample is uniform, so the counts it keeps are still the weights of the colors
+
+    """
+    pixels = np.asarray(cells.convert("RGB")).reshape(-1, 3)
+    colors, weights = np.unique(pixels, axis=0, return_counts=True)
+    if len(colors) > size:
+        # выборка с вероятностями по количеству вместе с самими количествами учитывала бы частые цвета дважды
+        chosen = np.random.default_rng(SUBSET_SEED).choice(len(colors), size, replace=False)
+        colors, weights = colors[chosen], weights[chosen]
+    return rgb_to_lab(colors), weights.astype(np.float64)
+
+
+def distance_matrix(colors: np.ndarray, inventory_lab: np.ndarray) -> np.ndarray:
+    """
+    Distances (m, n) in CIELAB between colors and inventory colors
+
+    """
+    squared = ((colors ** 2).sum(axis=1)[:, None] + (inventory_lab ** 2).sum(axis=1)[None, :]
+               - 2 * colors @ inventory_lab.T)
+    return np.sqrt(np.maximum(squared, 0)).astype(np.float32)
+
+
+def greedy_palette_order(distances: np.ndarray, weights: np.ndarray, colors: int) -> np.ndarray:
+    """
+    Inventory indexes chosen one by one, each time the color which decreases the weighted distance
+    of the cells to their nearest chosen color the most, every prefix of the order is a greedy subset
+
+    """
+    chosen = []
+    nearest = np.full(len(distances), np.inf, np.float32)
+    for _ in range(min(colors, distances.shape[1])):
+        costs = weights @ np.minimum(nearest[:, None], distances)
+        costs[chosen] = np.inf
+        best = int(costs.argmin())
+        chosen.append(best)
+        nearest = np.minimum(nearest, distances[:, best])
+    return np.array(chosen, np.intp)
+
+
+def refine_palette_subset(distances: np.ndarray, weights: np.ndarray, chosen: np.ndarray) -> np.ndarray:
+    """
+    k-medoids refinement: cells are assigned to the nearest chosen color, then every cluster takes the inventory color
+    with the smallest weighted distance to its cells, until the subset stops changing
+
+    """
+    chosen = chosen.copy()
+    for _ in range(MAX_REFINE_ITERATIONS):
+        labels = distances[:, chosen].argmin(axis=1)
+        refined = chosen.copy()
+        for cluster in range(len(chosen)):
+            members = labels == cluster
+            if members.any():
+                costs = weights[members] @ distances[members]
+                # цвет, уже выбранный для другого кластера, не берётся второй раз
+                costs[np.delete(refined, cluster)] = np.inf
+                refined[cluster] = int(costs.argmin())
+        if np.array_equal(refined, chosen):
+            break
+        chosen = refined
+    return chosen
+
+
+def select_palette_subset(cells: Image, inventory: np.ndarray, colors: int, refine: bool = True) -> np.ndarray:
+    """
+    Indexes of the colors colors of the inventory palette (n, 3) that represent the cells best:
+    greedy selection over the CIELAB distance matrix of cell colors and inventory colors, then k-medoids refinement
+
+    """
+    inventory = np.asarray(inventory, np.uint8).reshape(-1, 3)
+    if colors >= len(inventory):
+        return np.arange(len(inventory))
+    cell_colors, weights = cells_colors(cells)
+    distances = distance_matrix(cell_colors, rgb_to_lab(inventory))
+    chosen = greedy_palette_order(distances, weights, colors)
+    return np.sort(refine_palette_subset(distances, weights, chosen) if refine else chosen)
+
+
+def inventory_counts(inventory: np.ndarray, palette: np.ndarray, index_map: np.ndarray) -> np.ndarray:
+    """
+    Number of cells (n,) of every inventory color in the mosaic, zero for the colors not used
+
+    """
+    inventory = np.asarray(inventory).reshape(-1, 3)
+    inventory_keys = {tuple(color): index for (index, color) in enumerate(inventory.tolist())}
+    counts = np.zeros(len(inventory), np.int64)
+    for (color, count) in zip(palette.tolist(), np.bincount(index_map.ravel(), minlength=len(palette)).tolist()):
+        if tuple(color) in inventory_keys:
+            counts[inventory_keys[tuple(color)]] += count
+    return counts
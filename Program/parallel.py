@@ -0,0 +1,77 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, TypeVar
+
+# потоков по умолчанию - по количеству ядер
+DEFAULT_THREADS = os.cpu_count() or 1
+# полоса не делается меньше этого количества строк: на мелких полосах накладные расходы больше выигрыша
+MIN_BAND_ROWS = 8
+# полос на поток: полосы разной сложности лучше распределяются между потоками
+BANDS_PER_THREAD = 2
+
+T = TypeVar("T")
+
+_lock = threading.Lock()
+_threads = DEFAULT_THREADS
+_executor: ThreadPoolExecutor | None = None
+_worker = threading.local()
+
+
+def _mark_worker() -> None:
+    _worker.active = True
+
+
+def set_threads(threads: int) -> None:
+    """
+    Number of threads of the internal pool, the current pool is shut down after its tasks finish
+
+    """
+    global _threads, _executor
+    with _lock:
+        threads = max(1, int(threads))
+        if threads != _threads:
+            _threads = threads
+            if _executor is not None:
+                _executor.shutdown(wait=False)
+                _executor = None
+
+
+def get_threads() -> int:
+    return _threads
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=_threads, thread_name_prefix="mosaic",
+                                           initializer=_mark_worker)
+        return _executor
+
+
+def row_bands(rows: int, min_rows: int = MIN_BAND_ROWS, max_rows: int | None = None) -> list[tuple[int, int]]:
+    """
+    Bands [start, stop) of rows: BANDS_PER_THREAD bands per thread, each at least min_rows
+    and at most max_rows rows (except a single band of fewer rows)
+
+    """
+    bands = max(1, min(_threads * BANDS_PER_THREAD, rows // max(1, min_rows)))
+    if max_rows is not None:
+        bands = max(bands, -(-rows // max_rows))
+    bounds = [rows * band // bands for band in range(bands + 1)]
+    return [(start, stop) for (start, stop) in zip(bounds[:-1], bounds[1:]) if stop > start]
+
+
+def map_row_bands(function: Callable[[int, int], T], rows: int, min_rows: int = MIN_BAND_ROWS,
+                  max_rows: int | None = None) -> list[T]:
+    """
+    Results of function(start, stop) for the row bands in order, the bands run on the internal thread pool
+    (NumPy and PIL release the GIL in the heavy loops); the bands must write only their own rows.
+    Inside a pool thread and with one thread the bands run in the calling thread
+
+    """
+    bands = row_bands(rows, min_rows, max_rows)
+    if len(bands) == 1 or _threads == 1 or getattr(_worker, "active", False):
+        return [function(start, stop) for (start, stop) in bands]
+    return list(_get_executor().map(lambda band: function(*band), bands))
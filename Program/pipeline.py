@@ -0,0 +1,175 @@
+import threading
+from contextlib import nullcontext
+from dataclasses import dataclass, asdict, fields, replace
+from typing import Any, Callable, Iterator
+
+import numpy as np
+from PIL import Image
+
+from determinism import deterministic_mode, canonical_palette_order
+from image_processor import COLORING_FUNCTIONS, OVERLAY_FUNCTIONS, PALETTE_COLORING_FUNCTIONS, \
+    PYRAMID_COLORING_FUNCTIONS, resize_image, image_from_pyramid, inventory_palette_subset, palette_stock, \
+    create_mosaic_with_stock, index_map_from_mosaic, mosaic_from_index_map, colors_distribution_from_index_map, \
+    iterate_mosaic_bands
+from mosaic_error import cell_delta_e
+
+# сколько последних раскрасок ячеек хранит конвейер
+COLOR_CACHE_SIZE = 8
+
+
+@dataclass(frozen=True)
+class MosaicSpec:
+    """
+    Description of the mosaic: sizes, coloring and overlay, functions are referred to by name,
+    so the spec is hashable (a key for caches and deduplication) and serializable (worker processes, projects)
+
+    colors is the colors count or the palette, stock - the stock of every palette color (None - not limited),
+    palette_subset - the number of colors chosen from the palette (None - all)
+
+    """
+    width: int
+    height: int
+    multiplier: int
+    coloring: str
+    colors: int | tuple[tuple[int, int, int], ...]
+    overlay: str | None = None
+    numbers_size: int | None = None
+    dithering: str | None = None
+    palette_subset: int | None = None
+    stock: tuple[int, ...] | None = None
+
+    def __post_init__(self) -> None:
+        if self.coloring not in COLORING_FUNCTIONS:
+            raise ValueError(f"unknown coloring: {self.coloring}")
+        if self.overlay is not None and self.overlay not in OVERLAY_FUNCTIONS:
+            raise ValueError(f"unknown overlay: {self.overlay}")
+        # списки (из JSON и из интерфейса) заменяются кортежами, чтобы спецификация хешировалась
+        if (self.coloring_function in PALETTE_COLORING_FUNCTIONS) == isinstance(self.colors, int):
+            raise ValueError("palette coloring needs a palette, other colorings need a colors count")
+        if not isinstance(self.colors, int):
+            object.__setattr__(self, "colors", tuple(tuple(int(channel) for channel in color)
+                                                     for color in self.colors))
+        if self.stock is not None:
+            object.__setattr__(self, "stock", tuple(int(count) for count in self.stock))
+            if len(self.stock) != len(self.colors):
+                raise ValueError("stock must be given for every palette color")
+
+    @property
+    def coloring_function(self) -> Callable:
+        return COLORING_FUNCTIONS[self.coloring]
+
+    @property
+    def overlay_function(self) -> Callable | None:
+        return OVERLAY_FUNCTIONS[self.overlay] if self.overlay is not None else None
+
+    def color_spec(self) -> "MosaicSpec":
+        # часть спецификации, от которой зависит раскраска ячеек: множитель и наложение на неё не влияют
+        return replace(self, multiplier=1, overlay=None, numbers_size=None)
+
+    def to_dict(self) -> dict[str, Any]:
+        return asdict(self)
+
+    @classmethod
+    def from_parameters(cls, parameters: dict[str, Any]) -> "MosaicSpec":
+        """
+        Spec from a parameters dict: functions may be given as objects or by name (coloring_function,
+        overlay_function or coloring, overlay), unknown keys are ignored
+
+        """
+        values = {field.name: parameters[field.name] for field in fields(cls) if field.name in parameters}
+        for (name, key) in (("coloring", "coloring_function"), ("overlay", "overlay_function")):
+            value = parameters.get(key, values.get(name))
+            values[name] = value.__name__ if callable(value) else value
+        return cls(**values)
+
+
+def render_mosaic(palette: np.ndarray, index_map: np.ndarray, spec: MosaicSpec) -> Image:
+    """
+    The mosaic (mode "P" if possible) of the colored cells at the multiplier of the spec with its overlay
+
+    """
+    mosaic = mosaic_from_index_map(palette, index_map, spec.multiplier, paletted=True)
+    if spec.overlay_function is None:
+        return mosaic
+    return spec.overlay_function(mosaic, colors_distribution_from_index_map(palette, index_map), spec.multiplier,
+                                 numbers_size=spec.numbers_size)
+
+
+class Pipeline:
+    """
+    Creating mosaics of one source image by specs without GUI state: cells are colored by the coloring part
+    of the spec (the result is cached), then the mosaic is rendered at the multiplier of the spec with the overlay
+
+    """
+
+    def __init__(self, image: Image, pyramid: list[Image] | None = None, deterministic: bool = False,
+                 cache_size: int = COLOR_CACHE_SIZE) -> None:
+        """
+        Class constructor, pyramid - reduced copies of the image (build_image_pyramid), colorings are cached
+        by spec, so the pyramid must not be attached after the first coloring,
+        deterministic - reproducible colorings with the palette ordered by frequency of colors
+
+        """
+        self.image = image
+        self.pyramid = pyramid
+        self.deterministic = deterministic
+        self.cache_size = cache_size
+        # спецификация раскраски -> (палитра, карта индексов), порядок - от старых к новым
+        self.colored: dict[MosaicSpec, tuple[np.ndarray, np.ndarray]] = {}
+        self._lock = threading.Lock()
+
+    def source(self, width: int, height: int) -> Image:
+        # наименьший уровень пирамиды, из которого ещё можно уменьшить изображение до размера в ячейках
+        return self.image if self.pyramid is None else image_from_pyramid(self.pyramid, width, height)
+
+    def cells(self, width: int, height: int) -> Image:
+        # исходное изображение, усреднённое по ячейкам мозаики
+        return resize_image(self.source(width, height), width, height)
+
+    def color(self, spec: MosaicSpec) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Palette and index map of the cells colored by the spec, raises InsufficientStockError if the stock is not enough
+
+        """
+        key = spec.color_spec()
+        with self._lock:
+            if key in self.colored:
+                return self.colored[key]
+        with deterministic_mode() if self.deterministic else nullcontext():
+            colored = index_map_from_mosaic(self._color_mosaic(key), 1)
+        if self.deterministic:
+            colored = canonical_palette_order(*colored)
+        with self._lock:
+            self.colored[key] = colored
+            while len(self.colored) > self.cache_size:
+                del self.colored[next(iter(self.colored))]
+        return colored
+
+    def _color_mosaic(self, spec: MosaicSpec) -> Image:
+        colors = spec.colors
+        if spec.palette_subset is not None:
+            # из палитры наличия выбираются цвета, лучше всего передающие ячейки
+            colors = inventory_palette_subset(self.source(spec.width, spec.height), colors, spec.palette_subset,
+                                              spec.width, spec.height)
+        if spec.stock is not None:
+            # ячейки распределяются между цветами с учётом запаса каждого цвета
+            return create_mosaic_with_stock(self.source(spec.width, spec.height), colors,
+                                            palette_stock(colors, spec.colors, spec.stock), spec.width, spec.height,
+                                            spec.multiplier, paletted=True)
+        image = self.image
+        if spec.coloring_function in PYRAMID_COLORING_FUNCTIONS:
+            image = self.source(spec.width, spec.height)
+        return spec.coloring_function(image, colors, spec.width, spec.height, spec.multiplier, paletted=True,
+                                      dithering=spec.dithering)
+
+    def render(self, spec: MosaicSpec) -> Image:
+        return render_mosaic(*self.color(spec), spec)
+
+    def render_bands(self, spec: MosaicSpec, rows: int) -> Iterator[Image]:
+        # мозаика полосами по rows строк ячеек (для мозаик, которые целиком не помещаются в память)
+        return iterate_mosaic_bands(*self.color(spec), spec.multiplier, spec.overlay_function, spec.numbers_size,
+                                    rows)
+
+    def delta_e(self, spec: MosaicSpec) -> np.ndarray:
+        # ΔE каждой ячейки относительно усреднённого по ячейке исходного изображения
+        return cell_delta_e(self.cells(spec.width, spec.height), *self.color(spec))
@@ -0,0 +1,158 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from font_service import get_font, draw_centered_text
+from image_exporter import encode_png
+from image_processor import mosaic_from_index_map, colors_distribution_from_index_map, \
+    add_raw_grid_and_numbers_to_mosaic
+
+# размеры листов в миллиметрах (книжная ориентация)
+PAGE_SIZES = {"A4": (210, 297), "A3": (297, 420)}
+DEFAULT_DPI = 150
+# размер ячейки, поля листа в миллиметрах и перекрытие соседних листов в ячейках
+DEFAULT_CELL_SIZE = 8.0
+DEFAULT_MARGIN = 10.0
+DEFAULT_OVERLAP = 1
+# цвет линии, отделяющей ячейки перекрытия (они есть и на соседнем листе)
+OVERLAP_LINE_COLOR = (160, 160, 160)
+
+ProgressCallback = Callable[[int, int], None]
+
+
+def millimeters_to_pixels(millimeters: float, dpi: int) -> int:
+    return max(1, round(millimeters / 25.4 * dpi))
+
+
+def _page_starts(cells: int, page_cells: int, overlap: int) -> list[int]:
+    # первые ячейки листов: каждый следующий лист повторяет overlap последних ячеек предыдущего
+    starts = [0]
+    while starts[-1] + page_cells < cells:
+        starts.append(starts[-1] + page_cells - overlap)
+    return starts
+
+
+def print_layout(columns: int, rows: int, page_size: str = "A4", landscape: bool = False,
+                 cell_size: float = DEFAULT_CELL_SIZE, margin: float = DEFAULT_MARGIN, overlap: int = DEFAULT_OVERLAP,
+                 dpi: int = DEFAULT_DPI) -> dict[str, Any]:
+    """
+    Layout of the mosaic of columns x rows cells on pages: sizes in pixels and the first cells of pages
+
+    """
+    page_width, page_height = (millimeters_to_pixels(size, dpi) for size in PAGE_SIZES[page_size])
+    if landscape:
+        page_width, page_height = page_height, page_width
+    cell = millimeters_to_pixels(cell_size, dpi)
+    margin = millimeters_to_pixels(margin, dpi)
+    # полоса для номеров строк и столбцов
+    label = max(cell, millimeters_to_pixels(8, dpi))
+    page_columns = (page_width - 2 * margin - label) // cell
+    page_rows = (page_height - 2 * margin - label) // cell
+    if page_columns <= overlap or page_rows <= overlap:
+        raise ValueError("cell size is too large for the page")
+    return {"page_width": page_width, "page_height": page_height, "cell": cell, "margin": margin, "label": label,
+            "page_columns": page_columns, "page_rows": page_rows, "overlap": overlap, "dpi": dpi,
+            "column_starts": _page_starts(columns, page_columns, overlap),
+            "row_starts": _page_starts(rows, page_rows, overlap)}
+
+
+def render_print_page(palette: np.ndarray, index_map: np.ndarray, layout: dict[str, Any], row_start: int,
+                      column_start: int, colors_distribution: dict[tuple[int, int, int], int],
+                      overlay_function: Callable = add_raw_grid_and_numbers_to_mosaic,
+                      numbers_size: int | None = None) -> Image:
+    """
+    One page: only the cells of this page are rendered, with row and column numbers of the whole mosaic
+
+    """
+    cell, margin, label = layout["cell"], layout["margin"], layout["label"]
+    cells = index_map[row_start:row_start + layout["page_rows"], column_start:column_start + layout["page_columns"]]
+    rows, columns = cells.shape
+    tile = mosaic_from_index_map(palette, cells, cell, paletted=True)
+    tile = overlay_function(tile, colors_distribution, cell, numbers_size=numbers_size or max(1, cell // 2))
+
+    page = Image.new("L" if tile.mode == "L" else "RGB", (layout["page_width"], layout["page_height"]), "white")
+    left, top = margin + label, margin + label
+    page.paste(tile.convert(page.mode), (left, top))
+
+    draw = ImageDraw.Draw(page)
+    font = get_font(max(6, min(cell, label) // 2))
+    for column in range(columns):
+        draw_centered_text(draw, (left + column * cell + cell / 2, margin + label / 2), str(column_start + column + 1),
+                           "black", font)
+    for row in range(rows):
+        draw_centered_text(draw, (margin + label / 2, top + row * cell + cell / 2), str(row_start + row + 1),
+                           "black", font)
+
+    overlap_color = OVERLAP_LINE_COLOR[0] if page.mode == "L" else OVERLAP_LINE_COLOR
+    line_width = max(1, cell // 8)
+    if column_start > 0 and layout["overlap"] > 0:
+        x = left + layout["overlap"] * cell
+        draw.line((x, top - label, x, top + rows * cell), fill=overlap_color, width=line_width)
+    if row_start > 0 and layout["overlap"] > 0:
+        y = top + layout["overlap"] * cell
+        draw.line((left - label, y, left + columns * cell, y), fill=overlap_color, width=line_width)
+
+    page_number = (layout["row_starts"].index(row_start) * len(layout["column_starts"])
+                   + layout["column_starts"].index(column_start) + 1)
+    pages_count = len(layout["row_starts"]) * len(layout["column_starts"])
+    draw.text((margin, margin / 2), f"{page_number} / {pages_count}: строки {row_start + 1}-{row_start + rows}, "
+                                    f"столбцы {column_start + 1}-{column_start + columns}",
+              fill="black", font=get_font(max(6, margin // 3)), anchor="lm")
+    return page
+
+
+def save_print_pages(file_name: str, palette: np.ndarray, index_map: np.ndarray, page_size: str = "A4",
+                     landscape: bool = False, cell_size: float = DEFAULT_CELL_SIZE, margin: float = DEFAULT_MARGIN,
+                     overlap: int = DEFAULT_OVERLAP, overlay_function: Callable = add_raw_grid_and_numbers_to_mosaic,
+                     numbers_size: int | None = None, dpi: int = DEFAULT_DPI, workers: int | None = None,
+                     progress: ProgressCallback | None = None) -> list[str]:
+    """
+    Saving the mosaic split into printable pages as a multi-page PDF (.pdf) or a set of PNG files
+
+    Pages are rendered independently in parallel, the full image is never built. PNG pages are named
+    <name>_<row>_<column>.png, PDF pages are appended to the file in order as soon as they are ready,
+    the list of written files is returned
+
+    """
+    layout = print_layout(index_map.shape[1], index_map.shape[0], page_size, landscape, cell_size, margin, overlap,
+                          dpi)
+    colors_distribution = colors_distribution_from_index_map(palette, index_map)
+    starts = [(row_start, column_start) for row_start in layout["row_starts"]
+              for column_start in layout["column_starts"]]
+    workers = workers or os.cpu_count() or 1
+    name, extension = os.path.splitext(file_name)
+    pdf = extension.lower() == ".pdf"
+
+    def render(row_start: int, column_start: int) -> Image:
+        return render_print_page(palette, index_map, layout, row_start, column_start, colors_distribution,
+                                 overlay_function, numbers_size)
+
+    def save_page(row_start: int, column_start: int, page_file_name: str) -> None:
+        with open(page_file_name, "wb") as file:
+            file.write(encode_png(render(row_start, column_start), workers=1))
+
+    file_names = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        if pdf:
+            # в памяти одновременно не больше 2 * workers листов
+            for window_start in range(0, len(starts), 2 * workers):
+                window = starts[window_start:window_start + 2 * workers]
+                for (number, page) in enumerate(executor.map(lambda start: render(*start), window)):
+                    page.save(file_name, "PDF", resolution=dpi, append=window_start + number > 0)
+                    if progress is not None:
+                        progress(window_start + number + 1, len(starts))
+            file_names.append(file_name)
+        else:
+            for (row_start, column_start) in starts:
+                file_names.append(f"{name}_{layout['row_starts'].index(row_start) + 1}_"
+                                  f"{layout['column_starts'].index(column_start) + 1}.png")
+            futures = [executor.submit(save_page, row_start, column_start, page_file_name)
+                       for ((row_start, column_start), page_file_name) in zip(starts, file_names)]
+            for (number, future) in enumerate(futures):
+                future.result()
+                if progress is not None:
+                    progress(number + 1, len(futures))
+    return file_names
@@ -0,0 +1,52 @@
+import math
+from dataclasses import replace
+
+from memory_budget import fitting_multiplier
+from pipeline import MosaicSpec
+
+# наименьший размер номеров на экране (в пикселях экрана), при котором их можно прочитать
+LEGIBLE_NUMBERS_SIZE = 7
+# наименьший размер ячейки на экране, при котором сетка не закрашивает ячейки целиком
+LEGIBLE_GRID_CELL_SIZE = 4
+
+# наложение без нечитаемых номеров
+_OVERLAY_WITHOUT_NUMBERS = {"add_numbers_to_mosaic": None, "add_grid_and_numbers_to_mosaic": "add_grid_to_mosaic",
+                            "add_raw_grid_and_numbers_to_mosaic": "add_grid_to_mosaic"}
+
+
+def screen_cell_size(width: int, height: int, multiplier: int, viewport_width: int, viewport_height: int,
+                     zoom: float = 1.0) -> float:
+    """
+    Size of a cell on the screen in pixels: the mosaic is fitted into the viewport (but not enlarged), then zoomed
+
+    """
+    return min(viewport_width / width, viewport_height / height, multiplier) * zoom
+
+
+def preview_spec(spec: MosaicSpec, viewport_width: int, viewport_height: int,
+                 zoom: float = 1.0) -> MosaicSpec | None:
+    """
+    Spec of the preview profile: the multiplier is the on-screen cell size (at most the export multiplier
+    and within the memory budget), numbers and grid are dropped if they are not legible on the screen.
+    The export profile is the spec itself, it is returned if the preview is the same;
+    None if even the smallest multiplier does not fit into the memory budget
+
+    """
+    cell_size = screen_cell_size(spec.width, spec.height, spec.multiplier, viewport_width, viewport_height, zoom)
+    overlay = spec.overlay
+    numbers_size = spec.numbers_size
+    if numbers_size is not None and numbers_size * cell_size / spec.multiplier < LEGIBLE_NUMBERS_SIZE:
+        overlay = _OVERLAY_WITHOUT_NUMBERS.get(overlay, overlay)
+        numbers_size = None
+    if overlay == "add_grid_to_mosaic" and cell_size < LEGIBLE_GRID_CELL_SIZE:
+        overlay = None
+
+    multiplier = min(spec.multiplier, max(1, math.ceil(cell_size)))
+    multiplier = fitting_multiplier(spec.width, spec.height, multiplier, overlay is not None)
+    if multiplier == 0:
+        return None
+    if numbers_size is not None:
+        numbers_size = max(1, numbers_size * multiplier // spec.multiplier)
+    if (multiplier, overlay, numbers_size) == (spec.multiplier, spec.overlay, spec.numbers_size):
+        return spec
+    return replace(spec, multiplier=multiplier, overlay=overlay, numbers_size=numbers_size)
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# модули программы лежат плоско в Program и импортируются по имени
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
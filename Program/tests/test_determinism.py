@@ -0,0 +1,32 @@
+import numpy as np
+
+from determinism import canonical_palette_order, mosaic_fingerprint
+
+
+def test_fingerprint_does_not_depend_on_palette_order() -> None:
+    rng = np.random.default_rng(0)
+    palette = rng.integers(0, 256, (6, 3), dtype=np.uint8)
+    index_map = rng.integers(0, 6, (16, 24), dtype=np.uint8)
+    permutation = rng.permutation(6)
+    # цвет palette[i] переезжает на место permutation[i], карта индексов перенумеровывается так же
+    permuted_palette = np.empty_like(palette)
+    permuted_palette[permutation] = palette
+    permuted_index_map = permutation[index_map].astype(np.uint16)
+    assert mosaic_fingerprint(permuted_palette, permuted_index_map) == mosaic_fingerprint(palette, index_map)
+
+
+def test_fingerprint_changes_with_cells() -> None:
+    palette = np.array([[0, 0, 0], [255, 255, 255]], np.uint8)
+    index_map = np.zeros((4, 4), np.uint8)
+    index_map[0, 0] = 1
+    changed = index_map.copy()
+    changed[3, 3] = 1
+    assert mosaic_fingerprint(palette, changed) != mosaic_fingerprint(palette, index_map)
+
+
+def test_canonical_palette_order_drops_unused_colors() -> None:
+    palette = np.array([[10, 10, 10], [20, 20, 20], [30, 30, 30]], np.uint8)
+    index_map = np.array([[2, 2, 0], [2, 0, 2]], np.uint8)
+    ordered_palette, ordered_index_map = canonical_palette_order(palette, index_map)
+    assert ordered_palette.tolist() == [[30, 30, 30], [10, 10, 10]]
+    assert np.array_equal(ordered_palette[ordered_index_map], palette[index_map])
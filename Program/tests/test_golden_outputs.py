@@ -0,0 +1,28 @@
+import json
+import os
+
+import pytest
+
+pytest.importorskip("pyxelate")
+
+from golden_outputs import golden_outputs, compare_outputs
+
+DATA_FOLDER = os.path.join(os.path.dirname(__file__), "data")
+GOLDEN_IMAGE = os.path.join(DATA_FOLDER, "golden_image.png")
+GOLDEN_FILE = os.path.join(DATA_FOLDER, "golden_outputs.json")
+# параметры, с которыми записан эталон:
+# python golden_outputs.py tests/data/golden_image.png tests/data/golden_outputs.json --colors 6 --width 24
+#     --height 16 --functions <функции из эталона>
+GOLDEN_COLORS = 6
+GOLDEN_WIDTH = 24
+GOLDEN_HEIGHT = 16
+# сравнение времени зависит от машины, поэтому включается только явно: MOSAIC_GOLDEN_MAX_SLOWDOWN=1.5
+MAX_SLOWDOWN = os.environ.get("MOSAIC_GOLDEN_MAX_SLOWDOWN")
+
+
+def test_golden_outputs() -> None:
+    with open(GOLDEN_FILE, encoding="utf-8") as file:
+        golden = json.load(file)
+    outputs = golden_outputs(GOLDEN_IMAGE, GOLDEN_COLORS, GOLDEN_WIDTH, GOLDEN_HEIGHT, repeats=1, names=list(golden))
+    max_slowdown = float(MAX_SLOWDOWN) if MAX_SLOWDOWN else None
+    assert compare_outputs(outputs, golden, max_slowdown) == []
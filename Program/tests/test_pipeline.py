@@ -0,0 +1,70 @@
+import os
+from dataclasses import replace
+
+import numpy as np
+import pytest
+from PIL import Image
+
+pytest.importorskip("pyxelate")
+
+from image_processor import COLORING_FUNCTIONS, OVERLAY_FUNCTIONS, get_colors_distribution
+from palette_extractor import dominant_colors
+from pipeline import MosaicSpec, Pipeline
+
+IMAGE_NAME = os.path.join(os.path.dirname(__file__), "data", "golden_image.png")
+
+
+@pytest.fixture
+def image() -> Image:
+    with Image.open(IMAGE_NAME) as image:
+        return image.convert("RGB")
+
+
+def test_spec_is_hashable() -> None:
+    spec = MosaicSpec(24, 16, 4, "create_mosaic_from_image_with_palette_1", [[255, 0, 0], [0, 0, 255]],
+                      stock=[200, 200])
+    same = MosaicSpec(24, 16, 4, "create_mosaic_from_image_with_palette_1", ((255, 0, 0), (0, 0, 255)),
+                      stock=(200, 200))
+    assert spec == same
+    assert hash(spec) == hash(same)
+    assert {spec: 1}[same] == 1
+
+
+def test_equal_specs_hit_the_color_cache(image: Image) -> None:
+    pipeline = Pipeline(image)
+    palette, index_map = pipeline.color(MosaicSpec(24, 16, 4, "create_mosaic_from_image_1", 6))
+    cached_palette, cached_index_map = pipeline.color(MosaicSpec(24, 16, 4, "create_mosaic_from_image_1", 6))
+    assert cached_palette is palette and cached_index_map is index_map
+    assert len(pipeline.colored) == 1
+
+
+def test_multiplier_and_overlay_reuse_the_coloring(image: Image) -> None:
+    pipeline = Pipeline(image)
+    spec = MosaicSpec(24, 16, 4, "create_mosaic_from_image_4", 6)
+    _, index_map = pipeline.color(spec)
+    overlaid = replace(spec, multiplier=10, overlay="add_grid_and_numbers_to_mosaic", numbers_size=8)
+    assert pipeline.color(overlaid)[1] is index_map
+    assert pipeline.render(overlaid).size == (240, 160)
+    assert len(pipeline.colored) == 1
+    # другое количество цветов раскрашивает ячейки заново
+    assert pipeline.color(replace(spec, colors=4))[1] is not index_map
+    assert len(pipeline.colored) == 2
+
+
+@pytest.mark.parametrize("coloring", ["create_mosaic_from_image_1", "create_mosaic_from_image_4",
+                                      "create_mosaic_from_image_5", "create_mosaic_from_image_with_palette_1"])
+@pytest.mark.parametrize("overlay", [None, "add_grid_to_mosaic", "add_numbers_to_mosaic"])
+def test_render_matches_legacy_functions(image: Image, coloring: str, overlay: str | None) -> None:
+    coloring_function = COLORING_FUNCTIONS[coloring]
+    colors = tuple(dominant_colors(image, 6)) if coloring.startswith("create_mosaic_from_image_with_palette") else 6
+    spec = MosaicSpec(24, 16, 5, coloring, colors, overlay, 8 if overlay is not None else None)
+    rendered = np.asarray(Pipeline(image).render(spec).convert("RGB"))
+    # номера на мозаике в режиме "P" рисуются без сглаживания, поэтому с RGB мозаикой совпадают только
+    # мозаики без номеров
+    for paletted in (True, False) if overlay != "add_numbers_to_mosaic" else (True,):
+        # так мозаика строилась до конвейера: функция раскраски, затем наложение по распределению цветов мозаики
+        legacy = coloring_function(image, colors, spec.width, spec.height, spec.multiplier, paletted)
+        if overlay is not None:
+            legacy = OVERLAY_FUNCTIONS[overlay](legacy, get_colors_distribution(legacy, spec.multiplier),
+                                                spec.multiplier, numbers_size=spec.numbers_size)
+        assert np.array_equal(rendered, np.asarray(legacy.convert("RGB")))
@@ -15,11 +15,11 @@ from PySide6.QtGui import (QBrush, QColor, QConicalGradient, QCursor,
     QFont, QFontDatabase, QGradient, QIcon,
     QImage, QKeySequence, QLinearGradient, QPainter,
     QPalette, QPixmap, QRadialGradient, QTransform)
-from PySide6.QtWidgets import (QApplication, QCheckBox, QFrame, QGridLayout,
-    QHBoxLayout, QLabel, QMainWindow, QPlainTextEdit,
-    QPushButton, QRadioButton, QScrollArea, QSizePolicy,
-    QSlider, QSpacerItem, QStackedWidget, QTabWidget,
-    QVBoxLayout, QWidget)
+from PySide6.QtWidgets import (QApplication, QCheckBox, QComboBox, QFrame,
+    QGridLayout, QHBoxLayout, QLabel, QMainWindow,
+    QPlainTextEdit, QPushButton, QRadioButton, QScrollArea,
+    QSizePolicy, QSlider, QSpacerItem, QSpinBox, QStackedWidget,
+    QTabWidget, QVBoxLayout, QWidget)
 
 class Ui_MainWindow(object):
     def setupUi(self, MainWindow):
@@ -298,6 +298,26 @@ class Ui_MainWindow(object):
 
         self.gridLayout_3.addItem(self.verticalSpacer_6, 21, 0, 1, 3)
 
+        self.dithering_layout = QHBoxLayout()
+        self.dithering_layout.setObjectName(u"dithering_layout")
+        self.dithering_label = QLabel(self.mosaic_configurator_scroll_area_widget)
+        self.dithering_label.setObjectName(u"dithering_label")
+
+        self.dithering_layout.addWidget(self.dithering_label)
+
+        self.dithering_combo_box = QComboBox(self.mosaic_configurator_scroll_area_widget)
+        self.dithering_combo_box.addItem("")
+        self.dithering_combo_box.addItem("")
+        self.dithering_combo_box.addItem("")
+        self.dithering_combo_box.addItem("")
+        self.dithering_combo_box.addItem("")
+        self.dithering_combo_box.setObjectName(u"dithering_combo_box")
+
+        self.dithering_layout.addWidget(self.dithering_combo_box)
+
+
+        self.gridLayout_3.addLayout(self.dithering_layout, 22, 0, 1, 3)
+
         self.coloring_method_stacked_widget = QStackedWidget(self.mosaic_configurator_scroll_area_widget)
         self.coloring_method_stacked_widget.setObjectName(u"coloring_method_stacked_widget")
         sizePolicy.setHeightForWidth(self.coloring_method_stacked_widget.sizePolicy().hasHeightForWidth())
@@ -353,9 +373,31 @@ class Ui_MainWindow(object):
 
         self.verticalLayout_3.addWidget(self.third_colors_count_method_radio_button)
 
+        self.fourth_colors_count_method_radio_button = QRadioButton(self.color_numbers_coloring_method_page)
+        self.fourth_colors_count_method_radio_button.setObjectName(u"fourth_colors_count_method_radio_button")
+
+        self.verticalLayout_3.addWidget(self.fourth_colors_count_method_radio_button)
+
+        self.fifth_colors_count_method_radio_button = QRadioButton(self.color_numbers_coloring_method_page)
+        self.fifth_colors_count_method_radio_button.setObjectName(u"fifth_colors_count_method_radio_button")
+
+        self.verticalLayout_3.addWidget(self.fifth_colors_count_method_radio_button)
+
 
         self.gridLayout_2.addLayout(self.verticalLayout_3, 3, 0, 1, 3)
 
+        self.colors_sweep_button = QPushButton(self.color_numbers_coloring_method_page)
+        self.colors_sweep_button.setObjectName(u"colors_sweep_button")
+        self.colors_sweep_button.setEnabled(False)
+
+        self.gridLayout_2.addWidget(self.colors_sweep_button, 4, 0, 1, 3)
+
+        self.auto_colors_button = QPushButton(self.color_numbers_coloring_method_page)
+        self.auto_colors_button.setObjectName(u"auto_colors_button")
+        self.auto_colors_button.setEnabled(False)
+
+        self.gridLayout_2.addWidget(self.auto_colors_button, 5, 0, 1, 3)
+
         self.colors_count_slider = QSlider(self.color_numbers_coloring_method_page)
         self.colors_count_slider.setObjectName(u"colors_count_slider")
         self.colors_count_slider.setMinimum(2)
@@ -448,6 +490,27 @@ class Ui_MainWindow(object):
 
         self.gridLayout_4.addLayout(self.horizontalLayout_2, 1, 0, 1, 1)
 
+        self.extract_palette_button = QPushButton(self.color_palette_coloring_method_page)
+        self.extract_palette_button.setObjectName(u"extract_palette_button")
+
+        self.gridLayout_4.addWidget(self.extract_palette_button, 2, 0, 1, 1)
+
+        self.palette_subset_layout = QHBoxLayout()
+        self.palette_subset_layout.setObjectName(u"palette_subset_layout")
+        self.palette_subset_label = QLabel(self.color_palette_coloring_method_page)
+        self.palette_subset_label.setObjectName(u"palette_subset_label")
+
+        self.palette_subset_layout.addWidget(self.palette_subset_label)
+
+        self.palette_subset_spin_box = QSpinBox(self.color_palette_coloring_method_page)
+        self.palette_subset_spin_box.setObjectName(u"palette_subset_spin_box")
+        self.palette_subset_spin_box.setMaximum(256)
+
+        self.palette_subset_layout.addWidget(self.palette_subset_spin_box)
+
+
+        self.gridLayout_4.addLayout(self.palette_subset_layout, 5, 0, 1, 1)
+
 
         self.verticalLayout_6.addLayout(self.gridLayout_4)
 
@@ -566,9 +629,77 @@ class Ui_MainWindow(object):
 
         self.gridLayout.addWidget(self.save_mosaic_button, 1, 1, 1, 1)
 
+        self.save_mosaic_for_print_button = QPushButton(self.export_configurator_scroll_area_widget)
+        self.save_mosaic_for_print_button.setObjectName(u"save_mosaic_for_print_button")
+        self.save_mosaic_for_print_button.setEnabled(False)
+        sizePolicy1.setHeightForWidth(self.save_mosaic_for_print_button.sizePolicy().hasHeightForWidth())
+        self.save_mosaic_for_print_button.setSizePolicy(sizePolicy1)
+
+        self.gridLayout.addWidget(self.save_mosaic_for_print_button, 4, 1, 1, 1)
+
+        self.save_error_heatmap_button = QPushButton(self.export_configurator_scroll_area_widget)
+        self.save_error_heatmap_button.setObjectName(u"save_error_heatmap_button")
+        self.save_error_heatmap_button.setEnabled(False)
+        sizePolicy1.setHeightForWidth(self.save_error_heatmap_button.sizePolicy().hasHeightForWidth())
+        self.save_error_heatmap_button.setSizePolicy(sizePolicy1)
+
+        self.gridLayout.addWidget(self.save_error_heatmap_button, 5, 1, 1, 1)
+
+        self.threads_layout = QHBoxLayout()
+        self.threads_layout.setObjectName(u"threads_layout")
+        self.threads_label = QLabel(self.export_configurator_scroll_area_widget)
+        self.threads_label.setObjectName(u"threads_label")
+
+        self.threads_layout.addWidget(self.threads_label)
+
+        self.threads_spin_box = QSpinBox(self.export_configurator_scroll_area_widget)
+        self.threads_spin_box.setObjectName(u"threads_spin_box")
+        self.threads_spin_box.setMinimum(1)
+        self.threads_spin_box.setMaximum(64)
+
+        self.threads_layout.addWidget(self.threads_spin_box)
+
+
+        self.gridLayout.addLayout(self.threads_layout, 6, 1, 1, 1)
+
+        self.profiler_layout = QHBoxLayout()
+        self.profiler_layout.setObjectName(u"profiler_layout")
+        self.profiler_label = QLabel(self.export_configurator_scroll_area_widget)
+        self.profiler_label.setObjectName(u"profiler_label")
+
+        self.profiler_layout.addWidget(self.profiler_label)
+
+        self.profiler_combo_box = QComboBox(self.export_configurator_scroll_area_widget)
+        self.profiler_combo_box.addItem("")
+        self.profiler_combo_box.addItem("")
+        self.profiler_combo_box.addItem("")
+        self.profiler_combo_box.setObjectName(u"profiler_combo_box")
+
+        self.profiler_layout.addWidget(self.profiler_combo_box)
+
+
+        self.gridLayout.addLayout(self.profiler_layout, 7, 1, 1, 1)
+
+        self.compress_level_layout = QHBoxLayout()
+        self.compress_level_layout.setObjectName(u"compress_level_layout")
+        self.compress_level_label = QLabel(self.export_configurator_scroll_area_widget)
+        self.compress_level_label.setObjectName(u"compress_level_label")
+
+        self.compress_level_layout.addWidget(self.compress_level_label)
+
+        self.compress_level_spin_box = QSpinBox(self.export_configurator_scroll_area_widget)
+        self.compress_level_spin_box.setObjectName(u"compress_level_spin_box")
+        self.compress_level_spin_box.setMaximum(9)
+        self.compress_level_spin_box.setValue(6)
+
+        self.compress_level_layout.addWidget(self.compress_level_spin_box)
+
+
+        self.gridLayout.addLayout(self.compress_level_layout, 8, 1, 1, 1)
+
         self.verticalSpacer_13 = QSpacerItem(20, 40, QSizePolicy.Minimum, QSizePolicy.Expanding)
 
-        self.gridLayout.addItem(self.verticalSpacer_13, 4, 0, 1, 3)
+        self.gridLayout.addItem(self.verticalSpacer_13, 9, 0, 1, 3)
 
         self.verticalSpacer_12 = QSpacerItem(20, 20, QSizePolicy.Minimum, QSizePolicy.Fixed)
 
@@ -617,6 +748,13 @@ class Ui_MainWindow(object):
         self.colors_count_method_radio_button.setText(QCoreApplication.translate("MainWindow", u"\u041a\u043e\u043b\u0438\u0447\u0435\u0441\u0442\u0432\u043e \u0446\u0432\u0435\u0442\u043e\u0432", None))
         self.color_palette_method_radio_button.setText(QCoreApplication.translate("MainWindow", u"\u0417\u0430\u0434\u0430\u043d\u0438\u0435 \u043f\u0430\u043b\u0438\u0442\u0440\u044b \u0446\u0432\u0435\u0442\u043e\u0432", None))
         self.coloring_method_label.setText(QCoreApplication.translate("MainWindow", u"\u0421\u043f\u043e\u0441\u043e\u0431 \u0440\u0430\u0441\u043a\u0440\u0430\u0441\u043a\u0438", None))
+        self.dithering_label.setText(QCoreApplication.translate("MainWindow", u"\u0414\u0438\u0437\u0435\u0440\u0438\u043d\u0433", None))
+        self.dithering_combo_box.setItemText(0, QCoreApplication.translate("MainWindow", u"\u0411\u0435\u0437 \u0434\u0438\u0437\u0435\u0440\u0438\u043d\u0433\u0430", None))
+        self.dithering_combo_box.setItemText(1, QCoreApplication.translate("MainWindow", u"\u0423\u043f\u043e\u0440\u044f\u0434\u043e\u0447\u0435\u043d\u043d\u044b\u0439 (RGB)", None))
+        self.dithering_combo_box.setItemText(2, QCoreApplication.translate("MainWindow", u"\u0423\u043f\u043e\u0440\u044f\u0434\u043e\u0447\u0435\u043d\u043d\u044b\u0439 (Lab)", None))
+        self.dithering_combo_box.setItemText(3, QCoreApplication.translate("MainWindow", u"\u0424\u043b\u043e\u0439\u0434\u0430-\u0421\u0442\u0435\u0439\u043d\u0431\u0435\u0440\u0433\u0430 (RGB)", None))
+        self.dithering_combo_box.setItemText(4, QCoreApplication.translate("MainWindow", u"\u0424\u043b\u043e\u0439\u0434\u0430-\u0421\u0442\u0435\u0439\u043d\u0431\u0435\u0440\u0433\u0430 (Lab)", None))
+
         self.import_image_button.setText(QCoreApplication.translate("MainWindow", u"\u0418\u043c\u043f\u043e\u0440\u0442 \u0438\u0437\u043e\u0431\u0440\u0430\u0436\u0435\u043d\u0438\u044f", None))
         self.width_label.setText(QCoreApplication.translate("MainWindow", u"\u0428\u0438\u0440\u0438\u043d\u0430 \u043c\u043e\u0437\u0430\u0438\u043a\u0438 (\u043a\u043e\u043b\u0438\u0447\u0435\u0441\u0442\u0432\u043e \u043f\u0438\u043a\u0441\u0435\u043b\u0435\u0439)", None))
         self.width_slider_value_label.setText(QCoreApplication.translate("MainWindow", u"1", None))
@@ -631,12 +769,19 @@ class Ui_MainWindow(object):
         self.first_colors_count_method_radio_button.setText(QCoreApplication.translate("MainWindow", u"\u0421\u043f\u043e\u0441\u043e\u0431 \u21161", None))
         self.second_colors_count_method_radio_button.setText(QCoreApplication.translate("MainWindow", u"\u0421\u043f\u043e\u0441\u043e\u0431 \u21162", None))
         self.third_colors_count_method_radio_button.setText(QCoreApplication.translate("MainWindow", u"\u0421\u043f\u043e\u0441\u043e\u0431 \u21163", None))
+        self.fourth_colors_count_method_radio_button.setText(QCoreApplication.translate("MainWindow", u"\u0421\u043f\u043e\u0441\u043e\u0431 \u21164", None))
+        self.fifth_colors_count_method_radio_button.setText(QCoreApplication.translate("MainWindow", u"\u0421\u043f\u043e\u0441\u043e\u0431 \u21165", None))
+        self.colors_sweep_button.setText(QCoreApplication.translate("MainWindow", u"\u041f\u043e\u0434\u043e\u0431\u0440\u0430\u0442\u044c \u043a\u043e\u043b\u0438\u0447\u0435\u0441\u0442\u0432\u043e \u0446\u0432\u0435\u0442\u043e\u0432", None))
+        self.auto_colors_button.setText(QCoreApplication.translate("MainWindow", u"\u041f\u043e\u0434\u043e\u0431\u0440\u0430\u0442\u044c \u043f\u043e \u0434\u043e\u043f\u0443\u0441\u0442\u0438\u043c\u043e\u0439 \u043e\u0448\u0438\u0431\u043a\u0435", None))
         self.colors_count_value_label.setText(QCoreApplication.translate("MainWindow", u"10", None))
         self.color_palette_methods_label.setText(QCoreApplication.translate("MainWindow", u"\u0421\u043f\u043e\u0441\u043e\u0431 \u0441\u043e\u0437\u0434\u0430\u043d\u0438\u044f \u043c\u043e\u0437\u0430\u0438\u043a\u0438", None))
         self.first_color_palette_method_radio_button.setText(QCoreApplication.translate("MainWindow", u"\u0421\u043f\u043e\u0441\u043e\u0431 \u21161", None))
         self.second_color_palette_method_radio_button.setText(QCoreApplication.translate("MainWindow", u"\u0421\u043f\u043e\u0441\u043e\u0431 \u21162", None))
+        self.extract_palette_button.setText(QCoreApplication.translate("MainWindow", u"\u0426\u0432\u0435\u0442\u0430 \u0438\u0437 \u0438\u0437\u043e\u0431\u0440\u0430\u0436\u0435\u043d\u0438\u044f", None))
+        self.palette_subset_label.setText(QCoreApplication.translate("MainWindow", u"\u0426\u0432\u0435\u0442\u043e\u0432 \u0438\u0437 \u043f\u0430\u043b\u0438\u0442\u0440\u044b (0 - \u0432\u0441\u0435)", None))
         self.colors_palette_label.setText(QCoreApplication.translate("MainWindow", u"\u0412\u0432\u043e\u0434 \u043f\u0430\u043b\u0438\u0442\u0440\u044b \u0446\u0432\u0435\u0442\u043e\u0432 \u0432 \u0444\u043e\u0440\u043c\u0430\u0442\u0435 hex.\n"
-"\u041e\u0434\u043d\u0430 \u0441\u0442\u0440\u043e\u043a\u0430 - \u043e\u0434\u0438\u043d \u0446\u0432\u0435\u0442 \u0432 \u0444\u043e\u0440\u043c\u0430\u0442\u0435 #RRGGBB", None))
+"\u041e\u0434\u043d\u0430 \u0441\u0442\u0440\u043e\u043a\u0430 - \u043e\u0434\u0438\u043d \u0446\u0432\u0435\u0442 \u0432 \u0444\u043e\u0440\u043c\u0430\u0442\u0435 #RRGGBB\n"
+"\u041f\u043e\u0441\u043b\u0435 \u0446\u0432\u0435\u0442\u0430 \u043c\u043e\u0436\u043d\u043e \u0443\u043a\u0430\u0437\u0430\u0442\u044c \u0437\u0430\u043f\u0430\u0441: #RRGGBB 120", None))
         self.colors_palette_edit.setPlainText(QCoreApplication.translate("MainWindow", u"#FFAAAA\n"
 "#FFFFFF\n"
 "#000000\n"
@@ -652,6 +797,14 @@ class Ui_MainWindow(object):
         # self.save_mosaic_mesh_button.setText(QCoreApplication.translate("MainWindow", u"\u0421\u043e\u0445\u0440\u0430\u043d\u0438\u0442\u044c \u0444\u0430\u0439\u043b\u044b \u0441\u0435\u0442\u043a\u0438 \u043c\u043e\u0437\u0430\u0438\u043a\u0438", None))
         self.save_mosaic_palette_button.setText(QCoreApplication.translate("MainWindow", u"\u0421\u043e\u0445\u0440\u0430\u043d\u0438\u0442\u044c \u043f\u0430\u043b\u0438\u0442\u0440\u0443 \u0446\u0432\u0435\u0442\u043e\u0432 \u043c\u043e\u0437\u0430\u0438\u043a\u0438", None))
         self.save_mosaic_button.setText(QCoreApplication.translate("MainWindow", u"\u0421\u043e\u0445\u0440\u0430\u043d\u0438\u0442\u044c \u043c\u043e\u0437\u0430\u0438\u043a\u0443", None))
+        self.save_mosaic_for_print_button.setText(QCoreApplication.translate("MainWindow", u"\u0421\u043e\u0445\u0440\u0430\u043d\u0438\u0442\u044c \u0434\u043b\u044f \u043f\u0435\u0447\u0430\u0442\u0438", None))
+        self.save_error_heatmap_button.setText(QCoreApplication.translate("MainWindow", u"\u0421\u043e\u0445\u0440\u0430\u043d\u0438\u0442\u044c \u043a\u0430\u0440\u0442\u0443 \u043e\u0448\u0438\u0431\u043e\u043a", None))
+        self.threads_label.setText(QCoreApplication.translate("MainWindow", u"\u041f\u043e\u0442\u043e\u043a\u043e\u0432 \u043e\u0431\u0440\u0430\u0431\u043e\u0442\u043a\u0438", None))
+        self.profiler_label.setText(QCoreApplication.translate("MainWindow", u"\u041f\u0440\u043e\u0444\u0438\u043b\u0438\u0440\u043e\u0432\u0430\u043d\u0438\u0435 \u0441\u043e\u0445\u0440\u0430\u043d\u0435\u043d\u0438\u044f", None))
+        self.profiler_combo_box.setItemText(0, QCoreApplication.translate("MainWindow", u"\u0411\u0435\u0437 \u043f\u0440\u043e\u0444\u0438\u043b\u0438\u0440\u043e\u0432\u0430\u043d\u0438\u044f", None))
+        self.profiler_combo_box.setItemText(1, QCoreApplication.translate("MainWindow", u"\u0412\u044b\u0431\u043e\u0440\u043e\u0447\u043d\u043e\u0435", None))
+        self.profiler_combo_box.setItemText(2, QCoreApplication.translate("MainWindow", u"\u0414\u0435\u0442\u0435\u0440\u043c\u0438\u043d\u0438\u0440\u043e\u0432\u0430\u043d\u043d\u043e\u0435", None))
+        self.compress_level_label.setText(QCoreApplication.translate("MainWindow", u"\u0421\u0436\u0430\u0442\u0438\u0435 PNG", None))
         self.configuration_tab_widget.setTabText(self.configuration_tab_widget.indexOf(self.export_configurator), QCoreApplication.translate("MainWindow", u"\u042d\u043a\u0441\u043f\u043e\u0440\u0442", None))
     # retranslateUi
 
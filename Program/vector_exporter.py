@@ -0,0 +1,156 @@
+import os
+import zlib
+from typing import Callable, Iterator, TextIO, BinaryIO
+
+import numpy as np
+
+from cell_grid import CellGrid
+from image_processor import is_light_color, rgb_to_hex, add_grid_to_mosaic, add_numbers_to_mosaic, \
+    add_grid_and_numbers_to_mosaic, add_raw_grid_and_numbers_to_mosaic
+
+# размер ячейки в миллиметрах и размер номера относительно ячейки
+DEFAULT_CELL_SIZE = 8.0
+DEFAULT_NUMBERS_SCALE = 0.5
+# толщина линий сетки относительно ячейки
+GRID_LINE_WIDTH = 0.04
+# ширина цифры шрифта Helvetica в долях кегля (у всех цифр одинаковая) и смещение базовой линии для центрирования
+_DIGIT_WIDTH = 0.556
+_BASELINE_SHIFT = 0.35
+_POINTS_PER_MILLIMETER = 72 / 25.4
+# сколько строк ячеек и прямоугольников одного цвета записывается одним куском
+_ROWS_PER_WRITE = 16
+_RECTANGLES_PER_WRITE = 4096
+
+# наложение -> (ячейки закрашены цветами, сетка, номера)
+VECTOR_OVERLAYS = {None: (True, False, False), add_grid_to_mosaic: (True, True, False),
+                   add_numbers_to_mosaic: (True, False, True), add_grid_and_numbers_to_mosaic: (True, True, True),
+                   add_raw_grid_and_numbers_to_mosaic: (False, True, True)}
+
+
+def _write_svg(file: TextIO, palette: np.ndarray, index_map: np.ndarray, colored: bool, grid: bool, numbers: bool,
+               cell_size: float, numbers_scale: float) -> None:
+    # в координатах SVG ячейка - квадрат 1 x 1, размер в миллиметрах задаётся атрибутами width и height
+    rows, columns = index_map.shape
+    file.write(f'<?xml version="1.0" encoding="UTF-8"?>\n'
+               f'<svg xmlns="http://www.w3.org/2000/svg" width="{columns * cell_size:g}mm" '
+               f'height="{rows * cell_size:g}mm" viewBox="0 0 {columns} {rows}" shape-rendering="crispEdges">\n'
+               f'<rect width="{columns}" height="{rows}" fill="#FFFFFF"/>\n')
+    colors = ["#" + rgb_to_hex(tuple(color)) for color in palette.tolist()]
+    if colored:
+        rectangles = CellGrid(palette, index_map).rectangles.tolist()
+        file.write('<g stroke="none">\n')
+        for start in range(0, len(rectangles), _RECTANGLES_PER_WRITE):
+            file.write("".join(f'<rect x="{x}" y="{y}" width="{width}" height="{height}" fill="{colors[index]}"/>\n'
+                               for (y, x, height, width, index) in rectangles[start:start + _RECTANGLES_PER_WRITE]))
+        file.write('</g>\n')
+    if grid:
+        lines = [f"M0 {y}H{columns}" for y in range(rows + 1)] + [f"M{x} 0V{rows}" for x in range(columns + 1)]
+        file.write(f'<path d="{"".join(lines)}" stroke="#000000" stroke-width="{GRID_LINE_WIDTH}" fill="none"/>\n')
+    if numbers:
+        light = [is_light_color(tuple(color)) for color in palette.tolist()] if colored else [True] * len(palette)
+        for fill in ("#000000", "#FFFFFF"):
+            file.write(f'<g font-family="Arial, Helvetica, sans-serif" font-size="{numbers_scale:g}" '
+                       f'text-anchor="middle" dominant-baseline="central" fill="{fill}">\n')
+            for start in range(0, rows, _ROWS_PER_WRITE):
+                file.write("".join(f'<text x="{x + 0.5}" y="{y + 0.5}">{index + 1}</text>\n'
+                                   for y in range(start, min(start + _ROWS_PER_WRITE, rows))
+                                   for (x, index) in enumerate(index_map[y].tolist())
+                                   if light[index] == (fill == "#000000")))
+            file.write('</g>\n')
+    file.write('</svg>\n')
+
+
+def _pdf_content(palette: np.ndarray, index_map: np.ndarray, colored: bool, grid: bool, numbers: bool,
+                 cell: float, numbers_scale: float) -> Iterator[str]:
+    # части потока содержимого страницы PDF, начало координат PDF - левый нижний угол
+    rows, columns = index_map.shape
+    height = rows * cell
+    colors = [" ".join(f"{channel / 255:.3f}" for channel in color) for color in palette.tolist()]
+    if colored:
+        rectangles = CellGrid(palette, index_map).rectangles.tolist()
+        for start in range(0, len(rectangles), _RECTANGLES_PER_WRITE):
+            yield "".join(f"{colors[index]} rg {x * cell:.2f} {height - (y + rectangle_height) * cell:.2f} "
+                          f"{width * cell:.2f} {rectangle_height * cell:.2f} re f\n"
+                          for (y, x, rectangle_height, width, index)
+                          in rectangles[start:start + _RECTANGLES_PER_WRITE])
+    if grid:
+        yield f"0 G {GRID_LINE_WIDTH * cell:.2f} w\n"
+        yield "".join(f"0 {height - y * cell:.2f} m {columns * cell:.2f} {height - y * cell:.2f} l\n"
+                      for y in range(rows + 1))
+        yield "".join(f"{x * cell:.2f} 0 m {x * cell:.2f} {height:.2f} l\n" for x in range(columns + 1))
+        yield "S\n"
+    if numbers:
+        light = [is_light_color(tuple(color)) for color in palette.tolist()] if colored else [True] * len(palette)
+        size = numbers_scale * cell
+        yield f"BT /F1 {size:.2f} Tf\n"
+        for start in range(0, rows, _ROWS_PER_WRITE):
+            parts = []
+            for y in range(start, min(start + _ROWS_PER_WRITE, rows)):
+                baseline = height - (y + 0.5) * cell - _BASELINE_SHIFT * size
+                for (x, index) in enumerate(index_map[y].tolist()):
+                    text = str(index + 1)
+                    left = (x + 0.5) * cell - len(text) * _DIGIT_WIDTH * size / 2
+                    parts.append(f"{0 if light[index] else 1} g 1 0 0 1 {left:.2f} {baseline:.2f} Tm ({text}) Tj\n")
+            yield "".join(parts)
+        yield "ET\n"
+
+
+def _write_pdf(file: BinaryIO, palette: np.ndarray, index_map: np.ndarray, colored: bool, grid: bool, numbers: bool,
+               cell_size: float, numbers_scale: float) -> None:
+    # одностраничный PDF, поток содержимого сжимается по частям, длина записывается отдельным объектом после него
+    rows, columns = index_map.shape
+    cell = cell_size * _POINTS_PER_MILLIMETER
+    offsets = []
+
+    def begin_object() -> None:
+        offsets.append(file.tell())
+        file.write(f"{len(offsets)} 0 obj\n".encode())
+
+    file.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+    begin_object()
+    file.write(b"<< /Type /Catalog /Pages 2 0 R >>\nendobj\n")
+    begin_object()
+    file.write(b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>\nendobj\n")
+    begin_object()
+    file.write(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {columns * cell:.2f} {rows * cell:.2f}] "
+               f"/Resources << /Font << /F1 4 0 R >> >> /Contents 5 0 R >>\nendobj\n".encode())
+    begin_object()
+    file.write(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>\nendobj\n")
+    begin_object()
+    file.write(b"<< /Length 6 0 R /Filter /FlateDecode >>\nstream\n")
+    compressor = zlib.compressobj()
+    length = 0
+    for part in _pdf_content(palette, index_map, colored, grid, numbers, cell, numbers_scale):
+        compressed = compressor.compress(part.encode("ascii"))
+        file.write(compressed)
+        length += len(compressed)
+    compressed = compressor.flush()
+    file.write(compressed)
+    length += len(compressed)
+    file.write(b"\nendstream\nendobj\n")
+    begin_object()
+    file.write(f"{length}\nendobj\n".encode())
+
+    xref = file.tell()
+    file.write(f"xref\n0 {len(offsets) + 1}\n0000000000 65535 f \n".encode())
+    file.write("".join(f"{offset:010} 00000 n \n" for offset in offsets).encode())
+    file.write(f"trailer\n<< /Size {len(offsets) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode())
+
+
+def save_vector_mosaic(file_name: str, palette: np.ndarray, index_map: np.ndarray,
+                       overlay_function: Callable | None = None, cell_size: float = DEFAULT_CELL_SIZE,
+                       numbers_scale: float = DEFAULT_NUMBERS_SCALE) -> None:
+    """
+    Saving the mosaic as a vector SVG (.svg) or PDF (.pdf) built from the index map of cells
+
+    Cells of one color are merged into rectangles (greedy meshing), the grid is one path, numbers are text,
+    so the file size depends on the number of cells and the print resolution does not depend on the multiplier
+
+    """
+    colored, grid, numbers = VECTOR_OVERLAYS[overlay_function]
+    if os.path.splitext(file_name)[1].lower() == ".pdf":
+        with open(file_name, "wb") as file:
+            _write_pdf(file, palette, index_map, colored, grid, numbers, cell_size, numbers_scale)
+    else:
+        with open(file_name, "w", encoding="utf-8") as file:
+            _write_svg(file, palette, index_map, colored, grid, numbers, cell_size, numbers_scale)